@@ -3,6 +3,10 @@ ASGI config for gudangpd_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The async gateway views (/api/v1/async/...) are meant to be served from
+here, e.g. ``uvicorn gudangpd_api.asgi:application``, while the rest of the
+API keeps running under gunicorn with the WSGI app.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
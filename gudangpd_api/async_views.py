@@ -0,0 +1,42 @@
+"""
+Async DRF views.
+
+DRF runs every handler synchronously, so a view that mostly waits on an
+upstream API holds a worker thread for the whole call. ``AsyncAPIView``
+accepts coroutine handlers: authentication, permission and throttle checks,
+which may query the database, run in a thread through ``sync_to_async``,
+and the handler itself runs on the event loop. Under an ASGI server one
+process can then keep many upstream calls in flight. Under WSGI the same
+views still work; Django runs them with ``async_to_sync``.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """``APIView`` whose handlers (``async def get``, ``async def post``, ...) are coroutines"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
@@ -0,0 +1,154 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for ``list`` and ``retrieve``.
+
+    Validators come from a single count + max(updated_at) aggregate over the
+    requested rows, so an unchanged resource is answered with 304 Not Modified
+    without serializing anything. For a paginated list those are the rows of
+    the requested page, read through the paginator's keyset, so the check
+    costs the same however large the table is. Views that can tell when
+    their data changed return a key from ``get_validators_cache_key`` and
+    have the aggregate cached under it, so repeat checks cost no query.
+    """
+    # Timestamps of related rows that are part of the representation,
+    # e.g. 'variants__updated_at' for products with nested variants
+    conditional_related_fields = ()
+
+    def get_conditional_related_fields(self):
+        return self.conditional_related_fields
+
+    def get_etag_extra(self):
+        """Values that change the representation but are not covered by a timestamp"""
+        return ()
+
+    def get_page_rows(self, request, queryset, annotations):
+        """
+        The validator columns of each row on the requested page, read with
+        the paginator's keyset query, or None when the list is not paginated
+        """
+        paginator = self.paginator
+        if paginator is None:
+            return None
+        get_ordering = getattr(paginator, 'get_ordering', None)
+        ordering = get_ordering(request, queryset, self) if get_ordering else queryset.query.order_by
+        columns = {field.lstrip('-') for field in ordering if isinstance(field, str)}
+        rows = queryset.select_related(None).prefetch_related(None)
+        rows = rows.values('pk', 'updated_at', *columns).annotate(**annotations)
+        return paginator.paginate_queryset(rows, request, view=self)
+
+    def get_validators_cache_key(self, request, detail):
+        """A key that changes whenever the validators may, or None to compute them every time"""
+        parent = getattr(super(), 'get_validators_cache_key', None)
+        return parent(request, detail) if parent else None
+
+    def get_validator_values(self, request, detail):
+        """Return (values, last_modified) of the requested rows, or (None, None) when there are none"""
+        queryset = self.filter_queryset(self.get_queryset())
+        if detail:
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
+        related_fields = self.get_conditional_related_fields()
+        related = {}
+        for i, field in enumerate(related_fields):
+            related[f'related_{i}'] = Max(field)
+            # A deleted related row leaves the max unchanged but not the count
+            relation = field.rsplit('__', 1)[0]
+            related[f'related_count_{i}'] = Count(f'{relation}__pk', distinct=True)
+
+        page = None if detail else self.get_page_rows(request, queryset, related)
+        if page is not None:
+            # Only the page is aggregated, so the check does not grow with the
+            # table; which rows are on it and whether there are neighbouring
+            # pages are part of the representation too
+            values = {
+                'count': len(page),
+                'last_modified': max((row['updated_at'] for row in page), default=None),
+                'pks': [row['pk'] for row in page],
+                'has_next': getattr(self.paginator, 'has_next', None),
+                'has_previous': getattr(self.paginator, 'has_previous', None),
+            }
+            for name in related:
+                found = [row[name] for row in page if row[name] is not None]
+                if name.startswith('related_count_'):
+                    values[name] = sum(found)
+                else:
+                    values[name] = max(found, default=None)
+        else:
+            values = queryset.order_by().aggregate(
+                # Joining related rows repeats the parent rows
+                count=Count('pk', distinct=bool(related_fields)),
+                last_modified=Max('updated_at'),
+                **related
+            )
+        if not values['count']:
+            return None, None
+
+        timestamps = [values['last_modified'], *(values[f'related_{i}'] for i in range(len(related_fields)))]
+        timestamps = [value for value in timestamps if value is not None]
+        return values, max(timestamps) if timestamps else None
+
+    def get_validators(self, request, detail):
+        key = self.get_validators_cache_key(request, detail)
+        cached = cache.get(key) if key is not None else None
+        if cached is None:
+            cached = self.get_validator_values(request, detail)
+            if key is not None:
+                # The key changes with the data, so old entries just age out
+                cache.set(key, cached)
+        values, last_modified = cached
+        if values is None:
+            return None, None
+
+        raw = ':'.join(str(part) for part in [
+            request.user.pk,
+            request.get_full_path(),
+            request.accepted_renderer.format,
+            *values.values(),
+            *self.get_etag_extra(),
+        ])
+        etag = 'W/' + quote_etag(hashlib.md5(raw.encode()).hexdigest())
+        return etag, last_modified
+
+    def is_not_modified(self, request, etag, last_modified):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+            client_etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+            return '*' in client_etags or etag.removeprefix('W/') in client_etags
+
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        if if_modified_since and last_modified:
+            return int(last_modified.timestamp()) <= if_modified_since
+        return False
+
+    def get_conditional_response(self, handler, request, detail, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, detail)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        if self.is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, False, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, True, *args, **kwargs)
@@ -0,0 +1,105 @@
+"""
+Sparse fieldsets and expansion control.
+
+``?fields=id,name`` limits a response to the listed top-level fields and
+``?expand=brand`` swaps a field for the nested representation declared in
+the serializer's ``Meta.expandable_fields``. Viewsets can prune their
+queryset to match, so columns and relations nobody asked for are never
+loaded.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def _param_set(request, name):
+    value = request.query_params.get(name) if request is not None else None
+    if not value:
+        return None
+    return {part.strip() for part in value.split(',') if part.strip()}
+
+
+def requested_fields(request):
+    """The ``?fields=`` set, or None when every field is wanted"""
+    return _param_set(request, 'fields')
+
+
+def requested_expansions(request):
+    return _param_set(request, 'expand') or set()
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin applying ``?fields=`` and ``?expand=`` of the request in
+    the serializer context. Only the top-level serializer of a response to a
+    read is affected; nested serializers always render in full, and writes
+    keep every field so none of the submitted data is dropped.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        for name in requested_expansions(request) & set(expandable):
+            serializer_class, options = expandable[name]
+            self.fields[name] = serializer_class(read_only=True, **options)
+
+        fields = requested_fields(request)
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class SparseQuerysetMixin:
+    """
+    Viewset mixin that prunes read querysets to the serializer fields that
+    survive ``?fields=`` / ``?expand=``: unused columns are deferred with
+    ``only()`` and unused relations are neither joined nor prefetched.
+    """
+    # Columns that are always needed, e.g. the pagination ordering keys
+    sparse_required_fields = ('id',)
+    # Prefetch objects to use instead of a plain prefetch_related(name)
+    sparse_prefetches = {}
+
+    def prune_queryset(self, queryset):
+        if self.request.method != 'GET':
+            return queryset
+        if requested_fields(self.request) is None and not requested_expansions(self.request):
+            return queryset
+
+        model = queryset.model
+        only = set(self.sparse_required_fields)
+        select_related = set()
+        prefetch_related = set()
+        for field in self.get_serializer().fields.values():
+            if field.source == '*':
+                return queryset
+            path = field.source.split('.')
+            try:
+                model_field = model._meta.get_field(path[0])
+            except FieldDoesNotExist:
+                # Computed fields read the instance in ways we cannot see
+                return queryset
+
+            if model_field.one_to_many or model_field.many_to_many:
+                prefetch_related.add(path[0])
+            elif model_field.is_relation and len(path) > 1:
+                select_related.add(path[0])
+                only.add('__'.join(path))
+            elif model_field.is_relation and isinstance(field, serializers.BaseSerializer):
+                select_related.add(path[0])
+                only.add(path[0])
+            else:
+                only.add(path[0])
+
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*[
+                self.sparse_prefetches.get(name, name) for name in prefetch_related
+            ])
+        return queryset.only(*only)
@@ -1,6 +1,8 @@
 from django.db import connection
 from django.http import JsonResponse
 from django.views.decorators.cache import never_cache
+from orders.utils.gateway import gateway_stats
+from products.cache import cache_stats
 
 @never_cache
 def health_check(request):
@@ -24,7 +26,10 @@ def health_check(request):
     data = {
         "status": "healthy" if status == 200 else "unhealthy",
         "components": {
-            "database": db_status
+            "database": db_status,
+            "catalog_cache": cache_stats(),
+            # Counters of this worker process only
+            "gateways": gateway_stats()
         },
         "version": "1.0.0"
     }
@@ -1,6 +1,7 @@
 import time
 import json
 import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.utils import timezone
 
 # Create a logger
@@ -9,14 +10,22 @@ logger = logging.getLogger('api_request')
 class APIRequestLogMiddleware:
     """
     Middleware to log all API requests for security auditing.
+    Works in both sync and async (ASGI) request chains.
     """
+    sync_capable = True
+    async_capable = True
     
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
         # Skip logging for static files
-        if request.path.startswith('/static/') or request.path.startswith('/media/'):
+        if self._is_static(request):
             return self.get_response(request)
         
         # Mark start time
@@ -25,9 +34,23 @@ class APIRequestLogMiddleware:
         # Process request
         response = self.get_response(request)
         
-        # Calculate time taken
-        duration = time.time() - start_time
+        self._log(request, response, time.time() - start_time)
+        return response
+    
+    async def __acall__(self, request):
+        if self._is_static(request):
+            return await self.get_response(request)
         
+        start_time = time.time()
+        response = await self.get_response(request)
+        # Reading request.user may load the session's user from the database
+        await sync_to_async(self._log)(request, response, time.time() - start_time)
+        return response
+    
+    def _is_static(self, request):
+        return request.path.startswith('/static/') or request.path.startswith('/media/')
+    
+    def _log(self, request, response, duration):
         # Extract request info
         request_data = {
             'path': request.path,
@@ -42,8 +65,6 @@ class APIRequestLogMiddleware:
         
         # Log request
         logger.info(json.dumps(request_data))
-        
-        return response
     
     def _get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -0,0 +1,110 @@
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, _reverse_ordering
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor (keyset) pagination used by every list endpoint.
+    Pages are fetched with a WHERE on an indexed key instead of OFFSET,
+    so the cost of a page does not grow with how deep the client pages.
+
+    DRF's cursor only holds the first ordering column and steps over ties
+    with an offset, which drops or repeats rows when paging back across
+    equal values. Here the cursor holds every ordering column, so as long
+    as the ordering ends on a unique column each position is unique.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 100)
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=cursor.reverse, position=position)
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            values.append(str(value))
+        return json.dumps(values)
+
+    def get_keyset_filter(self, ordering, position):
+        """Rows strictly after ``position`` in ``ordering``, led by a range on the first column"""
+        field, rest = ordering[0], ordering[1:]
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        after = Q(**{f"{name}__{'lt' if descending else 'gt'}": position[0]})
+        if not rest:
+            return after
+        bound = Q(**{f"{name}__{'lte' if descending else 'gte'}": position[0]})
+        return bound & (after | Q(**{name: position[0]}) & self.get_keyset_filter(rest, position[1:]))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+        if position is not None and len(position) != len(self.ordering):
+            # A cursor from a differently ordered listing
+            raise NotFound(self.invalid_cursor_message)
+
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, position))
+
+        # One extra row tells whether there is a page beyond this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        else:
+            position = json.dumps(self.cursor.position)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        else:
+            position = json.dumps(self.cursor.position)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+
+class OrderKeysetPagination(KeysetPagination):
+    """Newest orders first, keyed on the (created_at, id) index"""
+    ordering = ('-created_at', '-id')
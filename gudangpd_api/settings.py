@@ -49,6 +49,35 @@ DATABASES = {
     }
 }
 
+# Cache
+# Catalog response caching relies on version counters shared by every worker,
+# so production should point this at a shared backend such as Redis
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='gudangpd-api'),
+    }
+}
+
+# Seconds a cached catalog response is kept; writes invalidate it earlier
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=600, cast=int)
+
+# Per-worker brand/category cache: seconds an entry lives, and how often the
+# shared version counters are checked for writes made by other workers
+CATALOG_DIMENSION_TTL = config('CATALOG_DIMENSION_TTL', default=300, cast=int)
+CATALOG_DIMENSION_CHECK_SECONDS = config('CATALOG_DIMENSION_CHECK_SECONDS', default=1, cast=int)
+
+# Upper bounds of the price buckets reported by /api/v1/products/facets/
+CATALOG_PRICE_BUCKETS = [50000, 100000, 250000, 500000]
+
+# Products read per query by the streaming catalog export
+CATALOG_EXPORT_CHUNK_SIZE = config('CATALOG_EXPORT_CHUNK_SIZE', default=500, cast=int)
+
+# Change feed: days a change is kept, and seconds a change must age before it
+# is served so that concurrent commits cannot slip in behind a client's cursor
+CATALOG_CHANGES_RETENTION_DAYS = config('CATALOG_CHANGES_RETENTION_DAYS', default=30, cast=int)
+CATALOG_CHANGES_SETTLE_SECONDS = config('CATALOG_CHANGES_SETTLE_SECONDS', default=1, cast=int)
+
 # Installed apps
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -158,6 +187,28 @@ AUTH_USER_MODEL = 'users.User'
 RAJAONGKIR_API_KEY = config('RAJAONGKIR_API_KEY')
 RAJAONGKIR_PACKAGE = config('RAJAONGKIR_PACKAGE')
 
+# Shipping quote cache: rates are stored per weight bucket of this many grams,
+# served as fresh for SHIPPING_QUOTE_TTL seconds and, while being refreshed in
+# the background, as stale for up to SHIPPING_QUOTE_MAX_STALE seconds
+SHIPPING_WEIGHT_BUCKET_GRAMS = config('SHIPPING_WEIGHT_BUCKET_GRAMS', default=1000, cast=int)
+SHIPPING_QUOTE_TTL = config('SHIPPING_QUOTE_TTL', default=21600, cast=int)
+SHIPPING_QUOTE_MAX_STALE = config('SHIPPING_QUOTE_MAX_STALE', default=86400, cast=int)
+# Threads per worker refreshing stale rates, and seconds to remember that a
+# courier has no service on a route
+SHIPPING_REFRESH_WORKERS = config('SHIPPING_REFRESH_WORKERS', default=2, cast=int)
+SHIPPING_EMPTY_QUOTE_TTL = config('SHIPPING_EMPTY_QUOTE_TTL', default=600, cast=int)
+
+# Multi-courier quotes: seconds to wait for RajaOngkir before answering with
+# the couriers that responded, and threads per worker making those calls
+SHIPPING_QUOTE_DEADLINE = config('SHIPPING_QUOTE_DEADLINE', default=5, cast=float)
+SHIPPING_QUOTE_WORKERS = config('SHIPPING_QUOTE_WORKERS', default=8, cast=int)
+
+# Identical concurrent RajaOngkir calls are made once per worker. With
+# SINGLEFLIGHT_ACROSS_WORKERS (needs a shared cache) once across workers,
+# the others waiting up to SINGLEFLIGHT_WAIT seconds for the result
+SINGLEFLIGHT_ACROSS_WORKERS = config('SINGLEFLIGHT_ACROSS_WORKERS', default=False, cast=bool)
+SINGLEFLIGHT_WAIT = config('SINGLEFLIGHT_WAIT', default=15, cast=float)
+
 # Midtrans API settings (Sandbox)
 import os
 MIDTRANS_SERVER_KEY = os.environ.get('MIDTRANS_PROD_SERVER_KEY')
@@ -169,6 +220,24 @@ MIDTRANS_ENV = os.environ.get('MIDTRANS_PROD_ENV', default='production')
 # MIDTRANS_CLIENT_KEY = config('MIDTRANS_PROD_CLIENT_KEY')
 # MIDTRANS_ENV = config('MIDTRANS_PROD_ENV_', default='production')
 
+# Outbound calls to RajaOngkir and Midtrans (orders.utils.gateway): read
+# timeouts per upstream, shared connect timeout, retries with jittered
+# backoff (seconds), and the circuit breaker that stops calling an upstream
+# for a while after repeated failures
+RAJAONGKIR_TIMEOUT = config('RAJAONGKIR_TIMEOUT', default=10, cast=float)
+MIDTRANS_TIMEOUT = config('MIDTRANS_TIMEOUT', default=15, cast=float)
+GATEWAY_CONNECT_TIMEOUT = config('GATEWAY_CONNECT_TIMEOUT', default=3, cast=float)
+GATEWAY_MAX_RETRIES = config('GATEWAY_MAX_RETRIES', default=2, cast=int)
+GATEWAY_RETRY_BACKOFF = config('GATEWAY_RETRY_BACKOFF', default=0.2, cast=float)
+GATEWAY_BREAKER_THRESHOLD = config('GATEWAY_BREAKER_THRESHOLD', default=5, cast=int)
+GATEWAY_BREAKER_RESET_SECONDS = config('GATEWAY_BREAKER_RESET_SECONDS', default=30, cast=int)
+GATEWAY_POOL_SIZE = config('GATEWAY_POOL_SIZE', default=10, cast=int)
+
+# Stock reservations
+# Unpaid orders hold their stock for this long before the sweeper
+# (manage.py release_expired_reservations) hands it back
+STOCK_RESERVATION_TTL_MINUTES = config('STOCK_RESERVATION_TTL_MINUTES', default=60, cast=int)
+
 # API keys exempt URL
 API_KEY_EXEMPT_URLS = [
     '/admin/',
@@ -259,8 +328,13 @@ REST_FRAMEWORK = {
         'anon': '100/day',
         'user': '1000/day',
     },
+    'DEFAULT_PAGINATION_CLASS': 'gudangpd_api.pagination.KeysetPagination',
+    'PAGE_SIZE': config('API_PAGE_SIZE', default=20, cast=int),
 }
 
+# Upper bound for the ?page_size= query parameter on list endpoints
+API_MAX_PAGE_SIZE = config('API_MAX_PAGE_SIZE', default=100, cast=int)
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = DEBUG
 CORS_ALLOWED_ORIGINS = [
@@ -0,0 +1,173 @@
+"""
+Fast read path for list endpoints.
+
+Building a page through ``ModelSerializer`` instantiates a model per row and
+walks every field's ``get_attribute`` / ``to_representation``. For
+serializers made of plain model columns, forward-relation lookups and nested
+``many=True`` model serializers, ``compile_serializer`` instead builds a
+``RowMapper`` once per request that reads ``values()`` rows and formats
+them with the serializer's own field converters, so the output is identical
+to the serializer's. Anything it cannot prove equivalent (method fields,
+``source='*'``, properties, nested single objects, ...) makes it return
+None and the caller falls back to the serializer.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import fields, relations, serializers
+from rest_framework.response import Response
+
+# Fields whose to_representation() returns database values unchanged
+_PASSTHROUGH = (fields.IntegerField, fields.CharField, relations.PrimaryKeyRelatedField)
+
+
+def _column(model, source_attrs):
+    """
+    Resolve a serializer source to a values() lookup and the lookups of the
+    relations it crosses, or None when it is not a plain model column
+    """
+    guards = []
+    for i, attr in enumerate(source_attrs):
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        last = i == len(source_attrs) - 1
+        if model_field.is_relation:
+            if not (model_field.many_to_one or model_field.one_to_one) or not model_field.concrete:
+                return None
+            if not last:
+                guards.append('__'.join(source_attrs[:i + 1]))
+                model = model_field.related_model
+        elif not last:
+            return None
+    return '__'.join(source_attrs), guards
+
+
+class RowMapper:
+
+    def __init__(self, model):
+        self.model = model
+        self.columns = {'pk'}
+        # (name, column, convert, guards, missing) in serializer field order
+        self.fields = []
+        # name -> (related model, parent lookup, child mapper)
+        self.nested = {}
+
+    def values(self, queryset, extra=()):
+        """The values() queryset to read, with ``extra`` columns (e.g. ordering keys)"""
+        columns = self.columns | {name for name in extra if name}
+        return queryset.select_related(None).prefetch_related(None).values(*columns)
+
+    def load_nested(self, rows):
+        children = {}
+        parent_ids = [row['pk'] for row in rows]
+        for name, (related_model, parent_lookup, mapper) in self.nested.items():
+            groups = {pk: [] for pk in parent_ids}
+            if parent_ids:
+                queryset = related_model._default_manager.filter(**{f'{parent_lookup}__in': parent_ids})
+                queryset = mapper.values(queryset, extra=(parent_lookup,)).order_by(parent_lookup, 'pk')
+                child_rows = list(queryset)
+                for row, data in zip(child_rows, mapper.map_rows(child_rows)):
+                    groups[row[parent_lookup]].append(data)
+            children[name] = groups
+        return children
+
+    def map_rows(self, rows):
+        """Return the serialized form of ``rows``, a list of values() dicts"""
+        rows = list(rows)
+        children = self.load_nested(rows) if self.nested else {}
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert, guards, missing in self.fields:
+                if column is None:
+                    item[name] = children[name][row['pk']]
+                    continue
+                if guards and any(row[guard] is None for guard in guards):
+                    # The serializer cannot reach past an empty relation
+                    if missing == 'skip':
+                        continue
+                    item[name] = None
+                    continue
+                value = row[column]
+                item[name] = value if value is None or convert is None else convert(value)
+            data.append(item)
+        return data
+
+
+def compile_serializer(serializer):
+    """Build a ``RowMapper`` for a model serializer instance, or None if it is unsupported"""
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    if not isinstance(serializer, serializers.ModelSerializer):
+        return None
+
+    model = serializer.Meta.model
+    mapper = RowMapper(model)
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source == '*':
+            return None
+
+        if isinstance(field, serializers.ListSerializer):
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                return None
+            child = compile_serializer(field.child)
+            if not model_field.one_to_many or child is None or child.model is not model_field.related_model:
+                return None
+            mapper.nested[name] = (model_field.related_model, model_field.field.name, child)
+            mapper.fields.append((name, None, None, (), None))
+            continue
+        if isinstance(field, (serializers.BaseSerializer, relations.ManyRelatedField)):
+            return None
+        if isinstance(field, relations.RelatedField) and (
+            not isinstance(field, relations.PrimaryKeyRelatedField) or field.pk_field is not None
+        ):
+            return None
+
+        resolved = _column(model, field.source_attrs)
+        if resolved is None:
+            return None
+        column, guards = resolved
+        missing = None
+        if guards:
+            # Mirror Field.get_attribute() on an AttributeError
+            if field.default is not fields.empty:
+                return None
+            if not field.allow_null:
+                if field.required:
+                    return None
+                missing = 'skip'
+
+        convert = None if type(field) in _PASSTHROUGH else field.to_representation
+        mapper.columns.add(column)
+        mapper.columns.update(guards)
+        mapper.fields.append((name, column, convert, tuple(guards), missing))
+    return mapper
+
+
+class ValuesListMixin:
+    """
+    Viewset mixin serving ``list`` from ``values()`` rows whenever the list
+    serializer can be compiled into a ``RowMapper``.
+    """
+
+    def get_ordering_columns(self, queryset):
+        get_ordering = getattr(self.paginator, 'get_ordering', None)
+        ordering = get_ordering(self.request, queryset, self) if get_ordering else queryset.query.order_by
+        return [field.lstrip('-') for field in ordering if isinstance(field, str)]
+
+    def list(self, request, *args, **kwargs):
+        mapper = compile_serializer(self.get_serializer())
+        if mapper is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        # Cursor pagination reads its position from the ordering columns
+        rows = mapper.values(queryset, extra=self.get_ordering_columns(queryset))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(mapper.map_rows(page))
+        return Response(mapper.map_rows(rows))
@@ -18,9 +18,14 @@ class APIDocsHomeView(TemplateView):
                 'endpoints': [
                     {'path': '/api/v1/products/', 'method': 'GET, POST', 'description': 'List and create products'},
                     {'path': '/api/v1/products/{id}/', 'method': 'GET, PUT, DELETE', 'description': 'Retrieve, update or delete a product'},
+                    {'path': '/api/v1/products/facets/', 'method': 'GET', 'description': 'List products with brand, category, price and availability counts'},
                     {'path': '/api/v1/categories/', 'method': 'GET, POST', 'description': 'List and create categories'},
                     {'path': '/api/v1/brands/', 'method': 'GET, POST', 'description': 'List and create brands'},
                     {'path': '/api/v1/product-variants/', 'method': 'GET, POST', 'description': 'List and create product variants'},
+                    {'path': '/api/v1/product-variants/lookup/', 'method': 'POST', 'description': 'Look up variants, their stock and prices by a list of SKUs'},
+                    {'path': '/api/v1/catalog/import/', 'method': 'POST', 'description': 'Bulk import products and variants from CSV or NDJSON (staff only)'},
+                    {'path': '/api/v1/catalog/export/', 'method': 'GET', 'description': 'Stream the whole catalog as NDJSON or CSV (?format=csv), resumable with ?after=<product id> (sellers and staff)'},
+                    {'path': '/api/v1/catalog/changes/', 'method': 'GET', 'description': 'Catalog changes since ?since=<cursor>, including deletions, for incremental sync'},
                 ]
             },
             {
@@ -38,11 +43,14 @@ class APIDocsHomeView(TemplateView):
                 'name': 'Orders API',
                 'description': 'Process orders, shipping, and payments',
                 'endpoints': [
-                    {'path': '/api/v1/orders/', 'method': 'GET, POST', 'description': 'List and create orders'},
+                    {'path': '/api/v1/orders/', 'method': 'GET, POST', 'description': 'List (filter with ?status=) and create orders'},
+                    {'path': '/api/v1/orders/history/', 'method': 'GET', 'description': 'Order history with the items of each order'},
                     {'path': '/api/v1/orders/{id}/', 'method': 'GET', 'description': 'Retrieve order details'},
                     {'path': '/api/v1/orders/{id}/cancel/', 'method': 'POST', 'description': 'Cancel an order'},
-                    {'path': '/api/v1/calculate-shipping/', 'method': 'POST', 'description': 'Calculate shipping cost'},
+                    {'path': '/api/v1/calculate-shipping/', 'method': 'POST', 'description': 'Calculate shipping cost for one courier, or several at once with couriers'},
                     {'path': '/api/v1/orders/{id}/create-payment/', 'method': 'POST', 'description': 'Create payment for order'},
+                    {'path': '/api/v1/async/calculate-shipping/', 'method': 'POST', 'description': 'Calculate shipping cost (async, served under ASGI)'},
+                    {'path': '/api/v1/async/orders/{id}/create-payment/', 'method': 'POST', 'description': 'Create payment for order (async, served under ASGI)'},
                 ]
             }
         ]
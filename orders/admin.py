@@ -1,14 +1,17 @@
 from django.contrib import admin
-from .models import Order, OrderItem, ShippingRate, PaymentTransaction
+from .models import Order, OrderItem, ShippingRate, PaymentTransaction, StockReservation
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
     readonly_fields = ('product_name', 'variant_name', 'price', 'discount_price', 'subtotal')
+    # A select would load and render every variant in the catalog for each row
+    raw_id_fields = ('product_variant',)
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'status', 'final_price', 'created_at', 'paid_at')
+    list_select_related = ('user',)
     list_filter = ('status', 'created_at', 'paid_at')
     search_fields = ('user_email', 'shipping_name', 'shipping_phone')
     readonly_fields = ('total_price', 'final_price', 'created_at', 'updated_at', 'paid_at', 'shipped_at', 'delivered_at')
@@ -32,18 +35,28 @@ class OrderAdmin(admin.ModelAdmin):
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ('id', 'order', 'product_name', 'variant_name', 'price', 'quantity', 'subtotal')
+    list_select_related = ('order__user',)
     search_fields = ('product_name', 'variant_name')
     readonly_fields = ('subtotal',)
 
 @admin.register(ShippingRate)
 class ShippingRateAdmin(admin.ModelAdmin):
-    list_display = ('origin_city', 'destination_city', 'courier', 'service', 'cost', 'estimated_days')
-    list_filter = ('courier', 'created_at')
+    list_display = ('origin_city', 'destination_city', 'weight_bucket', 'courier', 'service', 'cost', 'estimated_days', 'fetched_at')
+    list_filter = ('courier', 'fetched_at')
     search_fields = ('origin_city', 'destination_city')
 
 @admin.register(PaymentTransaction)
 class PaymentTransactionAdmin(admin.ModelAdmin):
     list_display = ('order', 'transaction_id', 'payment_type', 'amount', 'status', 'transaction_time')
+    list_select_related = ('order__user',)
     list_filter = ('status', 'payment_type', 'transaction_time')
     search_fields = ('order__id', 'transaction_id')
-    readonly_fields = ('transaction_id', 'transaction_time', 'created_at', 'updated_at', 'raw_response')
\ No newline at end of file
+    readonly_fields = ('transaction_id', 'transaction_time', 'created_at', 'updated_at', 'raw_response')
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'product_variant', 'quantity', 'status', 'expires_at', 'released_at')
+    list_select_related = ('order__user', 'product_variant__product')
+    list_filter = ('status',)
+    search_fields = ('order__id',)
+    readonly_fields = ('created_at', 'released_at')
\ No newline at end of file
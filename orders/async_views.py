@@ -0,0 +1,128 @@
+"""
+Async versions of the order views that spend their time waiting on
+RajaOngkir or Midtrans. They answer exactly like their counterparts in
+``orders.views`` and are meant to be served by an ASGI server
+(``gudangpd_api.asgi``) next to the WSGI app.
+"""
+import logging
+import uuid
+
+import requests
+from django.conf import settings
+from django.http import Http404
+from django.utils import timezone
+from rest_framework import generics, permissions, status
+from rest_framework.response import Response
+
+from gudangpd_api.async_views import AsyncAPIView
+from .models import Order, PaymentTransaction
+from .serializers import ShippingCostRequestSerializer
+from .utils import gateway, midtrans, shipping
+
+
+class AsyncCalculateShippingView(AsyncAPIView, generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = ShippingCostRequestSerializer
+
+    async def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if not getattr(settings, 'RAJAONGKIR_API_KEY', None):
+            return Response(
+                {"detail": "RajaOngkir API key not configured"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        route = (
+            serializer.validated_data['origin_city'],
+            serializer.validated_data['destination_city'],
+            serializer.validated_data['weight'],
+        )
+        couriers = serializer.validated_data.get('couriers')
+        if couriers:
+            quote = await shipping.aget_quotes(*route, couriers)
+            if not quote['data'] and quote['unavailable']:
+                return Response(
+                    {"detail": "No courier could be quoted", "unavailable": quote['unavailable']},
+                    status=status.HTTP_502_BAD_GATEWAY
+                )
+            return Response(quote)
+
+        try:
+            quote = await shipping.aget_quote(*route, serializer.validated_data['courier'])
+        except shipping.ShippingQuoteError as e:
+            return Response(
+                {"detail": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        return Response(quote)
+
+
+class AsyncCreatePaymentView(AsyncAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    async def post(self, request, order_id):
+        order = await Order.objects.select_related('user').filter(id=order_id, user=request.user).afirst()
+        if order is None:
+            raise Http404
+
+        if order.status != 'pending':
+            return Response(
+                {"detail": f"Cannot process payment for order with status: {order.status}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        server_key = getattr(settings, 'MIDTRANS_SERVER_KEY', '').strip()
+        if not server_key:
+            return Response(
+                {"detail": "Midtrans API key not configured"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        transaction_id = f"{order.id}-{uuid.uuid4().hex[:8]}"
+        items = [item async for item in order.items.all()]
+        payload = midtrans.snap_payload(order, items, transaction_id)
+
+        try:
+            response = await gateway.midtrans.apost(
+                midtrans.snap_url(), headers=midtrans.snap_headers(server_key), json=payload
+            )
+            result = response.json()
+
+            if response.status_code != 201 or "token" not in result:
+                logging.error(f"Midtrans error response: {result}")
+                return Response(
+                    {"detail": result.get("status_message", "Midtrans API error")},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            await PaymentTransaction.objects.acreate(
+                order=order,
+                transaction_id=transaction_id,
+                payment_type="Midtrans",
+                amount=order.final_price,
+                status="pending",
+                transaction_time=timezone.now(),
+                transaction_status="pending",
+                raw_response=result
+            )
+
+            return Response({
+                "token": result["token"],
+                "redirect_url": result["redirect_url"]
+            })
+
+        except requests.exceptions.RequestException as e:
+            logging.exception("Error connecting to Midtrans API")
+            return Response(
+                {"detail": f"Connection error: {e}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        except Exception as e:
+            logging.exception("Unexpected error during payment processing")
+            return Response(
+                {"detail": f"Unexpected error: {e}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
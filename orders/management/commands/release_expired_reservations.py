@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from orders.utils.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = "Release stock held by expired reservations of unpaid orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of reservations released per UPDATE")
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservation(s)"))
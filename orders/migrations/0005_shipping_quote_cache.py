@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_access_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='shippingrate',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='courier_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='fetched_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='weight_bucket',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterUniqueTogether(
+            name='shippingrate',
+            unique_together={('origin_city', 'destination_city', 'weight_bucket', 'courier', 'service')},
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import Sum
 from django.conf import settings
+from django.utils import timezone
 from products.models import ProductVariant
 
 class Order(models.Model):
@@ -41,23 +43,42 @@ class Order(models.Model):
     shipped_at = models.DateTimeField(null=True, blank=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
     
+    class Meta:
+        indexes = [
+            # Keyset pagination of order lists
+            models.Index(fields=['created_at', 'id']),
+            # A customer's order history, newest first
+            models.Index(fields=['user', 'created_at', 'id']),
+            # Staff order lists filtered by status
+            models.Index(fields=['status', 'created_at', 'id']),
+            # Admin filter on payment date
+            models.Index(fields=['paid_at']),
+        ]
+    
+    # Fields final_price is derived from
+    PRICE_FIELDS = {'total_price', 'shipping_cost', 'discount'}
+    
     def calculate_total_price(self):
-        """Calculate the total price of the order"""
-        self.total_price = sum(item.subtotal for item in self.items.all())
+        """Calculate the total price of the order from its items with one aggregate query"""
+        self.total_price = self.items.aggregate(total=Sum('subtotal'))['total'] or 0
         self.final_price = self.total_price + self.shipping_cost - self.discount
         return self.final_price
     
+    def update_totals(self):
+        """Recalculate and store the totals after the items changed"""
+        self.calculate_total_price()
+        self.save(update_fields=['total_price', 'updated_at'])
+    
     def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        
-        if is_new:
-            super().save(*args, **kwargs)
-            self.calculate_total_price()
-            kwargs.pop('force_insert', None)
-            return super().save(*args, **kwargs)
-        else:
-            self.calculate_total_price()
-            return super().save(*args, **kwargs)
+        # total_price is kept current by whoever changes the items (see update_totals),
+        # so a save never has to read them; only final_price is derived here
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.final_price = self.total_price + self.shipping_cost - self.discount
+        elif self.PRICE_FIELDS & set(update_fields):
+            self.final_price = self.total_price + self.shipping_cost - self.discount
+            kwargs['update_fields'] = {*update_fields, 'final_price'}
+        return super().save(*args, **kwargs)
         
     def __str__(self):
         return f"Order #{self.id} - {self.user.email}"
@@ -75,51 +96,97 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
     
+    def copy_variant_details(self, product_name=None):
+        """Snapshot the variant's names and prices onto this item"""
+        variant = self.product_variant
+        self.product_name = product_name if product_name is not None else variant.product.name
+        self.variant_name = variant.name
+        
+        # Use discount price if available, otherwise use regular price
+        if variant.discount_price:
+            self.price = variant.discount_price
+            self.discount_price = variant.discount_price
+        else:
+            self.price = variant.price
+    
+    def calculate_subtotal(self):
+        """Calculate the subtotal of this item"""
+        effective_price = self.discount_price if self.discount_price else self.price
+        self.subtotal = effective_price * self.quantity
+        return self.subtotal
+    
     def save(self, *args, **kwargs):
         # If this is a new order item being created, update product info
         if not self.pk and self.product_variant:
-            self.product_name = self.product_variant.product.name
-            self.variant_name = self.product_variant.name
-            
-            # Use discount price if available, otherwise use regular price
-            if self.product_variant.discount_price:
-                self.price = self.product_variant.discount_price
-                self.discount_price = self.product_variant.discount_price
-            else:
-                self.price = self.product_variant.price
+            self.copy_variant_details()
                 
         # Calculate subtotal
-        effective_price = self.discount_price if self.discount_price else self.price
-        self.subtotal = effective_price * self.quantity
+        self.calculate_subtotal()
         
         super().save(*args, **kwargs)
         
         # Update order total
         if self.order:
-            self.order.calculate_total_price()
-            self.order.save()
+            self.order.update_totals()
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.order.update_totals()
+        return result
     
     def __str__(self):
         return f"{self.quantity} x {self.product_name} - {self.variant_name}"
 
 
+class StockReservation(models.Model):
+    """Time-boxed hold on variant stock for an order that has not been paid yet"""
+    STATUS_CHOICES = (
+        ('active', 'Active'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+    )
+    
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    released_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Summing active holds for a set of variants
+            models.Index(fields=['product_variant', 'status', 'expires_at']),
+            # Sweeping expired holds
+            models.Index(fields=['status', 'expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x variant {self.product_variant_id} for Order #{self.order_id} ({self.status})"
+
+
 class ShippingRate(models.Model):
-    """Model to store shipping rates fetched from RajaOngkir API"""
+    """Model to store shipping rates fetched from RajaOngkir API (see orders.utils.shipping)"""
     origin_city = models.CharField(max_length=100)
     destination_city = models.CharField(max_length=100)
+    # Parcel weight in SHIPPING_WEIGHT_BUCKET_GRAMS steps, rounded up
+    weight_bucket = models.PositiveIntegerField(default=1)
     courier = models.CharField(max_length=50)
+    courier_name = models.CharField(max_length=100, blank=True)
     service = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     cost = models.DecimalField(max_digits=10, decimal_places=2)
     estimated_days = models.CharField(max_length=20)
     created_at = models.DateTimeField(auto_now_add=True)
+    fetched_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
-        # Create a unique constraint to avoid duplicate shipping rates
-        unique_together = ('origin_city', 'destination_city', 'courier', 'service')
+        # One rate per service of a route; also the key quotes are looked up by
+        unique_together = ('origin_city', 'destination_city', 'weight_bucket', 'courier', 'service')
     
     def __str__(self):
-        return f"{self.origin_city} to {self.destination_city} via {self.courier} {self.service}"
+        return f"{self.origin_city} to {self.destination_city} ({self.weight_bucket}) via {self.courier} {self.service}"
 
 
 class PaymentTransaction(models.Model):
@@ -144,5 +211,12 @@ class PaymentTransaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Admin lists filtered by status and transaction date
+            models.Index(fields=['status', 'transaction_time']),
+            models.Index(fields=['transaction_time']),
+        ]
+    
     def __str__(self):
-        return f"Payment {self.transaction_id} for Order #{self.order.id}"
\ No newline at end of file
+        return f"Payment {self.transaction_id} for Order #{self.order_id}"
\ No newline at end of file
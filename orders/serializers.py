@@ -1,5 +1,9 @@
+from django.db import transaction
 from rest_framework import serializers
+from gudangpd_api.fieldsets import SparseFieldsetMixin
+from products.models import Product, ProductVariant
 from .models import Order, OrderItem, ShippingRate, PaymentTransaction
+from .utils import reservations
 from products.serializers import ProductVariantSerializer
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -22,10 +26,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return value
 
 
-class OrderItemCreateSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = OrderItem
-        fields = ['product_variant', 'quantity']
+class OrderItemCreateSerializer(serializers.Serializer):
+    # Variants are resolved in bulk when the order is placed, so validation
+    # does not issue one lookup query per line
+    product_variant = serializers.IntegerField(source='product_variant_id')
+    quantity = serializers.IntegerField(min_value=1, default=1)
 
 
 class OrderCreateSerializer(serializers.ModelSerializer):
@@ -45,6 +50,7 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("At least one item is required")
         return value
 
+    @transaction.atomic
     def create(self, validated_data):
         if 'id' in validated_data:
             validated_data.pop('id')
@@ -52,29 +58,64 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         items_data = validated_data.pop('items')
         user = self.context['request'].user
         
-        order = Order.objects.create(user=user, **validated_data)
+        # Repeated lines for the same variant are checked against their combined quantity
+        quantities = {}
+        for item_data in items_data:
+            variant_id = item_data['product_variant_id']
+            quantities[variant_id] = quantities.get(variant_id, 0) + item_data['quantity']
+        
+        # Resolve and lock every variant in the basket with one query. The lock only
+        # serializes availability checks; the variant rows themselves are not written.
+        # Locking in primary key order keeps concurrent checkouts from deadlocking.
+        variants = {
+            variant.pk: variant
+            for variant in ProductVariant.objects.select_for_update()
+            .filter(pk__in=quantities).order_by('pk')
+        }
+        missing = [variant_id for variant_id in quantities if variant_id not in variants]
+        if missing:
+            raise serializers.ValidationError(
+                {"items": f"Invalid product variant: {', '.join(map(str, missing))}"}
+            )
+        
+        available = reservations.available_stock(variants.values())
+        for variant_id, quantity in quantities.items():
+            if available[variant_id] < quantity:
+                raise serializers.ValidationError(f"Not enough stock for {variants[variant_id].name}")
+        
+        product_names = dict(
+            Product.objects.filter(
+                pk__in={variant.product_id for variant in variants.values()}
+            ).values_list('id', 'name')
+        )
         
+        order = Order(user=user, **validated_data)
+        order_items = []
         for item_data in items_data:
-            product_variant = item_data['product_variant']
-            quantity = item_data['quantity']
-            
-            if product_variant.stock < quantity:
-                order.delete()
-                raise serializers.ValidationError(f"Not enough stock for {product_variant.name}")
-            
-            OrderItem.objects.create(order=order, **item_data)
-            
-            product_variant.stock -= quantity
-            product_variant.save()
+            product_variant = variants[item_data['product_variant_id']]
+            item = OrderItem(
+                order=order,
+                product_variant=product_variant,
+                quantity=item_data['quantity'],
+            )
+            item.copy_variant_details(product_names[product_variant.product_id])
+            item.calculate_subtotal()
+            order_items.append(item)
         
-        order.calculate_total_price()
+        # Totals are written once together with the order row
+        order.total_price = sum(item.subtotal for item in order_items)
         order.save()
+        OrderItem.objects.bulk_create(order_items)
+        
+        # Stock is held rather than taken until the order is paid
+        reservations.reserve(order, quantities)
         
         return order
 
 
 class OrderItemDetailSerializer(serializers.ModelSerializer):
-    product_variant_details = serializers.SerializerMethodField()
+    # Rendered from the variant loaded with the item (see OrderViewSet.sparse_prefetches)
+    product_variant_details = ProductVariantSerializer(source='product_variant', read_only=True)
     
     class Meta:
         model = OrderItem
@@ -83,14 +124,9 @@ class OrderItemDetailSerializer(serializers.ModelSerializer):
             'price', 'discount_price', 'quantity', 'subtotal',
             'product_variant_details'
         ]
-    
-    def get_product_variant_details(self, obj):
-        if obj.product_variant:
-            return ProductVariantSerializer(obj.product_variant).data
-        return None
 
 
-class OrderListSerializer(serializers.ModelSerializer):
+class OrderListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = [
@@ -99,7 +135,15 @@ class OrderListSerializer(serializers.ModelSerializer):
         ]
 
 
-class OrderDetailSerializer(serializers.ModelSerializer):
+class OrderHistorySerializer(OrderListSerializer):
+    """Orders with the items as they were bought, for the order history"""
+    items = OrderItemSerializer(many=True, read_only=True)
+    
+    class Meta(OrderListSerializer.Meta):
+        fields = OrderListSerializer.Meta.fields + ['items']
+
+
+class OrderDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemDetailSerializer(many=True, read_only=True)
     
     class Meta:
@@ -134,4 +178,13 @@ class ShippingCostRequestSerializer(serializers.Serializer):
     origin_city = serializers.CharField()
     destination_city = serializers.CharField()
     weight = serializers.IntegerField(min_value=1)
-    courier = serializers.CharField()
\ No newline at end of file
+    courier = serializers.CharField(required=False)
+    # Quotes every listed courier in one request, fetched concurrently
+    couriers = serializers.ListField(
+        child=serializers.CharField(), required=False, allow_empty=False, max_length=10
+    )
+    
+    def validate(self, data):
+        if not data.get('courier') and not data.get('couriers'):
+            raise serializers.ValidationError("Either courier or couriers is required")
+        return data
\ No newline at end of file
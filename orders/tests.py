@@ -1,3 +1,1141 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import threading
+import time
+from concurrent.futures import wait
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Prefetch
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from gudangpd_api.pagination import KeysetPagination, OrderKeysetPagination
+from products.models import Product, ProductVariant
+from users.models import User
+
+from .models import Order, OrderItem, PaymentTransaction, ShippingRate, StockReservation
+from .serializers import OrderDetailSerializer, OrderHistorySerializer, OrderListSerializer
+from .utils import gateway, reservations, shipping
+from .utils.shipping import run_in_background
+from .utils.singleflight import SingleFlight
+from .views import PaymentNotificationView
+
+
+def create_order(user, **kwargs):
+    fields = {
+        'shipping_name': "Budi",
+        'shipping_phone': "08123456789",
+        'shipping_address': "Jl. Merdeka 1",
+        'shipping_province': "DKI Jakarta",
+        'shipping_city': "Jakarta Pusat",
+        'shipping_postal_code': "10110",
+    }
+    fields.update(kwargs)
+    return Order.objects.create(user=user, **fields)
+
+
+class OrderListParityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+        for cost in ['9000', '12500.5', '0']:
+            create_order(cls.user, shipping_cost=Decimal(cost))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_matches_serializer(self):
+        response = self.client.get('/api/v1/orders/', {'page_size': 2})
+        results = response.data['results']
+        response = self.client.get(response.data['next'])
+        results += response.data['results']
+        expected = OrderListSerializer(Order.objects.order_by('-created_at', '-id'), many=True).data
+        self.assertEqual(results, expected)
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+        cls.orders = [create_order(cls.user) for _ in range(7)]
+        # Orders placed in the same instant are told apart by id
+        Order.objects.update(created_at=timezone.now())
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [order['id'] for order in response.data['results']]
+
+    def test_cursors_round_trip(self):
+        expected = [order.pk for order in reversed(self.orders)]
+        pages = [self.client.get('/api/v1/orders/', {'page_size': 3})]
+        while pages[-1].data['next']:
+            pages.append(self.client.get(pages[-1].data['next']))
+        self.assertEqual([self.ids(page) for page in pages], [expected[:3], expected[3:6], expected[6:]])
+        self.assertIsNone(pages[0].data['previous'])
+
+        # Walking back lands on the same pages
+        back = self.client.get(pages[-1].data['previous'])
+        self.assertEqual(self.ids(back), expected[3:6])
+        self.assertEqual(self.ids(self.client.get(back.data['previous'])), expected[:3])
+
+    def test_page_size_is_clamped(self):
+        self.assertEqual(KeysetPagination.max_page_size, settings.API_MAX_PAGE_SIZE)
+        with mock.patch.object(OrderKeysetPagination, 'max_page_size', 4):
+            response = self.client.get('/api/v1/orders/', {'page_size': 1000})
+        self.assertEqual(len(self.ids(response)), 4)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/orders/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class OrderCreateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+        product = Product.objects.create(id=1, name="Kaos Polos")
+        cls.variants = [
+            ProductVariant.objects.create(
+                id=i, product=product, name=f"Size {i}", price=Decimal('15000'),
+                reseller_price=Decimal('12000'), sku=f"KP-{i}", stock=5, weight=Decimal('200'),
+            )
+            for i in range(1, 7)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place(self, items):
+        return self.client.post('/api/v1/orders/', {
+            'shipping_name': "Budi", 'shipping_phone': "08123456789", 'shipping_address': "Jl. Merdeka 1",
+            'shipping_province': "DKI Jakarta", 'shipping_city': "Jakarta Pusat", 'shipping_postal_code': "10110",
+            'items': [{'product_variant': variant_id, 'quantity': quantity} for variant_id, quantity in items],
+        }, format='json')
+
+    def test_query_count_does_not_grow_with_items(self):
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(self.place([(1, 1)]).status_code, 201)
+        with CaptureQueriesContext(connection) as five:
+            self.assertEqual(self.place([(i, 1) for i in range(2, 7)]).status_code, 201)
+        self.assertEqual(len(five), len(one))
+
+        order = Order.objects.latest('id')
+        self.assertEqual(order.items.count(), 5)
+        self.assertEqual(order.total_price, Decimal('75000'))
+        self.assertEqual(order.reservations.filter(status='active').count(), 5)
+
+    def test_repeated_variant_is_checked_on_the_combined_quantity(self):
+        response = self.place([(1, 3), (1, 3)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+        self.assertEqual(self.place([(1, 2), (1, 3)]).status_code, 201)
+        self.assertEqual(StockReservation.objects.get().quantity, 5)
+
+    def test_missing_variant(self):
+        response = self.place([(1, 1), (99, 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('99', str(response.data['items']))
+
+    def test_a_failing_line_rolls_back_the_order(self):
+        # Nothing of the order is kept when one of its lines is short of stock...
+        response = self.place([(1, 1), (2, 6)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+
+        # ...or when a write fails after the items were inserted
+        with mock.patch.object(reservations, 'reserve', side_effect=RuntimeError("ledger down")):
+            with self.assertRaises(RuntimeError):
+                self.place([(1, 1), (2, 1)])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class OrderTotalsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+
+    def setUp(self):
+        self.order = create_order(self.user, shipping_cost=Decimal('9000'))
+
+    def add_item(self, price, quantity=1):
+        return OrderItem.objects.create(
+            order=self.order, product_name="Kaos", variant_name="M",
+            price=Decimal(price), quantity=quantity,
+        )
+
+    def test_item_changes_keep_totals(self):
+        self.add_item('15000', quantity=2)
+        item = self.add_item('5000')
+        self.assertEqual(self.order.total_price, Decimal('35000'))
+        self.assertEqual(self.order.final_price, Decimal('44000'))
+
+        item.delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal('30000'))
+        self.assertEqual(self.order.final_price, Decimal('39000'))
+
+    def test_status_save_does_not_read_items(self):
+        self.add_item('15000')
+        self.order.status = 'cancelled'
+        with CaptureQueriesContext(connection) as queries:
+            self.order.save(update_fields=['status', 'updated_at'])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('final_price', queries[0]['sql'])
+
+    def test_shipping_cost_save_updates_final_price(self):
+        self.add_item('15000')
+        self.order.shipping_cost = Decimal('12000')
+        with self.assertNumQueries(1):
+            self.order.save(update_fields=['shipping_cost', 'updated_at'])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.final_price, Decimal('27000'))
+
+
+class PaymentNotificationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+
+    def setUp(self):
+        self.order = create_order(self.user)
+        self.payment = PaymentTransaction.objects.create(
+            order=self.order, transaction_id='ORDER-1-1', payment_type='bank_transfer',
+            amount=Decimal('10000'), status='pending', transaction_time=timezone.now(),
+            transaction_status='pending',
+        )
+        self.client = APIClient()
+
+    def notify(self, transaction_status):
+        return self.client.post('/api/v1/payment-notification/', {
+            'order_id': 'ORDER-1-1', 'transaction_status': transaction_status,
+        }, format='json')
+
+    def test_repeated_settlement_leaves_order_alone(self):
+        self.assertEqual(self.notify('settlement').status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        paid_at = self.order.paid_at
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.notify('settlement').status_code, 200)
+        self.assertFalse(any(
+            query['sql'].startswith('UPDATE') and 'orders_order' in query['sql'] for query in queries
+        ))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.paid_at, paid_at)
+
+    def test_concurrent_settlement_is_applied_once(self):
+        # Another notification settled the order after this one read it
+        stale = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(self.notify('settlement').status_code, 200)
+        self.order.refresh_from_db()
+        paid_at = self.order.paid_at
+
+        with mock.patch.object(reservations, 'commit_order') as commit_order:
+            PaymentNotificationView().settle(stale, self.payment)
+        commit_order.assert_not_called()
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.paid_at), ('paid', paid_at))
+
+    def test_cancelled_order_is_not_revived(self):
+        self.order.status = 'cancelled'
+        self.order.save()
+        self.assertEqual(self.notify('settlement').status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        self.assertIsNone(self.order.paid_at)
+        self.assertEqual(self.order.payment_details['review']['transaction_id'], 'ORDER-1-1')
+
+    def test_late_payment_without_stock_is_flagged(self):
+        product = Product.objects.create(id=1, name="Kaos")
+        variant = ProductVariant.objects.create(
+            id=11, product=product, name="M", price=Decimal('15000'), reseller_price=Decimal('12000'),
+            sku="KS-M", stock=2, weight=Decimal('200'),
+        )
+        hold = reservations.reserve(self.order, {variant.pk: 2})[0]
+        StockReservation.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        # The lapsed hold's stock went to someone else
+        reservations.reserve(create_order(self.user), {variant.pk: 1})
+
+        self.assertEqual(self.notify('settlement').status_code, 200)
+        self.order.refresh_from_db()
+        variant.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+        self.assertIn('review', self.order.payment_details)
+        self.assertEqual(variant.stock, 2)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'success')
+
+
+class StockReservationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+        product = Product.objects.create(id=1, name="Kaos")
+        cls.variant = ProductVariant.objects.create(
+            id=11, product=product, name="M", price=Decimal('15000'), reseller_price=Decimal('12000'),
+            sku="KS-M", stock=10, weight=Decimal('200'),
+        )
+
+    def setUp(self):
+        self.order = create_order(self.user)
+
+    def stock(self):
+        self.variant.refresh_from_db()
+        return self.variant.stock
+
+    def available(self, now=None):
+        return reservations.available_stock([self.variant], now=now)[self.variant.pk]
+
+    def held_stock(self):
+        return ProductVariant.objects.get(pk=self.variant.pk).held_stock
+
+    def expire(self, order):
+        order.reservations.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+    def test_holds_reduce_available_stock_until_they_expire(self):
+        reservations.reserve(self.order, {self.variant.pk: 3})
+        reservations.reserve(create_order(self.user), {self.variant.pk: 2})
+        self.assertEqual(reservations.held_quantities([self.variant.pk]), {self.variant.pk: 5})
+        self.assertEqual(self.available(), 5)
+        self.assertEqual(self.stock(), 10)
+
+        later = timezone.now() + reservations.reservation_ttl() + timedelta(minutes=1)
+        self.assertEqual(reservations.held_quantities([self.variant.pk], now=later), {})
+        self.assertEqual(self.available(now=later), 10)
+
+    def test_release_expired(self):
+        reservations.reserve(self.order, {self.variant.pk: 3})
+        live = create_order(self.user)
+        reservations.reserve(live, {self.variant.pk: 2})
+        self.expire(self.order)
+        # Expired holds stay counted until they are swept
+        self.assertEqual(self.held_stock(), 5)
+
+        self.assertEqual(reservations.release_expired(batch_size=1), 1)
+        self.assertEqual(self.order.reservations.get().status, 'released')
+        self.assertEqual(live.reservations.get().status, 'active')
+        self.assertEqual(self.available(), 8)
+        self.assertEqual(self.held_stock(), 2)
+
+    def test_commit_then_release_restocks(self):
+        reservations.reserve(self.order, {self.variant.pk: 3})
+        self.assertEqual(self.held_stock(), 3)
+        self.assertEqual(reservations.commit_order(self.order), 1)
+        self.assertEqual(self.stock(), 7)
+        self.assertEqual(self.available(), 7)
+        self.assertEqual(self.held_stock(), 0)
+        # Committing again does nothing
+        self.assertEqual(reservations.commit_order(self.order), 0)
+        self.assertEqual(self.stock(), 7)
+
+        reservations.release_order(self.order)
+        self.assertEqual(self.stock(), 10)
+        self.assertEqual(self.order.reservations.get().status, 'released')
+
+    def test_release_of_active_hold_leaves_stock(self):
+        reservations.reserve(self.order, {self.variant.pk: 3})
+        reservations.release_order(self.order)
+        self.assertEqual(self.stock(), 10)
+        self.assertEqual(self.available(), 10)
+
+    def test_commit_of_released_hold_reserves_again(self):
+        reservations.reserve(self.order, {self.variant.pk: 3})
+        self.expire(self.order)
+        reservations.release_expired()
+        reservations.reserve(create_order(self.user), {self.variant.pk: 7})
+
+        self.assertEqual(reservations.commit_order(self.order), 1)
+        self.assertEqual(self.stock(), 7)
+        self.assertEqual(self.order.reservations.get().status, 'committed')
+
+    def test_commit_of_released_hold_without_stock_fails(self):
+        reservations.reserve(self.order, {self.variant.pk: 3})
+        self.expire(self.order)
+        reservations.release_expired()
+        reservations.reserve(create_order(self.user), {self.variant.pk: 8})
+
+        with self.assertRaises(reservations.StockUnavailable) as raised:
+            reservations.commit_order(self.order)
+        self.assertEqual(raised.exception.variant_ids, [self.variant.pk])
+        self.assertEqual(self.stock(), 10)
+        self.assertEqual(self.order.reservations.get().status, 'released')
+
+
+def plan_problems(sql):
+    """Full table scans and sorts in the query plan of ``sql``"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            details = [row[-1] for row in cursor.fetchall()]
+            return [
+                detail for detail in details
+                if re.fullmatch(r'SCAN \w+', detail) or 'TEMP B-TREE FOR ORDER BY' in detail
+            ]
+        cursor.execute('EXPLAIN FORMAT=JSON ' + sql)
+        plan = json.loads(cursor.fetchone()[0])
+
+    problems = []
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get('access_type') == 'ALL':
+                problems.append(f"full scan of {node.get('table_name')}")
+            if node.get('using_filesort'):
+                problems.append('filesort')
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+    walk(plan)
+    return problems
+
+
+@skipUnless(connection.vendor in ('sqlite', 'mysql'), "EXPLAIN output is only parsed for SQLite and MySQL")
+class OrderQueryPlanTests(TestCase):
+    """The order queries that grow with the table must be served from an index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+        cls.staff = User.objects.create_user('staff@example.com', 'secret', is_staff=True)
+        for _ in range(3):
+            order = create_order(cls.user)
+            OrderItem.objects.create(
+                order=order, product_name="Kaos", variant_name="M", price=Decimal('15000'),
+            )
+        cls.order = order
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assertIndexed(self, queryset):
+        with CaptureQueriesContext(connection) as queries:
+            list(queryset)
+        sql = queries[-1]['sql']
+        self.assertEqual(plan_problems(sql), [], sql)
+
+    def assertRequestIndexed(self, user, path, params=None):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        selects = [query['sql'] for query in queries if 'orders_' in query['sql']]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertEqual(plan_problems(sql), [], sql)
+        return response
+
+    def test_customer_order_history(self):
+        response = self.assertRequestIndexed(self.user, '/api/v1/orders/', {'page_size': 2})
+        self.assertRequestIndexed(self.user, response.data['next'])
+
+    def test_staff_list_by_status(self):
+        response = self.assertRequestIndexed(self.staff, '/api/v1/orders/', {'status': 'pending', 'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertRequestIndexed(self.staff, response.data['next'])
+
+    def test_staff_list(self):
+        # Every query of the unfiltered list, ETag validators included, is keyset-bounded
+        response = self.assertRequestIndexed(self.staff, '/api/v1/orders/', {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertRequestIndexed(self.staff, response.data['next'])
+
+    def test_order_history(self):
+        response = self.assertRequestIndexed(self.user, '/api/v1/orders/history/', {'page_size': 2})
+        self.assertRequestIndexed(self.user, response.data['next'])
+
+    def test_order_detail(self):
+        self.assertRequestIndexed(self.user, f'/api/v1/orders/{self.order.pk}/')
+
+    def test_admin_filters(self):
+        today = timezone.now()
+        self.assertIndexed(Order.objects.filter(status='paid'))
+        self.assertIndexed(Order.objects.filter(paid_at__gte=today - timedelta(days=7), paid_at__lt=today))
+        self.assertIndexed(Order.objects.filter(created_at__gte=today - timedelta(days=7)))
+        self.assertIndexed(PaymentTransaction.objects.filter(
+            status='success', transaction_time__gte=today - timedelta(days=7)
+        ))
+        self.assertIndexed(PaymentTransaction.objects.filter(transaction_time__gte=today - timedelta(days=7)))
+
+    def test_payment_notification_lookup(self):
+        self.assertIndexed(PaymentTransaction.objects.select_related('order').filter(transaction_id='ORDER-1-1'))
+
+
+class OrderReadQueryTests(TestCase):
+    """Order reads cost a fixed number of queries however many items the orders have"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+        product = Product.objects.create(id=1, name="Kaos Polos")
+        cls.variants = [
+            ProductVariant.objects.create(
+                id=i, product=product, name=f"Size {i}", price=Decimal('15000'),
+                reseller_price=Decimal('12000'), sku=f"KP-{i}", stock=10, weight=Decimal('200'),
+            )
+            for i in range(1, 6)
+        ]
+        for count in [1, 5, 3]:
+            cls.order = cls.create_order_with_items(count)
+
+    @classmethod
+    def create_order_with_items(cls, count):
+        order = create_order(cls.user)
+        for variant in cls.variants[:count]:
+            OrderItem.objects.create(order=order, product_variant=variant, quantity=2)
+        return order
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_detail_queries_do_not_grow_with_items(self):
+        # validators, order, items with their variants
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/v1/orders/{self.order.pk}/')
+        self.assertEqual(response.data, OrderDetailSerializer(self.order).data)
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(response.data['items'][0]['product_variant_details']['sku'], 'KP-1')
+
+        self.create_order_with_items(5)
+        order = Order.objects.latest('created_at')
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/v1/orders/{order.pk}/')
+        self.assertEqual(len(response.data['items']), 5)
+
+    def test_history_costs_two_queries_per_page(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/orders/history/', {'page_size': 2})
+        results = response.data['results']
+        with self.assertNumQueries(2):
+            response = self.client.get(response.data['next'])
+        results += response.data['results']
+
+        orders = Order.objects.order_by('-created_at', '-id').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.order_by('id'))
+        )
+        self.assertEqual(results, OrderHistorySerializer(orders, many=True).data)
+        self.assertEqual([len(order['items']) for order in results], [3, 5, 1])
+
+    def test_payment_str_does_not_load_order(self):
+        payment = PaymentTransaction(
+            order_id=self.order.pk, transaction_id='ORDER-1-1', payment_type='bank_transfer',
+            amount=Decimal('10000'), status='pending', transaction_time=timezone.now(),
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(str(payment), f"Payment ORDER-1-1 for Order #{self.order.pk}")
+
+
+def rajaongkir_response(*services):
+    return {
+        'meta': {'message': "Success Calculate Domestic Shipping cost", 'code': 200, 'status': "success"},
+        'data': [
+            {'name': "Jalur Nugraha Ekakurir (JNE)", 'code': 'jne', 'service': service,
+             'description': f"Layanan {service}", 'cost': cost, 'etd': "2 day"}
+            for service, cost in services
+        ],
+    }
+
+
+class ShippingQuoteCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch.object(
+            shipping, 'fetch_rates', return_value=rajaongkir_response(('YES', 36000), ('REG', 18000))
+        )
+        self.fetch_rates = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Background refreshes run inline so their effect can be checked
+        patcher = mock.patch.object(shipping, 'run_in_background', side_effect=lambda func, *args: func(*args))
+        self.run_in_background = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def quote(self, weight=1500):
+        return self.client.post('/api/v1/calculate-shipping/', {
+            'origin_city': '501', 'destination_city': '114', 'weight': weight, 'courier': 'JNE',
+        }, format='json')
+
+    def age_rates(self, seconds):
+        ShippingRate.objects.update(fetched_at=timezone.now() - timedelta(seconds=seconds))
+
+    def test_quote_is_fetched_once_per_weight_bucket(self):
+        response = self.quote(weight=1500)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([rate['service'] for rate in response.data['data']], ['REG', 'YES'])
+        # Asked for the heaviest weight of the bucket
+        self.fetch_rates.assert_called_once_with('501', '114', 2000, 'jne')
+        self.assertEqual(ShippingRate.objects.filter(weight_bucket=2).count(), 2)
+
+        with self.assertNumQueries(1):
+            cached = self.quote(weight=1001)
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(self.fetch_rates.call_count, 1)
+
+        self.quote(weight=2500)
+        self.assertEqual(self.fetch_rates.call_count, 2)
+
+    def test_stale_rates_are_served_while_refreshing(self):
+        self.quote()
+        self.age_rates(settings.SHIPPING_QUOTE_TTL + 60)
+        self.fetch_rates.return_value = rajaongkir_response(('REG', 19000))
+
+        response = self.quote()
+        self.assertEqual([rate['cost'] for rate in response.data['data']], [18000, 36000])
+        self.run_in_background.assert_called_once()
+        # The refresh replaced the route's rates, dropping the service that went away
+        self.assertEqual(list(ShippingRate.objects.values_list('service', 'cost')), [('REG', Decimal('19000'))])
+
+    def test_expired_rates_wait_for_rajaongkir(self):
+        self.quote()
+        self.age_rates(settings.SHIPPING_QUOTE_MAX_STALE + 60)
+        self.fetch_rates.return_value = rajaongkir_response(('REG', 19000))
+
+        response = self.quote()
+        self.assertEqual([rate['cost'] for rate in response.data['data']], [19000])
+        self.run_in_background.assert_not_called()
+
+    def test_upstream_errors_are_not_cached(self):
+        error = {'meta': {'message': "Destination not found", 'code': 404, 'status': "error"}, 'data': None}
+        self.fetch_rates.return_value = error
+        response = self.quote()
+        self.assertEqual(response.data, error)
+        self.assertFalse(ShippingRate.objects.exists())
+
+        self.fetch_rates.side_effect = shipping.ShippingQuoteError("Error connecting to RajaOngkir API: timeout")
+        self.assertEqual(self.quote().status_code, 500)
+
+    def test_routes_without_service_are_remembered(self):
+        self.fetch_rates.return_value = rajaongkir_response()
+        self.assertEqual(self.quote().data['data'], [])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.quote().data['data'], [])
+        self.fetch_rates.assert_called_once()
+
+    def test_refreshes_share_a_bounded_pool(self):
+        threads = set()
+
+        def refresh():
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+
+        wait([run_in_background(refresh) for _ in range(10)])
+        self.assertLessEqual(len(threads), settings.SHIPPING_REFRESH_WORKERS)
+        self.assertTrue(all(name.startswith('shipping-refresh') for name in threads))
+
+
+def courier_response(courier, *services):
+    return {
+        'meta': {'message': "Success Calculate Domestic Shipping cost", 'code': 200, 'status': "success"},
+        'data': [
+            {'name': courier.upper(), 'code': courier, 'service': service, 'description': "",
+             'cost': cost, 'etd': etd}
+            for service, cost, etd in services
+        ],
+    }
+
+
+@override_settings(SHIPPING_QUOTE_DEADLINE=0.5)
+class MultiCourierQuoteTests(TestCase):
+
+    RESPONSES = {
+        'jne': courier_response('jne', ('REG', 18000, "2-3 day"), ('YES', 36000, "1 day")),
+        'sicepat': courier_response('sicepat', ('REG', 18000, "1-2 day")),
+        'pos': courier_response('pos', ('Kilat', 15000, "4 day")),
+        'tiki': courier_response('tiki'),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.calls = []
+        patcher = mock.patch.object(shipping, 'fetch_rates', side_effect=self.fetch_rates)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch_rates(self, origin, destination, weight, courier):
+        self.calls.append(courier)
+        if courier == 'jnt':
+            time.sleep(1)
+        if courier == 'anteraja':
+            raise shipping.ShippingQuoteError("Error connecting to RajaOngkir API: timeout")
+        return self.RESPONSES.get(courier, {'meta': {'message': "Invalid courier", 'code': 400}, 'data': None})
+
+    def quote(self, couriers):
+        return self.client.post('/api/v1/calculate-shipping/', {
+            'origin_city': '501', 'destination_city': '114', 'weight': 1000, 'couriers': couriers,
+        }, format='json')
+
+    def test_quotes_are_merged_by_cost_and_eta(self):
+        response = self.quote(['jne', 'SiCepat', 'pos'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(self.calls), ['jne', 'pos', 'sicepat'])
+        self.assertEqual(
+            [(rate['code'], rate['service']) for rate in response.data['data']],
+            [('pos', 'Kilat'), ('sicepat', 'REG'), ('jne', 'REG'), ('jne', 'YES')]
+        )
+        self.assertEqual(response.data['unavailable'], [])
+
+        # Cached couriers are not fetched again
+        self.calls = []
+        with self.assertNumQueries(1):
+            self.quote(['pos', 'jne'])
+        self.assertEqual(self.calls, [])
+
+    def test_couriers_without_service_are_remembered(self):
+        response = self.quote(['jne', 'tiki'])
+        self.assertEqual({rate['code'] for rate in response.data['data']}, {'jne'})
+        self.assertEqual(response.data['unavailable'], [])
+        self.calls = []
+        self.quote(['jne', 'tiki'])
+        self.assertEqual(self.calls, [])
+
+    def test_partial_results_within_the_deadline(self):
+        started = time.monotonic()
+        response = self.quote(['jne', 'jnt', 'anteraja', 'wahana'])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({rate['code'] for rate in response.data['data']}, {'jne'})
+        self.assertEqual(
+            {item['courier']: item['detail'] for item in response.data['unavailable']},
+            {
+                'anteraja': "Error connecting to RajaOngkir API: timeout",
+                'jnt': "RajaOngkir did not answer in time",
+                'wahana': "Invalid courier",
+            }
+        )
+
+    def test_no_courier_answered(self):
+        response = self.quote(['anteraja'])
+        self.assertEqual(response.status_code, 502)
+
+    def test_courier_or_couriers_is_required(self):
+        response = self.client.post('/api/v1/calculate-shipping/', {
+            'origin_city': '501', 'destination_city': '114', 'weight': 1000,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class StubUpstream(BaseHTTPRequestHandler):
+    """Local stand-in for a gateway; each path fails its own way"""
+    protocol_version = 'HTTP/1.1'
+    calls = {}
+    client_ports = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.client_ports.add(self.client_address[1])
+        count = self.calls[self.path] = self.calls.get(self.path, 0) + 1
+        if self.path == '/slow':
+            time.sleep(0.5)
+        if self.path == '/down' or (self.path == '/flaky' and count < 3):
+            return self.reply(503, {'status': 'unavailable'})
+        self.reply(200, {'status': 'ok', 'call': count})
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class GatewayClientTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubUpstream)
+        # Clients hanging up on /slow are expected
+        cls.server.handle_error = lambda request, client_address: None
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        StubUpstream.calls = {}
+        StubUpstream.client_ports = set()
+        self.client = gateway.GatewayClient(
+            'stub', timeout=0.2, connect_timeout=0.2, max_retries=2, backoff=0,
+            breaker_threshold=2, breaker_reset_seconds=60,
+        )
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.assertEqual(self.client.post(self.base_url + '/ok', json={}).status_code, 200)
+        self.assertEqual(len(StubUpstream.client_ports), 1)
+        stats = self.client.stats()
+        self.assertEqual((stats['requests'], stats['errors'], stats['circuit']), (3, 0, 'closed'))
+
+    def test_idempotent_calls_are_retried(self):
+        response = self.client.post(self.base_url + '/flaky', json={}, idempotent=True)
+        self.assertEqual(response.json(), {'status': 'ok', 'call': 3})
+        self.assertEqual(self.client.stats()['retries'], 2)
+
+        # Other POSTs may already have had an effect upstream
+        StubUpstream.calls = {}
+        self.assertEqual(self.client.post(self.base_url + '/flaky', json={}).status_code, 503)
+        self.assertEqual(StubUpstream.calls['/flaky'], 1)
+
+    def test_read_timeout(self):
+        with self.assertRaises(gateway.GatewayError):
+            self.client.post(self.base_url + '/slow', json={})
+        self.assertEqual(StubUpstream.calls['/slow'], 1)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        for _ in range(2):
+            self.client.post(self.base_url + '/down', json={}, idempotent=True)
+        self.assertEqual(StubUpstream.calls['/down'], 6)
+        with self.assertRaises(gateway.CircuitOpenError):
+            self.client.post(self.base_url + '/ok', json={})
+        self.assertNotIn('/ok', StubUpstream.calls)
+
+        # After the reset period one trial call closes the circuit again
+        self.client.breaker.opened_at -= 60
+        self.assertEqual(self.client.post(self.base_url + '/ok', json={}).status_code, 200)
+        stats = self.client.stats()
+        self.assertEqual((stats['circuit'], stats['short_circuited'], stats['errors']), ('closed', 1, 2))
+
+
+class AsyncGatewayClientTests(GatewayClientTests):
+    """The httpx path shares the retry policy, breaker and metrics of the sync one"""
+
+    def test_async_retries_and_metrics(self):
+        response = async_to_sync(self.client.apost)(self.base_url + '/flaky', json={}, idempotent=True)
+        self.assertEqual(response.json(), {'status': 'ok', 'call': 3})
+        self.assertEqual(self.client.stats()['retries'], 2)
+
+        with self.assertRaises(gateway.GatewayError):
+            async_to_sync(self.client.apost)(self.base_url + '/slow', json={})
+
+    def test_async_calls_share_the_circuit(self):
+        for _ in range(2):
+            self.client.post(self.base_url + '/down', json={}, idempotent=True)
+        with self.assertRaises(gateway.CircuitOpenError):
+            async_to_sync(self.client.apost)(self.base_url + '/ok', json={})
+
+    def test_cancelled_trial_reopens_the_probe(self):
+        for _ in range(2):
+            self.client.post(self.base_url + '/down', json={}, idempotent=True)
+        self.client.breaker.opened_at -= 60
+
+        async def cancel_trial():
+            trial = asyncio.ensure_future(self.client.apost(self.base_url + '/slow', json={}, timeout=5))
+            await asyncio.sleep(0.1)
+            trial.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await trial
+
+        async_to_sync(cancel_trial)()
+        self.assertFalse(self.client.breaker.trial_running)
+        # The next call is let through as the trial and closes the circuit
+        response = async_to_sync(self.client.apost)(self.base_url + '/ok', json={})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.stats()['circuit'], 'closed')
+
+    def test_client_is_closed_with_its_loop(self):
+        clients = []
+
+        async def call():
+            await self.client.apost(self.base_url + '/ok', json={})
+            clients.append(await self.client.async_client())
+            # Reused within the loop
+            clients.append(await self.client.async_client())
+
+        async_to_sync(call)()
+        self.assertIs(clients[0], clients[1])
+        self.assertTrue(clients[0].is_closed)
+
+
+class AsyncGatewayViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'secret')
+        cls.order = create_order(cls.user, shipping_cost=Decimal('9000'))
+        OrderItem.objects.create(order=cls.order, product_name="Kaos", variant_name="M", price=Decimal('15000'))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch.object(
+            shipping, 'afetch_rates', side_effect=self.afetch_rates
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def afetch_rates(self, origin, destination, weight, courier):
+        if courier == 'jnt':
+            await asyncio.sleep(1)
+        return MultiCourierQuoteTests.RESPONSES.get(courier)
+
+    def test_shipping_quote_matches_sync_view(self):
+        data = {'origin_city': '501', 'destination_city': '114', 'weight': 1000, 'courier': 'jne'}
+        response = self.client.post('/api/v1/async/calculate-shipping/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Now cached, so the sync view answers without RajaOngkir
+        self.assertEqual(self.client.post('/api/v1/calculate-shipping/', data, format='json').data, response.data)
+
+    @override_settings(SHIPPING_QUOTE_DEADLINE=0.5)
+    def test_multi_courier_deadline(self):
+        response = self.client.post('/api/v1/async/calculate-shipping/', {
+            'origin_city': '501', 'destination_city': '114', 'weight': 1000, 'couriers': ['pos', 'jnt'],
+        }, format='json')
+        self.assertEqual([rate['code'] for rate in response.data['data']], ['pos'])
+        self.assertEqual([item['courier'] for item in response.data['unavailable']], ['jnt'])
+
+    @override_settings(MIDTRANS_SERVER_KEY='server-key', MIDTRANS_ENV='sandbox')
+    def test_create_payment(self):
+        snap = mock.Mock(status_code=201)
+        snap.json.return_value = {'token': 'abc', 'redirect_url': 'https://app.sandbox.midtrans.com/snap/abc'}
+        with mock.patch.object(gateway.midtrans, 'apost', mock.AsyncMock(return_value=snap)) as apost:
+            response = self.client.post(f'/api/v1/async/orders/{self.order.pk}/create-payment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['token'], 'abc')
+        payload = apost.call_args.kwargs['json']
+        self.assertEqual(payload['transaction_details']['gross_amount'], 24000)
+        self.assertEqual(len(payload['item_details']), 2)
+        self.assertTrue(PaymentTransaction.objects.filter(order=self.order, status='pending').exists())
+
+        other = User.objects.create_user('other@example.com', 'secret')
+        self.client.force_authenticate(other)
+        response = self.client.post(f'/api/v1/async/orders/{self.order.pk}/create-payment/')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(API_KEY_EXEMPT_URLS=['/admin/'])
+    async def test_async_middleware_chain(self):
+        client = AsyncClient()
+        data = {'origin_city': '501', 'destination_city': '114', 'weight': 1000, 'courier': 'jne'}
+        response = await client.post(
+            '/api/v1/async/calculate-shipping/', data, content_type='application/json',
+            headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'][0]['service'], 'REG')
+
+        response = await client.post(
+            '/api/v1/async/calculate-shipping/', data, content_type='application/json',
+            headers={'X-API-Key': 'not-a-key'},
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight('test')
+        self.calls = 0
+        self.release = threading.Event()
+
+    def slow_call(self, value):
+        self.calls += 1
+        self.release.wait(5)
+        return {'value': value}
+
+    async def aslow_call(self, value):
+        self.calls += 1
+        await asyncio.sleep(0.2)
+        return {'value': value}
+
+    def run_threads(self, count, target):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(target())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_threads_share_one_call(self):
+        results = self.run_threads(8, lambda: self.flight.do('route', self.slow_call, 1))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+
+        # The flight is over; the next caller makes a new call
+        self.flight.do('route', self.slow_call, 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_errors_are_shared(self):
+        def failing():
+            self.calls += 1
+            self.release.wait(5)
+            raise shipping.ShippingQuoteError("down")
+
+        def call():
+            try:
+                return self.flight.do('route', failing)
+            except shipping.ShippingQuoteError as e:
+                return e
+
+        results = self.run_threads(4, call)
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(isinstance(result, shipping.ShippingQuoteError) for result in results))
+        self.assertEqual(self.flight.calls, {})
+
+    def test_tasks_share_one_call(self):
+        async def quote():
+            return await asyncio.gather(
+                *(self.flight.ado('route', self.aslow_call, 1) for _ in range(5)),
+                self.flight.ado('other', self.aslow_call, 2),
+            )
+
+        results = async_to_sync(quote)()
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(results[:5], [{'value': 1}] * 5)
+        self.assertEqual(results[5], {'value': 2})
+
+    def test_task_follows_a_thread(self):
+        leader = threading.Thread(target=self.flight.do, args=('route', self.slow_call, 1))
+        leader.start()
+        time.sleep(0.1)
+        threading.Timer(0.2, self.release.set).start()
+        result = async_to_sync(self.flight.ado)('route', self.aslow_call, 2)
+        leader.join(5)
+        self.assertEqual(result, {'value': 1})
+        self.assertEqual(self.calls, 1)
+
+    def test_cancelled_leader_does_not_cancel_the_call(self):
+        async def quote():
+            leader = asyncio.ensure_future(self.flight.ado('route', self.aslow_call, 1))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.flight.ado('route', self.aslow_call, 2))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(async_to_sync(quote)(), {'value': 1})
+        self.assertEqual(self.calls, 1)
+
+    def test_across_workers(self):
+        flight = SingleFlight('test', across_workers=True, wait=2)
+        lock_key, result_key = flight._cache_keys('route')
+
+        # Another worker holds the call; its result is picked up from the cache
+        cache.add(lock_key, 1)
+
+        def other_worker_finishes():
+            cache.set(result_key, {'value': 'other'})
+            cache.delete(lock_key)
+        threading.Timer(0.2, other_worker_finishes).start()
+        self.assertEqual(flight.do('route', self.slow_call, 1), {'value': 'other'})
+        self.assertEqual(self.calls, 0)
+
+        # With no worker holding the lock this one calls and publishes its result
+        cache.delete(result_key)
+        self.release.set()
+        self.assertEqual(flight.do('route', self.slow_call, 1), {'value': 1})
+        self.assertEqual(cache.get(result_key), {'value': 1})
+        self.assertIsNone(cache.get(lock_key))
+
+    def test_across_workers_gives_up_waiting(self):
+        flight = SingleFlight('test', across_workers=True, wait=0.2)
+        lock_key, _ = flight._cache_keys('route')
+        cache.add(lock_key, 1)
+        self.release.set()
+        self.assertEqual(async_to_sync(flight.ado)('route', self.aslow_call, 1), {'value': 1})
+        self.assertEqual(self.calls, 1)
+
+
+class ShippingQuoteCoalescingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def post(self, url, data, **kwargs):
+        self.calls.append(data['courier'])
+        self.release.wait(5)
+        return mock.Mock(status_code=200, json=mock.Mock(return_value=MultiCourierQuoteTests.RESPONSES['jne']))
+
+    async def apost(self, url, data, **kwargs):
+        self.calls.append(data['courier'])
+        await asyncio.sleep(0.2)
+        return mock.Mock(status_code=200, json=mock.Mock(return_value=MultiCourierQuoteTests.RESPONSES['jne']))
+
+    @override_settings(RAJAONGKIR_API_KEY='key')
+    def test_identical_routes_share_one_upstream_call(self):
+        routes = [
+            ('501', '114', 800, 'jne'),
+            ('501', '114', 1000, 'JNE'),  # same weight bucket and courier
+            (501, '114', 1000, 'jne'),
+            ('501', '114', 1500, 'jne'),  # next bucket
+            ('501', '114', 1000, 'pos'),
+        ]
+        with mock.patch.object(gateway.rajaongkir, 'post', side_effect=self.post):
+            threads = [threading.Thread(target=shipping.fetch_rates, args=route) for route in routes * 3]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+            self.release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(sorted(self.calls), ['jne', 'jne', 'pos'])
+
+    @override_settings(RAJAONGKIR_API_KEY='key')
+    def test_async_routes_share_one_upstream_call(self):
+        async def quote():
+            return await asyncio.gather(*(
+                shipping.afetch_rates('501', '114', 1000, 'jne') for _ in range(5)
+            ))
+
+        with mock.patch.object(gateway.rajaongkir, 'apost', side_effect=self.apost):
+            results = async_to_sync(quote)()
+        self.assertEqual(self.calls, ['jne'])
+        self.assertEqual(results, [MultiCourierQuoteTests.RESPONSES['jne']] * 5)
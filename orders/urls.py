@@ -4,6 +4,7 @@ from .views import (
     OrderViewSet, ShippingRateViewSet, CalculateShippingView,
     CreatePaymentView, PaymentNotificationView
 )
+from .async_views import AsyncCalculateShippingView, AsyncCreatePaymentView
 
 router = DefaultRouter()
 router.register(r'orders', OrderViewSet, basename='orders')
@@ -14,4 +15,10 @@ urlpatterns = [
     path('calculate-shipping/', CalculateShippingView.as_view(), name='calculate-shipping'),
     path('orders/<int:order_id>/create-payment/', CreatePaymentView.as_view(), name='create-payment'),
     path('payment-notification/', PaymentNotificationView.as_view(), name='payment-notification'),
+    # Same endpoints as async views, for the ASGI server
+    path('async/calculate-shipping/', AsyncCalculateShippingView.as_view(), name='async-calculate-shipping'),
+    path(
+        'async/orders/<int:order_id>/create-payment/', AsyncCreatePaymentView.as_view(),
+        name='async-create-payment'
+    ),
 ]
\ No newline at end of file
@@ -0,0 +1,327 @@
+"""
+Outbound HTTP client for the payment and shipping gateways.
+
+Each upstream gets one ``GatewayClient`` per worker process holding a
+keep-alive connection pool, so repeated calls skip the TCP and TLS
+handshakes. Every call has a connect and read timeout. Failed calls are
+retried a bounded number of times with jittered exponential backoff;
+requests that are not idempotent are only retried when the connection was
+never established. After ``GATEWAY_BREAKER_THRESHOLD`` consecutive failures
+the circuit opens and calls fail fast for ``GATEWAY_BREAKER_RESET_SECONDS``,
+after which a single trial call decides whether it closes again. Latency
+and error counters are kept per worker and reported by the health check.
+
+Async views use the same clients through ``arequest`` / ``apost``, which go
+over httpx but share the breaker and the metrics with the sync calls.
+"""
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import deque
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Responses that mean "try again later" rather than "your request is wrong"
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class GatewayError(requests.exceptions.RequestException):
+    """An upstream call failed after its retries"""
+
+
+class CircuitOpenError(GatewayError):
+    """The upstream failed repeatedly and is not being called for now"""
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """False to fail fast, 'trial' for the single probe of a half-open circuit, else True"""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                # Let one call through to probe the upstream
+                self.trial_running = True
+                return 'trial'
+            return False
+    
+    def abandon_trial(self):
+        # The probe was cancelled before it told anything about the upstream
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class GatewayMetrics:
+
+    def __init__(self, window=500):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.short_circuited = 0
+        # Latencies of the most recent calls, in milliseconds
+        self.latencies = deque(maxlen=window)
+
+    def record(self, elapsed, ok, attempts):
+        with self.lock:
+            self.requests += 1
+            self.retries += attempts - 1
+            if not ok:
+                self.errors += 1
+            self.latencies.append(elapsed * 1000)
+
+    def record_short_circuit(self):
+        with self.lock:
+            self.short_circuited += 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            data = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'short_circuited': self.short_circuited,
+            }
+        if latencies:
+            data['latency_ms'] = {
+                'p50': round(latencies[len(latencies) // 2], 1),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+                'max': round(latencies[-1], 1),
+            }
+        return data
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+async def _closed_with_loop(client):
+    # Parked at its yield for the life of the loop. Loops close their pending
+    # async generators on shutdown (asyncio.run, asgiref, uvicorn), which
+    # runs the finally and releases the client's connections.
+    try:
+        yield client
+    finally:
+        await client.aclose()
+
+
+class GatewayClient:
+    """
+    Pooled client for one upstream. Options left as None are read from the
+    ``GATEWAY_*`` settings; ``timeout`` is the read timeout in seconds.
+    """
+
+    def __init__(self, name, timeout=None, connect_timeout=None, max_retries=None,
+                 backoff=None, breaker_threshold=None, breaker_reset_seconds=None, pool_size=None):
+        self.name = name
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(
+            breaker_threshold or _setting('GATEWAY_BREAKER_THRESHOLD', 5),
+            breaker_reset_seconds or _setting('GATEWAY_BREAKER_RESET_SECONDS', 30),
+        )
+        self.metrics = GatewayMetrics()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    pool_size = self.pool_size or _setting('GATEWAY_POOL_SIZE', 10)
+                    # Retries are done here, with backoff and the breaker in the loop
+                    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def get_timeout(self):
+        connect = self.connect_timeout or _setting('GATEWAY_CONNECT_TIMEOUT', 3)
+        return (connect, self.timeout or 10)
+
+    def get_max_retries(self):
+        return self.max_retries if self.max_retries is not None else _setting('GATEWAY_MAX_RETRIES', 2)
+
+    def backoff_delay(self, attempt):
+        # Full jitter keeps workers that failed together from retrying together
+        backoff = self.backoff if self.backoff is not None else _setting('GATEWAY_RETRY_BACKOFF', 0.2)
+        return random.uniform(0, backoff * 2 ** attempt)
+
+    def start_call(self, method, idempotent):
+        """
+        Check the circuit; returns whether the call may be retried on errors
+        and whether it is the trial call of a half-open circuit
+        """
+        allowed = self.breaker.allow()
+        if not allowed:
+            self.metrics.record_short_circuit()
+            raise CircuitOpenError(f"{self.name} is unavailable, not retrying for now")
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+        return idempotent, allowed == 'trial'
+
+    def finish_call(self, started, attempts, response, error):
+        failed = error is not None or response.status_code >= 500
+        self.metrics.record(time.monotonic() - started, not failed, attempts)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if error is not None:
+            raise GatewayError(f"{self.name}: {error}") from error
+        return response
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Send a request and return the ``requests.Response``. Raises
+        ``GatewayError`` when the upstream cannot be reached and
+        ``CircuitOpenError`` while the circuit is open. ``idempotent``
+        defaults to True for GET, HEAD, PUT and DELETE.
+        """
+        idempotent, trial = self.start_call(method, idempotent)
+        kwargs.setdefault('timeout', self.get_timeout())
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                error = response = None
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.exceptions.ConnectTimeout as e:
+                    # Nothing was sent, so any request may be retried
+                    error, retryable = e, True
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error, retryable = e, idempotent
+                except requests.exceptions.RequestException as e:
+                    # Invalid URL, too many redirects, ...
+                    error, retryable = e, False
+                else:
+                    retryable = idempotent and response.status_code in RETRY_STATUSES
+
+                if not retryable or attempt > self.get_max_retries():
+                    break
+                time.sleep(self.backoff_delay(attempt - 1))
+        except BaseException:
+            if trial:
+                self.breaker.abandon_trial()
+            raise
+        return self.finish_call(started, attempt, response, error)
+
+    async def async_client(self):
+        # An httpx client belongs to the event loop it was first used on
+        loop = asyncio.get_running_loop()
+        entry = self._async_clients.get(loop)
+        if entry is None:
+            pool_size = self.pool_size or _setting('GATEWAY_POOL_SIZE', 10)
+            client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ))
+            entry = self._async_clients[loop] = (client, _closed_with_loop(client))
+            await entry[1].__anext__()
+        return entry[0]
+
+    async def arequest(self, method, url, idempotent=None, **kwargs):
+        """
+        Async ``request`` over httpx, sharing the circuit breaker and metrics.
+        Returns an ``httpx.Response``.
+        """
+        idempotent, trial = self.start_call(method, idempotent)
+        connect, read = self.get_timeout()
+        kwargs.setdefault('timeout', httpx.Timeout(read, connect=connect))
+        started = time.monotonic()
+        attempt = 0
+        try:
+            client = await self.async_client()
+            while True:
+                attempt += 1
+                error = response = None
+                try:
+                    response = await client.request(method, url, **kwargs)
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    # Nothing was sent, so any request may be retried
+                    error, retryable = e, True
+                except httpx.TransportError as e:
+                    error, retryable = e, idempotent
+                except (httpx.HTTPError, httpx.InvalidURL) as e:
+                    error, retryable = e, False
+                else:
+                    retryable = idempotent and response.status_code in RETRY_STATUSES
+
+                if not retryable or attempt > self.get_max_retries():
+                    break
+                await asyncio.sleep(self.backoff_delay(attempt - 1))
+        except BaseException:
+            # Cancelled (client gone, deadline): a trial must not keep the circuit shut
+            if trial:
+                self.breaker.abandon_trial()
+            raise
+        return self.finish_call(started, attempt, response, error)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest('GET', url, **kwargs)
+
+    async def apost(self, url, **kwargs):
+        return await self.arequest('POST', url, **kwargs)
+
+    def stats(self):
+        return {'circuit': self.breaker.state, **self.metrics.snapshot()}
+
+
+rajaongkir = GatewayClient('rajaongkir', timeout=_setting('RAJAONGKIR_TIMEOUT', 10))
+midtrans = GatewayClient('midtrans', timeout=_setting('MIDTRANS_TIMEOUT', 15))
+
+
+def gateway_stats():
+    """Per-worker circuit state and call metrics of every gateway"""
+    return {client.name: client.stats() for client in (rajaongkir, midtrans)}
@@ -1,17 +1,89 @@
 import base64
-import requests
 
-def create_midtrans_transaction(payload, server_key):
+from django.conf import settings
+
+
+def snap_url():
+    env = getattr(settings, 'MIDTRANS_ENV', 'production')
+    return "https://app.midtrans.com/snap/v1/transactions" \
+        if env == 'production' else "https://app.sandbox.midtrans.com/snap/v1/transactions"
+
+
+def snap_headers(server_key):
     auth_string = base64.b64encode(f"{server_key}:".encode()).decode()
-    headers = {
+    return {
         "Accept": "application/json",
         "Content-Type": "application/json",
         "Authorization": f"Basic {auth_string}"
     }
-    response = requests.post(
-        url="https://app.sandbox.midtrans.com/snap/v1/transactions",
-        # url="https://app.midtrans.com/snap/v1/transactions Sandbox
-        headers=headers,
-        json=payload
-    )
-    return response
+
+
+def snap_payload(order, items, transaction_id):
+    """The Snap transaction request for an order (with its user loaded) and its items"""
+    transaction_details = {
+        "order_id": transaction_id,
+        "gross_amount": int(order.final_price),
+    }
+
+    name_parts = order.shipping_name.strip().split(' ')
+    first_name = name_parts[0]
+    last_name = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
+
+    customer_details = {
+        "first_name": first_name,
+        "last_name": last_name,
+        "email": order.user.email,
+        "phone": order.shipping_phone,
+        "billing_address": {
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": order.user.email,
+            "phone": order.shipping_phone,
+            "address": order.shipping_address,
+            "city": order.shipping_city,
+            "postal_code": order.shipping_postal_code,
+            "country_code": "IDN"
+        },
+        "shipping_address": {
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": order.user.email,
+            "phone": order.shipping_phone,
+            "address": order.shipping_address,
+            "city": order.shipping_city,
+            "postal_code": order.shipping_postal_code,
+            "country_code": "IDN"
+        }
+    }
+
+    item_details = []
+    for item in items:
+        item_details.append({
+            "id": f"ITEM-{item.id}",
+            "price": int(item.price),
+            "quantity": item.quantity,
+            "name": f"{item.product_name} - {item.variant_name}"
+        })
+
+    if order.shipping_cost > 0:
+        item_details.append({
+            "id": f"SHIPPING-{order.id}",
+            "price": int(order.shipping_cost),
+            "quantity": 1,
+            "name": f"Shipping Cost ({order.shipping_courier})"
+        })
+
+    if order.discount > 0:
+        item_details.append({
+            "id": f"DISCOUNT-{order.id}",
+            "price": -int(order.discount),
+            "quantity": 1,
+            "name": "Discount"
+        })
+
+    return {
+        "transaction_details": transaction_details,
+        "customer_details": customer_details,
+        "item_details": item_details
+    }
+
@@ -0,0 +1,206 @@
+"""
+Stock reservation ledger.
+
+Placing an order no longer takes stock from ``ProductVariant.stock``. Instead
+each order line gets a ``StockReservation`` hold that expires after
+``STOCK_RESERVATION_TTL_MINUTES``. Physical stock is only decremented when the
+order is paid, and available stock is ``stock - active holds``.
+
+Every change to the holds also refreshes ``ProductVariant.held_stock`` and
+the product summaries, so the catalog can filter and sort on availability
+without reading the ledger. Holds that expire stay counted there until
+``release_expired`` sweeps them.
+
+A payment can arrive after its holds expired or were swept. Its stock is
+then reserved again at commit time, and ``StockUnavailable`` is raised when
+other orders have taken it in the meantime.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products.cache import bump_version
+from products.changes import record_changes
+from products.models import ProductVariant
+from products.summaries import refresh_variant_summaries
+from ..models import StockReservation
+
+
+class StockUnavailable(Exception):
+    """A paid order's lapsed holds can no longer be covered by the stock left"""
+
+    def __init__(self, variant_ids):
+        self.variant_ids = variant_ids
+        super().__init__(f"Not enough stock left for variants {', '.join(map(str, variant_ids))}")
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_TTL_MINUTES', 60))
+
+
+def held_quantities(variant_ids, now=None):
+    """Return {variant_id: quantity held by unexpired active reservations}"""
+    now = now or timezone.now()
+    rows = (
+        StockReservation.objects
+        .filter(product_variant_id__in=variant_ids, status='active', expires_at__gt=now)
+        .values('product_variant_id')
+        .annotate(total=Sum('quantity'))
+    )
+    return {row['product_variant_id']: row['total'] for row in rows}
+
+
+def available_stock(variants, now=None):
+    """Return {variant_id: stock that can still be reserved} for the given variants"""
+    held = held_quantities([variant.pk for variant in variants], now=now)
+    return {variant.pk: variant.stock - held.get(variant.pk, 0) for variant in variants}
+
+
+def refresh_held_stock(variant_ids, now=None):
+    """Recompute ``held_stock`` of the given variants from their unexpired active holds"""
+    variant_ids = set(variant_ids)
+    if not variant_ids:
+        return 0
+    now = now or timezone.now()
+    holds = (
+        StockReservation.objects
+        .filter(product_variant=OuterRef('pk'), status='active', expires_at__gt=now)
+        .order_by().values('product_variant').annotate(total=Sum('quantity')).values('total')
+    )
+    updated = ProductVariant.objects.filter(pk__in=variant_ids).update(
+        held_stock=Coalesce(Subquery(holds), Value(0))
+    )
+    # Bulk updates skip model signals
+    bump_version(ProductVariant)
+    record_changes(ProductVariant, variant_ids, 'updated')
+    refresh_variant_summaries(variant_ids)
+    return updated
+
+
+def reserve(order, quantities):
+    """Create active holds for ``{variant_id: quantity}`` on behalf of ``order``"""
+    expires_at = timezone.now() + reservation_ttl()
+    holds = StockReservation.objects.bulk_create([
+        StockReservation(
+            order=order,
+            product_variant_id=variant_id,
+            quantity=quantity,
+            expires_at=expires_at,
+        )
+        for variant_id, quantity in quantities.items()
+    ])
+    refresh_held_stock(quantities)
+    return holds
+
+
+def apply_stock_deltas(deltas):
+    """Add ``{variant_id: delta}`` to variant stock with a single UPDATE"""
+    deltas = {variant_id: delta for variant_id, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    updated = ProductVariant.objects.filter(pk__in=deltas).update(
+        stock=Case(
+            *[When(pk=variant_id, then=F('stock') + delta) for variant_id, delta in deltas.items()],
+            default=F('stock'),
+        ),
+        updated_at=timezone.now(),
+    )
+    # Bulk updates skip model signals
+    bump_version(ProductVariant)
+    record_changes(ProductVariant, deltas, 'updated')
+    refresh_variant_summaries(deltas)
+    return updated
+
+
+def _sum_by_variant(rows):
+    totals = {}
+    for variant_id, quantity in rows:
+        if variant_id is not None:
+            totals[variant_id] = totals.get(variant_id, 0) + quantity
+    return totals
+
+
+@transaction.atomic
+def commit_order(order):
+    """
+    Turn an order's holds into sold stock once it has been paid. Holds that
+    expired or were released are only committed if the stock they covered
+    is still available; otherwise ``StockUnavailable`` is raised and nothing
+    is committed.
+    """
+    now = timezone.now()
+    holds = list(
+        order.reservations.select_for_update()
+        .exclude(status='committed')
+        .values_list('id', 'product_variant_id', 'quantity', 'status', 'expires_at')
+    )
+    if not holds:
+        # Nothing to commit: already committed, or placed before reservations existed
+        return 0
+
+    lapsed = _sum_by_variant(
+        (v, q) for _, v, q, hold_status, expires_at in holds
+        if hold_status != 'active' or expires_at <= now
+    )
+    if lapsed:
+        # Reserve again, serialized with checkouts by the same variant locks
+        variants = list(
+            ProductVariant.objects.select_for_update().filter(pk__in=lapsed).order_by('pk')
+        )
+        available = available_stock(variants, now=now)
+        short = [variant.pk for variant in variants if available[variant.pk] < lapsed[variant.pk]]
+        if short:
+            raise StockUnavailable(short)
+
+    committed = StockReservation.objects.filter(pk__in=[hold[0] for hold in holds]).update(
+        status='committed', released_at=None
+    )
+    sold = _sum_by_variant((v, q) for _, v, q, _, _ in holds)
+    refresh_held_stock(sold, now=now)
+    apply_stock_deltas({variant_id: -quantity for variant_id, quantity in sold.items()})
+    return committed
+
+
+@transaction.atomic
+def release_order(order):
+    """Give an order's stock back: drop its holds and restock anything already sold"""
+    holds = list(
+        order.reservations.select_for_update()
+        .exclude(status='released')
+        .values_list('id', 'product_variant_id', 'quantity', 'status')
+    )
+    if holds:
+        sold = _sum_by_variant((v, q) for _, v, q, hold_status in holds if hold_status == 'committed')
+        StockReservation.objects.filter(pk__in=[hold[0] for hold in holds]).update(
+            status='released', released_at=timezone.now()
+        )
+        refresh_held_stock({hold[1] for hold in holds})
+    elif not order.reservations.exists():
+        # Orders placed before reservations existed took stock directly
+        sold = _sum_by_variant(order.items.values_list('product_variant_id', 'quantity'))
+    else:
+        sold = {}
+
+    apply_stock_deltas(sold)
+
+
+def release_expired(batch_size=500, now=None):
+    """Release expired active holds in batches and return how many were released"""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        expired = list(
+            StockReservation.objects
+            .filter(status='active', expires_at__lte=now)
+            .values_list('id', 'product_variant_id')[:batch_size]
+        )
+        if not expired:
+            return released
+        released += StockReservation.objects.filter(
+            pk__in=[pk for pk, _ in expired], status='active'
+        ).update(status='released', released_at=now)
+        refresh_held_stock({variant_id for _, variant_id in expired}, now=now)
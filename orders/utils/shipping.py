@@ -0,0 +1,470 @@
+"""
+Shipping quotes, cached in ``ShippingRate``.
+
+RajaOngkir prices parcels per weight step, so rates are stored per origin,
+destination, courier and weight bucket (``SHIPPING_WEIGHT_BUCKET_GRAMS``)
+and RajaOngkir is always asked for the heaviest weight of the bucket. Rates
+younger than ``SHIPPING_QUOTE_TTL`` seconds are served as they are. Older
+rates, up to ``SHIPPING_QUOTE_MAX_STALE`` seconds, are still served while a
+background thread fetches fresh ones; past that a quote waits for RajaOngkir.
+Couriers without service on a route have no rates to store, so that answer
+is kept in the Django cache for ``SHIPPING_EMPTY_QUOTE_TTL`` seconds instead.
+
+``get_quotes`` quotes several couriers at once: cached couriers are answered
+from one query and the rest are fetched concurrently, each courier being its
+own RajaOngkir call, within ``SHIPPING_QUOTE_DEADLINE`` seconds. Couriers
+that miss the deadline are reported as unavailable instead of holding up
+the others.
+
+The ``a``-prefixed functions are the same for async views: RajaOngkir is
+called over httpx and the database through the async ORM.
+
+Concurrent requests for the same route, weight bucket and couriers share one
+RajaOngkir call (see ``singleflight``), whether they come from threads,
+async views or, with ``SINGLEFLIGHT_ACROSS_WORKERS``, other workers.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from ..models import ShippingRate
+from . import gateway
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+COST_URL = "https://rajaongkir.komerce.id/api/v1/calculate/domestic-cost"
+QUOTE_META = {'message': "Success Calculate Domestic Shipping cost", 'code': 200, 'status': "success"}
+
+
+class ShippingQuoteError(Exception):
+    """RajaOngkir could not be reached and no usable cached rates exist"""
+
+
+def weight_bucket(weight):
+    """The bucket of a weight in grams; bucket n covers weights up to n steps"""
+    return max(1, math.ceil(weight / getattr(settings, 'SHIPPING_WEIGHT_BUCKET_GRAMS', 1000)))
+
+
+def courier_codes(courier):
+    # RajaOngkir takes several couriers joined with ':'
+    return sorted({code.strip().lower() for code in courier.split(':') if code.strip()})
+
+
+def _cost_request(origin, destination, weight, courier):
+    headers = {
+        'key': settings.RAJAONGKIR_API_KEY,
+        'content-type': "application/x-www-form-urlencoded"
+    }
+    payload = {'origin': origin, 'destination': destination, 'weight': weight, 'courier': courier}
+    return headers, payload
+
+
+def _decode(response):
+    try:
+        return response.json()
+    except ValueError:
+        logger.warning("RajaOngkir returned %s with a non-JSON body", response.status_code)
+        return {"raw_response": response.text, "status_code": response.status_code}
+
+
+quote_flights = SingleFlight('shipping-quote')
+
+
+def _flight_key(origin, destination, weight, courier):
+    return (str(origin), str(destination), weight_bucket(weight), ':'.join(courier_codes(courier)))
+
+
+def _fetch_rates(origin, destination, weight, courier):
+    headers, payload = _cost_request(origin, destination, weight, courier)
+    try:
+        # A cost query changes nothing upstream, so it is safe to retry
+        response = gateway.rajaongkir.post(COST_URL, headers=headers, data=payload, idempotent=True)
+    except requests.exceptions.RequestException as e:
+        raise ShippingQuoteError(f"Error connecting to RajaOngkir API: {e}") from e
+    return _decode(response)
+
+
+async def _afetch_rates(origin, destination, weight, courier):
+    headers, payload = _cost_request(origin, destination, weight, courier)
+    try:
+        response = await gateway.rajaongkir.apost(COST_URL, headers=headers, data=payload, idempotent=True)
+    except requests.exceptions.RequestException as e:
+        raise ShippingQuoteError(f"Error connecting to RajaOngkir API: {e}") from e
+    return _decode(response)
+
+
+def fetch_rates(origin, destination, weight, courier):
+    """
+    Ask RajaOngkir for the rates of one route; returns the decoded response.
+    The response is shared with concurrent callers and must not be modified.
+    """
+    key = _flight_key(origin, destination, weight, courier)
+    return quote_flights.do(key, _fetch_rates, origin, destination, weight, courier)
+
+
+async def afetch_rates(origin, destination, weight, courier):
+    """Async ``fetch_rates``"""
+    key = _flight_key(origin, destination, weight, courier)
+    return await quote_flights.ado(key, _afetch_rates, origin, destination, weight, courier)
+
+
+def parse_rates(data):
+    """The service entries of a successful response, or None for anything else"""
+    meta = data.get('meta') if isinstance(data, dict) else None
+    entries = data.get('data') if isinstance(data, dict) else None
+    if not isinstance(meta, dict) or meta.get('code') != 200 or not isinstance(entries, list):
+        return None
+    return entries
+
+
+def quote_response(rates):
+    return {
+        'meta': QUOTE_META,
+        'data': [
+            {
+                'name': rate.courier_name,
+                'code': rate.courier,
+                'service': rate.service,
+                'description': rate.description,
+                'cost': int(rate.cost),
+                'etd': rate.estimated_days,
+            }
+            for rate in rates
+        ],
+    }
+
+
+def _upsert_options():
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    if connection.features.supports_update_conflicts_with_target:
+        return {
+            'update_conflicts': True,
+            'unique_fields': ['origin_city', 'destination_city', 'weight_bucket', 'courier', 'service'],
+        }
+    return {'update_conflicts': True}
+
+
+@transaction.atomic
+def store_rates(origin, destination, bucket, couriers, entries, fetched_at=None):
+    """Replace the cached rates of a route with ``entries`` in one upsert"""
+    fetched_at = fetched_at or timezone.now()
+    rates = [
+        ShippingRate(
+            origin_city=origin,
+            destination_city=destination,
+            weight_bucket=bucket,
+            courier=str(entry.get('code', '')).lower(),
+            courier_name=entry.get('name') or '',
+            service=entry.get('service') or '',
+            description=entry.get('description') or '',
+            cost=entry.get('cost') or 0,
+            estimated_days=entry.get('etd') or '',
+            fetched_at=fetched_at,
+        )
+        for entry in entries
+    ]
+    # Services a courier no longer offers on this route
+    route = ShippingRate.objects.filter(
+        origin_city=origin, destination_city=destination, weight_bucket=bucket, courier__in=couriers
+    )
+    for courier in couriers:
+        services = [rate.service for rate in rates if rate.courier == courier]
+        route.filter(courier=courier).exclude(service__in=services).delete()
+
+    ShippingRate.objects.bulk_create(
+        rates,
+        update_fields=['courier_name', 'description', 'cost', 'estimated_days', 'fetched_at'],
+        **_upsert_options()
+    )
+    # No row records a courier without service, so remember that in the cache
+    empty = set(couriers) - {rate.courier for rate in rates}
+    if empty:
+        cache.set_many(
+            {_route_key('empty', origin, destination, bucket, courier): True for courier in empty},
+            timeout=getattr(settings, 'SHIPPING_EMPTY_QUOTE_TTL', 600),
+        )
+    return rates
+
+
+def _sorted_quote(rates):
+    return quote_response(sorted(rates, key=lambda rate: (rate.cost, rate.courier, rate.service)))
+
+
+def refresh_quote(origin, destination, bucket, courier):
+    """
+    Fetch a route from RajaOngkir and cache its rates. Returns the response
+    to send back: the cached rates, or RajaOngkir's own body when it did not
+    return a quote.
+    """
+    weight = bucket * getattr(settings, 'SHIPPING_WEIGHT_BUCKET_GRAMS', 1000)
+    data = fetch_rates(origin, destination, weight, courier)
+    entries = parse_rates(data)
+    if entries is None:
+        return data
+    return _sorted_quote(store_rates(origin, destination, bucket, courier_codes(courier), entries))
+
+
+async def arefresh_quote(origin, destination, bucket, courier):
+    weight = bucket * getattr(settings, 'SHIPPING_WEIGHT_BUCKET_GRAMS', 1000)
+    data = await afetch_rates(origin, destination, weight, courier)
+    entries = parse_rates(data)
+    if entries is None:
+        return data
+    rates = await sync_to_async(store_rates)(origin, destination, bucket, courier_codes(courier), entries)
+    return _sorted_quote(rates)
+
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def _pool(name, workers):
+    with _executor_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    return _executors[name]
+
+
+def _get_executor():
+    return _pool('shipping-quote', getattr(settings, 'SHIPPING_QUOTE_WORKERS', 8))
+
+
+def run_in_background(func, *args):
+    def run():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Background shipping quote refresh failed")
+        finally:
+            connections.close_all()
+    # A pool of its own, so refreshes never hold up the calls a request waits for
+    return _pool('shipping-refresh', getattr(settings, 'SHIPPING_REFRESH_WORKERS', 2)).submit(run)
+
+
+def rate_freshness(rates, now=None):
+    """'fresh', 'stale' (servable while refreshing) or None when there is nothing usable"""
+    if not rates:
+        return None
+    age = (now or timezone.now()) - min(rate.fetched_at for rate in rates)
+    if age <= timedelta(seconds=getattr(settings, 'SHIPPING_QUOTE_TTL', 21600)):
+        return 'fresh'
+    if age <= timedelta(seconds=getattr(settings, 'SHIPPING_QUOTE_MAX_STALE', 86400)):
+        return 'stale'
+    return None
+
+
+def _route_key(kind, origin, destination, bucket, courier):
+    digest = hashlib.md5(f'{origin}:{destination}:{bucket}:{courier}'.encode()).hexdigest()
+    return f'shipping:{kind}:{digest}'
+
+
+def _known_empty(origin, destination, bucket, couriers):
+    """The couriers recently found to have no service on the route"""
+    if not couriers:
+        return set()
+    keys = {_route_key('empty', origin, destination, bucket, courier): courier for courier in couriers}
+    return {keys[key] for key in cache.get_many(list(keys))}
+
+
+def _refresh_later(origin, destination, bucket, courier):
+    lock = _route_key('refresh', origin, destination, bucket, courier)
+    # One refresh per route at a time, across every worker sharing the cache
+    if not cache.add(lock, 1, timeout=60):
+        return
+
+    def refresh():
+        try:
+            refresh_quote(origin, destination, bucket, courier)
+        finally:
+            cache.delete(lock)
+    run_in_background(refresh)
+
+
+def _route_rates(origin, destination, bucket, couriers):
+    return ShippingRate.objects.filter(
+        origin_city=origin, destination_city=destination, weight_bucket=bucket, courier__in=couriers
+    ).order_by('cost', 'courier', 'service')
+
+
+def _cached_quote(origin, destination, bucket, couriers, rates):
+    """The response for cached rates that cover every courier, or None"""
+    uncovered = set(couriers) - {rate.courier for rate in rates}
+    if uncovered - _known_empty(origin, destination, bucket, uncovered):
+        return None
+    if not rates:
+        return quote_response([])
+    freshness = rate_freshness(rates)
+    if freshness == 'stale':
+        # Stale while revalidate
+        _refresh_later(origin, destination, bucket, ':'.join(couriers))
+    return quote_response(rates) if freshness is not None else None
+
+
+def get_quote(origin, destination, weight, courier):
+    """Return the shipping quote response for a parcel of ``weight`` grams"""
+    bucket = weight_bucket(weight)
+    couriers = courier_codes(courier)
+    rates = list(_route_rates(origin, destination, bucket, couriers))
+    quote = _cached_quote(origin, destination, bucket, couriers, rates)
+    if quote is not None:
+        return quote
+    return refresh_quote(origin, destination, bucket, ':'.join(couriers))
+
+
+async def aget_quote(origin, destination, weight, courier):
+    """Async ``get_quote``"""
+    bucket = weight_bucket(weight)
+    couriers = courier_codes(courier)
+    rates = [rate async for rate in _route_rates(origin, destination, bucket, couriers)]
+    # Scheduling a refresh talks to the shared cache
+    quote = await sync_to_async(_cached_quote)(origin, destination, bucket, couriers, rates)
+    if quote is not None:
+        return quote
+    return await arefresh_quote(origin, destination, bucket, ':'.join(couriers))
+
+
+def etd_days(etd):
+    """The first number of an estimate such as '2-3 day', for sorting"""
+    match = re.search(r'\d+', etd or '')
+    return int(match.group()) if match else math.inf
+
+
+def _fetch_many(origin, destination, bucket, couriers):
+    """
+    Fetch each courier with its own RajaOngkir call, concurrently. Returns
+    {courier: decoded response or ShippingQuoteError}; couriers that did not
+    answer before the deadline are left out.
+    """
+    weight = bucket * getattr(settings, 'SHIPPING_WEIGHT_BUCKET_GRAMS', 1000)
+    executor = _get_executor()
+    futures = {
+        executor.submit(fetch_rates, origin, destination, weight, courier): courier
+        for courier in couriers
+    }
+    done, not_done = wait(futures, timeout=getattr(settings, 'SHIPPING_QUOTE_DEADLINE', 5))
+    for future in not_done:
+        # Calls already running finish in the background, bounded by the gateway timeouts
+        future.cancel()
+    return _results(futures, done)
+
+
+async def _afetch_many(origin, destination, bucket, couriers):
+    """Async ``_fetch_many``; calls past the deadline are cancelled"""
+    weight = bucket * getattr(settings, 'SHIPPING_WEIGHT_BUCKET_GRAMS', 1000)
+    tasks = {
+        asyncio.ensure_future(afetch_rates(origin, destination, weight, courier)): courier
+        for courier in couriers
+    }
+    done, pending = await asyncio.wait(tasks, timeout=getattr(settings, 'SHIPPING_QUOTE_DEADLINE', 5))
+    for task in pending:
+        task.cancel()
+    return _results(tasks, done)
+
+
+def _results(futures, done):
+    results = {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except ShippingQuoteError as e:
+            results[futures[future]] = e
+    return results
+
+
+def _split_cached(origin, destination, bucket, couriers, rates):
+    """Split cached rates into the servable ones and the couriers that must be fetched"""
+    cached = {courier: [] for courier in couriers}
+    for rate in rates:
+        cached[rate.courier].append(rate)
+
+    servable = []
+    missing = []
+    for courier in couriers:
+        freshness = rate_freshness(cached[courier])
+        if freshness == 'stale':
+            _refresh_later(origin, destination, bucket, courier)
+        if freshness is None:
+            missing.append(courier)
+        else:
+            servable += cached[courier]
+    known_empty = _known_empty(origin, destination, bucket, missing)
+    return servable, [courier for courier in missing if courier not in known_empty]
+
+
+def _read_fetched(missing, fetched):
+    """Return ({courier: service entries}, unavailable) for the fetched couriers"""
+    quoted = {}
+    unavailable = []
+    for courier in missing:
+        data = fetched.get(courier)
+        if data is None:
+            unavailable.append({'courier': courier, 'detail': "RajaOngkir did not answer in time"})
+            continue
+        if isinstance(data, ShippingQuoteError):
+            unavailable.append({'courier': courier, 'detail': str(data)})
+            continue
+        entries = parse_rates(data)
+        if entries is None:
+            meta = data.get('meta') if isinstance(data, dict) else None
+            detail = meta.get('message') if isinstance(meta, dict) else None
+            unavailable.append({'courier': courier, 'detail': detail or "Invalid response from RajaOngkir"})
+            continue
+        quoted[courier] = entries
+    return quoted, unavailable
+
+
+def _store_quoted(origin, destination, bucket, quoted):
+    rates = []
+    for courier, entries in quoted.items():
+        rates += store_rates(origin, destination, bucket, [courier], entries)
+    return rates
+
+
+def _merged_response(rates, unavailable):
+    rates.sort(key=lambda rate: (rate.cost, etd_days(rate.estimated_days), rate.courier, rate.service))
+    response = quote_response(rates)
+    response['unavailable'] = unavailable
+    return response
+
+
+def get_quotes(origin, destination, weight, couriers):
+    """
+    Quote several couriers at once. Returns the quote response with the
+    services of every courier that answered, cheapest and then fastest
+    first, and an ``unavailable`` list for the couriers that did not.
+    """
+    bucket = weight_bucket(weight)
+    couriers = sorted({code for courier in couriers for code in courier_codes(courier)})
+    rates, missing = _split_cached(
+        origin, destination, bucket, couriers, _route_rates(origin, destination, bucket, couriers)
+    )
+    fetched = _fetch_many(origin, destination, bucket, missing) if missing else {}
+    quoted, unavailable = _read_fetched(missing, fetched)
+    rates += _store_quoted(origin, destination, bucket, quoted)
+    return _merged_response(rates, unavailable)
+
+
+async def aget_quotes(origin, destination, weight, couriers):
+    """Async ``get_quotes``"""
+    bucket = weight_bucket(weight)
+    couriers = sorted({code for courier in couriers for code in courier_codes(courier)})
+    cached = [rate async for rate in _route_rates(origin, destination, bucket, couriers)]
+    rates, missing = await sync_to_async(_split_cached)(origin, destination, bucket, couriers, cached)
+    fetched = await _afetch_many(origin, destination, bucket, missing) if missing else {}
+    quoted, unavailable = _read_fetched(missing, fetched)
+    if quoted:
+        rates += await sync_to_async(_store_quoted)(origin, destination, bucket, quoted)
+    return _merged_response(rates, unavailable)
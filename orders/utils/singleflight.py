@@ -0,0 +1,197 @@
+"""
+Request coalescing for identical upstream calls.
+
+When many requests need the same upstream answer at once, only the first
+one (the leader) makes the call; the others wait for it and get the same
+result, or the same exception. Threads and asyncio tasks join the same
+flights, whichever of them leads. A flight ends with its call, so later
+callers start a new one: this caps upstream calls to the number of distinct
+keys in flight and caches nothing.
+
+With ``SINGLEFLIGHT_ACROSS_WORKERS`` the leader also takes a lock in the
+Django cache, so one worker process makes the call and the leaders of the
+others poll the cache for its result, for up to ``SINGLEFLIGHT_WAIT``
+seconds, before calling anyway. This needs a cache shared by the workers.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Seconds between checks for another worker's result
+POLL_INTERVAL = 0.05
+# Seconds a result stays in the cache for the workers polling for it
+RESULT_TTL = 5
+
+_missing = object()
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Set when an async leader was torn down before its call finished
+        self.abandoned = False
+        self.waiters = []  # (loop, future) of the async callers
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _resolve(future, call):
+    if future.done():
+        return
+    if call.error is not None:
+        future.set_exception(call.error)
+    else:
+        future.set_result(call)
+
+
+class SingleFlight:
+    """
+    One in-flight call per key. ``do`` is for threads, ``ado`` for coroutines;
+    keys must be hashable and their ``repr`` stable across processes.
+    """
+
+    def __init__(self, name, across_workers=None, wait=None):
+        self.name = name
+        self.across_workers = across_workers
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.calls = {}
+        # Keeps the tasks of async leaders alive until they finish
+        self.tasks = set()
+
+    def get_across_workers(self):
+        if self.across_workers is not None:
+            return self.across_workers
+        return getattr(settings, 'SINGLEFLIGHT_ACROSS_WORKERS', False)
+
+    def get_wait(self):
+        return self.wait or getattr(settings, 'SINGLEFLIGHT_WAIT', 15)
+
+    def _join(self, key, waiter=None):
+        """Return (call, is_leader); ``waiter`` is registered on a call led by someone else"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = _Call()
+                return call, True
+            if waiter is not None:
+                call.waiters.append(waiter)
+            return call, False
+
+    def _finish(self, key, call, result=None, error=None, abandoned=False):
+        with self.lock:
+            call.result, call.error, call.abandoned = result, error, abandoned
+            del self.calls[key]
+            call.done.set()
+            waiters, call.waiters = call.waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future, call)
+            except RuntimeError:
+                # That caller's event loop is gone
+                pass
+
+    def _cache_keys(self, key):
+        digest = hashlib.md5(repr(key).encode()).hexdigest()
+        prefix = f'singleflight:{self.name}:{digest}'
+        return f'{prefix}:lock', f'{prefix}:result'
+
+    def do(self, key, func, *args):
+        """Return ``func(*args)``, sharing the call with concurrent callers of ``key``"""
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                try:
+                    result = self._call_shared(key, func, *args)
+                except Exception as e:
+                    self._finish(key, call, error=e)
+                    raise
+                except BaseException:
+                    self._finish(key, call, abandoned=True)
+                    raise
+                self._finish(key, call, result)
+                return result
+            call.done.wait()
+            if not call.abandoned:
+                return call.outcome()
+
+    def _call_shared(self, key, func, *args):
+        if not self.get_across_workers():
+            return func(*args)
+        lock_key, result_key = self._cache_keys(key)
+        deadline = time.monotonic() + self.get_wait()
+        while not cache.add(lock_key, 1, timeout=self.get_wait()):
+            # The holder publishes its result before releasing the lock
+            time.sleep(POLL_INTERVAL)
+            result = cache.get(result_key, _missing)
+            if result is not _missing:
+                return result
+            if time.monotonic() >= deadline:
+                # The other worker is too slow or died holding the lock
+                return func(*args)
+        try:
+            result = func(*args)
+            cache.set(result_key, result, timeout=RESULT_TTL)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    async def ado(self, key, func, *args):
+        """Async ``do``; ``func`` returns a coroutine"""
+        loop = asyncio.get_running_loop()
+        while True:
+            future = loop.create_future()
+            call, leader = self._join(key, (loop, future))
+            if leader:
+                # The call runs in its own task so that cancelling this caller,
+                # e.g. at a deadline, does not cancel it for the others
+                task = loop.create_task(self._alead(key, call, func, *args))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                await asyncio.shield(task)
+                return call.outcome()
+            call = await future
+            if not call.abandoned:
+                return call.result
+
+    async def _alead(self, key, call, func, *args):
+        try:
+            result = await self._acall_shared(key, func, *args)
+        except asyncio.CancelledError:
+            # The event loop is shutting down; let a waiting caller lead instead
+            self._finish(key, call, abandoned=True)
+            raise
+        except Exception as e:
+            self._finish(key, call, error=e)
+        else:
+            self._finish(key, call, result)
+
+    async def _acall_shared(self, key, func, *args):
+        if not self.get_across_workers():
+            return await func(*args)
+        lock_key, result_key = self._cache_keys(key)
+        deadline = time.monotonic() + self.get_wait()
+        while not await cache.aadd(lock_key, 1, timeout=self.get_wait()):
+            # The holder publishes its result before releasing the lock
+            await asyncio.sleep(POLL_INTERVAL)
+            result = await cache.aget(result_key, _missing)
+            if result is not _missing:
+                return result
+            if time.monotonic() >= deadline:
+                return await func(*args)
+        try:
+            result = await func(*args)
+            await cache.aset(result_key, result, timeout=RESULT_TTL)
+            return result
+        finally:
+            await cache.adelete(lock_key)
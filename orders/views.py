@@ -3,35 +3,69 @@ from rest_framework.decorators import action
 import uuid
 import os
 import requests
-import base64
 import logging
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from rest_framework import permissions, status, generics
 from rest_framework.response import Response
-from .models import Order, ShippingRate, PaymentTransaction
+from gudangpd_api.conditional import ConditionalGetMixin
+from gudangpd_api.fieldsets import SparseQuerysetMixin
+from gudangpd_api.values import ValuesListMixin
+from gudangpd_api.pagination import OrderKeysetPagination
+from .models import Order, OrderItem, ShippingRate, PaymentTransaction
 from .serializers import (
-    OrderCreateSerializer, OrderListSerializer, OrderDetailSerializer,
+    OrderCreateSerializer, OrderListSerializer, OrderHistorySerializer, OrderDetailSerializer,
     ShippingRateSerializer, ShippingCostRequestSerializer
 )
+from .utils import gateway, midtrans, reservations, shipping
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ConditionalGetMixin, SparseQuerysetMixin, ValuesListMixin, viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = OrderKeysetPagination
+    sparse_required_fields = ('id', 'created_at')
+    # Items are rendered together with their variant
+    sparse_prefetches = {
+        'items': Prefetch('items', queryset=OrderItem.objects.select_related('product_variant').order_by('id')),
+    }
+    
+    def get_conditional_related_fields(self):
+        # Order details embed the current state of each item's variant
+        if self.action == 'retrieve':
+            return ('items__product_variant__updated_at',)
+        return ()
     
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Order.objects.all().order_by('-created_at')
-        return Order.objects.filter(user=user).order_by('-created_at')
+            queryset = Order.objects.all().order_by('-created_at')
+        else:
+            queryset = Order.objects.filter(user=user).order_by('-created_at')
+        
+        order_status = self.request.query_params.get('status')
+        if order_status:
+            queryset = queryset.filter(status=order_status)
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(self.sparse_prefetches['items'])
+        return self.prune_queryset(queryset)
     
     def get_serializer_class(self):
         if self.action == 'create':
             return OrderCreateSerializer
         elif self.action == 'list':
             return OrderListSerializer
+        elif self.action == 'history':
+            return OrderHistorySerializer
         return OrderDetailSerializer
     
+    @action(detail=False)
+    def history(self, request):
+        """Orders with their items, served in two queries per page"""
+        # No ETag: the embedded items carry no timestamp to validate against
+        return super(ConditionalGetMixin, self).list(request)
+    
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         order = self.get_object()
@@ -42,14 +76,12 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        for item in order.items.all():
-            if item.product_variant:
-                product_variant = item.product_variant
-                product_variant.stock += item.quantity
-                product_variant.save()
-        
-        order.status = 'cancelled'
-        order.save()
+        with transaction.atomic():
+            # Drop the order's stock holds, or restock it if the order was already paid
+            reservations.release_order(order)
+            
+            order.status = 'cancelled'
+            order.save(update_fields=['status', 'updated_at'])
         
         return Response({"detail": "Order cancelled successfully"})
     
@@ -76,7 +108,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         # Update order
         order.shipping_cost = shipping_cost
         order.shipping_courier = shipping_courier
-        order.save()
+        order.save(update_fields=['shipping_cost', 'shipping_courier', 'updated_at'])
         
         return Response({"detail": "Shipping cost updated successfully"})
 
@@ -100,45 +132,31 @@ class CalculateShippingView(generics.GenericAPIView):
                     {"detail": "RajaOngkir API key not configured"},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
-
-            url = "https://rajaongkir.komerce.id/api/v1/calculate/domestic-cost"
-            headers = {
-                'key': api_key,
-                'content-type': "application/x-www-form-urlencoded"
-            }
-            
-            # Prepare payload as form data
-            payload = {
-                'origin': serializer.validated_data['origin_city'],
-                'destination': serializer.validated_data['destination_city'],
-                'weight': serializer.validated_data['weight'],
-                'courier': serializer.validated_data['courier']
-            }
             
-            try:
-                # Make request to RajaOngkir API with form-urlencoded data
-                response = requests.post(url, headers=headers, data=payload)
-                
-                # Log the entire response for debugging
-                print("RajaOngkir Response Status:", response.status_code)
-                print("RajaOngkir Response Headers:", response.headers)
-                print("RajaOngkir Response Content:", response.text)
-
-                try:
-                    # Try to parse JSON response
-                    raw_data = response.json()
-                    return Response(raw_data)
-                except ValueError:
-                    # If not JSON, return the raw text
+            route = (
+                serializer.validated_data['origin_city'],
+                serializer.validated_data['destination_city'],
+                serializer.validated_data['weight'],
+            )
+            couriers = serializer.validated_data.get('couriers')
+            if couriers:
+                quote = shipping.get_quotes(*route, couriers)
+                if not quote['data'] and quote['unavailable']:
                     return Response(
-                        {"raw_response": response.text, "status_code": response.status_code}
+                        {"detail": "No courier could be quoted", "unavailable": quote['unavailable']},
+                        status=status.HTTP_502_BAD_GATEWAY
                     )
-                
-            except requests.exceptions.RequestException as e:
+                return Response(quote)
+            
+            try:
+                # Served from ShippingRate when the route was quoted recently
+                quote = shipping.get_quote(*route, serializer.validated_data['courier'])
+            except shipping.ShippingQuoteError as e:
                 return Response(
-                    {"detail": f"Error connecting to RajaOngkir API: {str(e)}"},
+                    {"detail": str(e)},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
+            return Response(quote)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -147,7 +165,7 @@ class CreatePaymentView(generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request, order_id):
-        order = get_object_or_404(Order, id=order_id, user=request.user)
+        order = get_object_or_404(Order.objects.select_related('user'), id=order_id, user=request.user)
 
         if order.status != 'pending':
             return Response(
@@ -162,77 +180,9 @@ class CreatePaymentView(generics.GenericAPIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
             
-        env = getattr(settings, 'MIDTRANS_ENV', 'production')
-        api_url = "https://app.midtrans.com/snap/v1/transactions" \
-            if env == 'production' else "https://app.sandbox.midtrans.com/snap/v1/transactions"
-
+        api_url = midtrans.snap_url()
         transaction_id = f"{order.id}-{uuid.uuid4().hex[:8]}"
-        transaction_details = {
-            "order_id": transaction_id,
-            "gross_amount": int(order.final_price),
-        }
-
-        name_parts = order.shipping_name.strip().split(' ')
-        first_name = name_parts[0]
-        last_name = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
-
-        customer_details = {
-            "first_name": first_name,
-            "last_name": last_name,
-            "email": order.user.email,
-            "phone": order.shipping_phone,
-            "billing_address": {
-                "first_name": first_name,
-                "last_name": last_name,
-                "email": order.user.email,
-                "phone": order.shipping_phone,
-                "address": order.shipping_address,
-                "city": order.shipping_city,
-                "postal_code": order.shipping_postal_code,
-                "country_code": "IDN"
-            },
-            "shipping_address": {
-                "first_name": first_name,
-                "last_name": last_name,
-                "email": order.user.email,
-                "phone": order.shipping_phone,
-                "address": order.shipping_address,
-                "city": order.shipping_city,
-                "postal_code": order.shipping_postal_code,
-                "country_code": "IDN"
-            }
-        }
-
-        item_details = []
-        for item in order.items.all():
-            item_details.append({
-                "id": f"ITEM-{item.id}",
-                "price": int(item.price),
-                "quantity": item.quantity,
-                "name": f"{item.product_name} - {item.variant_name}"
-            })
-
-        if order.shipping_cost > 0:
-            item_details.append({
-                "id": f"SHIPPING-{order.id}",
-                "price": int(order.shipping_cost),
-                "quantity": 1,
-                "name": f"Shipping Cost ({order.shipping_courier})"
-            })
-
-        if order.discount > 0:
-            item_details.append({
-                "id": f"DISCOUNT-{order.id}",
-                "price": -int(order.discount),
-                "quantity": 1,
-                "name": "Discount"
-            })
-
-        payload = {
-            "transaction_details": transaction_details,
-            "customer_details": customer_details,
-            "item_details": item_details
-        }
+        payload = midtrans.snap_payload(order, order.items.all(), transaction_id)
 
         try:
             response = self.create_midtrans_transaction(api_url, server_key, payload)
@@ -275,13 +225,7 @@ class CreatePaymentView(generics.GenericAPIView):
             )
 
     def create_midtrans_transaction(self, api_url, server_key, payload):
-        auth_string = base64.b64encode(f"{server_key}:".encode()).decode()
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Basic {auth_string}"
-        }
-        return requests.post(api_url, headers=headers, json=payload)
+        return gateway.midtrans.post(api_url, headers=midtrans.snap_headers(server_key), json=payload)
 
 
 
@@ -299,7 +243,7 @@ class PaymentNotificationView(generics.GenericAPIView):
         
         # Find payment transaction
         try:
-            payment = PaymentTransaction.objects.get(transaction_id=transaction_id)
+            payment = PaymentTransaction.objects.select_related('order').get(transaction_id=transaction_id)
             order = payment.order
             
             # Update payment data
@@ -308,24 +252,30 @@ class PaymentNotificationView(generics.GenericAPIView):
             payment.raw_response = notification_data
             
             # Set status based on transaction_status and fraud_status
+            paid = False
             if transaction_status == 'capture':
                 if fraud_status == 'accept':
                     payment.status = 'success'
-                    order.status = 'paid'
-                    order.paid_at = timezone.now()
+                    paid = True
                 else:
                     payment.status = 'failed'
             elif transaction_status == 'settlement':
                 payment.status = 'success'
-                order.status = 'paid'
-                order.paid_at = timezone.now()
+                paid = True
             elif transaction_status == 'deny' or transaction_status == 'cancel' or transaction_status == 'expire':
                 payment.status = 'failed'
             elif transaction_status == 'pending':
                 payment.status = 'pending'
             
-            payment.save()
-            order.save()
+            with transaction.atomic():
+                payment.save(update_fields=[
+                    'transaction_status', 'fraud_status', 'raw_response', 'status', 'updated_at'
+                ])
+                
+                # Only the first successful notification changes the order; repeats
+                # of a settled payment do not write it again
+                if paid and order.paid_at is None:
+                    self.settle(order, payment)
             
             return Response({"status": "OK"})
         
@@ -333,4 +283,36 @@ class PaymentNotificationView(generics.GenericAPIView):
             return Response(
                 {"detail": "Payment transaction not found"},
                 status=status.HTTP_404_NOT_FOUND
-            )
\ No newline at end of file
+            )
+    
+    def settle(self, order, payment):
+        """Apply a successful payment to ``order`` unless a concurrent notification or cancel got there first"""
+        # The instance was read without a lock, so decide on the locked row
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.paid_at is not None:
+            return
+        if order.status == 'cancelled':
+            self.flag_for_review(order, payment, "Payment received for a cancelled order")
+        elif order.status == 'pending':
+            self.mark_paid(order, payment)
+    
+    def mark_paid(self, order, payment):
+        try:
+            # Held stock becomes sold stock on the first successful payment
+            reservations.commit_order(order)
+        except reservations.StockUnavailable as e:
+            # The holds lapsed before the payment and the stock went to other orders
+            self.flag_for_review(order, payment, str(e))
+            return
+        order.status = 'paid'
+        order.paid_at = timezone.now()
+        order.save(update_fields=['status', 'paid_at', 'updated_at'])
+    
+    def flag_for_review(self, order, payment, reason):
+        """Leave the order as it is and record why its payment needs a refund or a manual fix"""
+        logging.error(f"Order #{order.id}: {reason} (transaction {payment.transaction_id})")
+        order.payment_details = {
+            **(order.payment_details or {}),
+            'review': {'reason': reason, 'transaction_id': payment.transaction_id},
+        }
+        order.save(update_fields=['payment_details', 'updated_at'])
@@ -19,6 +19,7 @@ class CategoryAdmin(admin.ModelAdmin):
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'brand', 'category', 'created_at', 'updated_at')
     list_filter = ('brand', 'category')
+    list_select_related = ('brand', 'category')
     search_fields = ('name', 'description')
     inlines = [ProductVariantInline]
 
@@ -26,4 +27,5 @@ class ProductAdmin(admin.ModelAdmin):
 class ProductVariantAdmin(admin.ModelAdmin):
     list_display = ('id', 'product', 'name', 'price', 'reseller_price', 'stock', 'sku')
     list_filter = ('product',)
+    list_select_related = ('product',)
     search_fields = ('name', 'sku')
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Versioned response cache for catalog reads.
+
+Every catalog model has a version counter in the Django cache that is bumped
+whenever a row of that model is written. Cached responses are keyed on the
+versions of the models they were built from, so a write makes every older
+entry unreachable at once and a hit is never stale. Old entries simply age
+out of the cache.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+VERSION_KEY = 'catalog:version:{}'
+RESPONSE_KEY = 'catalog:response:{}'
+VALIDATORS_KEY = 'catalog:validators:{}'
+STATS_KEY = 'catalog:cache:{}'
+
+
+def _version_key(model):
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def _initial_version():
+    # Start from the clock rather than 1 so a counter that was evicted never
+    # comes back with a value that old responses were cached under
+    return int(time.time() * 1000)
+
+
+def get_versions(models):
+    """Return the current version of each model, creating missing counters"""
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(models):
+    for model in models:
+        key = _version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+
+
+def bump_version(*models):
+    """
+    Invalidate every cached response built from ``models``. Inside a
+    transaction the versions are bumped again on commit, so a response
+    built from the not yet committed state cannot outlive the write.
+    """
+    _bump(models)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(models))
+
+
+def _count(event):
+    key = STATS_KEY.format(event)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def cache_stats():
+    """Return the hit and miss counters of the catalog response cache"""
+    stats = cache.get_many([STATS_KEY.format('hits'), STATS_KEY.format('misses')])
+    hits = stats.get(STATS_KEY.format('hits'), 0)
+    misses = stats.get(STATS_KEY.format('misses'), 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+class CachedResponseMixin:
+    """
+    Serve ``list`` and ``retrieve`` from the cache. ``cache_models`` lists
+    every model the responses are built from. The conditional GET
+    validators of a view are cached under the same versions.
+    """
+    cache_models = ()
+
+    def _versioned_key(self, template, request):
+        versions = get_versions(self.cache_models)
+        params = sorted(request.query_params.lists())
+        # The host is part of the key because paginated responses embed absolute links
+        raw = f"{type(self).__name__}:{self.action}:{request.get_host()}{request.path}:{params}:{versions}"
+        return template.format(hashlib.md5(raw.encode()).hexdigest())
+
+    def get_cache_key(self, request):
+        return self._versioned_key(RESPONSE_KEY, request)
+
+    def get_validators_cache_key(self, request, detail):
+        return self._versioned_key(VALIDATORS_KEY, request)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            _count('hits')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        _count('misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 600))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,115 @@
+"""
+Catalog change feed.
+
+Every write to a brand, category, product or variant appends a
+``CatalogChange`` row: model signals cover single saves and deletes, and
+bulk paths call ``record_changes`` themselves. Rows are inserted once the
+writing transaction commits, so ids are handed out in commit order and a
+client that remembers the last id it saw never skips a change.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from gudangpd_api.values import compile_serializer
+from .models import Brand, CatalogChange, Category, Product, ProductVariant
+from .serializers import BrandSerializer, CategorySerializer, ProductSerializer, ProductVariantSerializer
+
+OBJECT_TYPES = {
+    Brand: ('brand', BrandSerializer),
+    Category: ('category', CategorySerializer),
+    Product: ('product', ProductSerializer),
+    ProductVariant: ('variant', ProductVariantSerializer),
+}
+MODELS = {object_type: model for model, (object_type, _) in OBJECT_TYPES.items()}
+MAX_LIMIT = 1000
+
+
+class ChangeFeedExpired(Exception):
+    """The requested cursor is older than the retained log"""
+
+
+def record_changes(model, ids, action):
+    """Log ``action`` ('created', 'updated' or 'deleted') for the ``model`` rows in ``ids``"""
+    object_type = OBJECT_TYPES[model][0]
+    changes = [CatalogChange(object_type=object_type, object_id=pk, action=action) for pk in ids]
+    if changes:
+        transaction.on_commit(lambda: CatalogChange.objects.bulk_create(changes))
+
+
+def current_cursor():
+    return CatalogChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def read_changes(since, limit=500, now=None):
+    """
+    Return ``(cursor, has_more, results)`` for the changes after ``since``.
+    Repeated changes of one object within a page collapse into the latest
+    one, and the current representation of each surviving object is
+    attached as ``data`` (None for deleted objects).
+    """
+    now = now or timezone.now()
+    oldest = CatalogChange.objects.order_by('id').values_list('id', flat=True).first()
+    if oldest is not None and since < oldest - 1:
+        raise ChangeFeedExpired()
+
+    # A commit racing with this read may still be inserting a lower id
+    settle = timedelta(seconds=getattr(settings, 'CATALOG_CHANGES_SETTLE_SECONDS', 1))
+    rows = list(
+        CatalogChange.objects
+        .filter(id__gt=since, changed_at__lte=now - settle)
+        .order_by('id')
+        .values('id', 'object_type', 'object_id', 'action', 'changed_at')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return since, False, []
+
+    latest = {}
+    for row in rows:
+        latest.pop((row['object_type'], row['object_id']), None)
+        latest[(row['object_type'], row['object_id'])] = row
+
+    live = {}
+    for object_type, model in MODELS.items():
+        ids = [
+            row['object_id'] for row in latest.values()
+            if row['object_type'] == object_type and row['action'] != 'deleted'
+        ]
+        if ids:
+            mapper = compile_serializer(OBJECT_TYPES[model][1]())
+            for item in mapper.map_rows(mapper.values(model.objects.filter(pk__in=ids))):
+                live[(object_type, item['id'])] = item
+
+    results = [
+        {
+            'cursor': row['id'],
+            'type': object_type,
+            'id': object_id,
+            # An object deleted after this page's change is reported by a later page
+            'action': row['action'],
+            'changed_at': row['changed_at'],
+            'data': live.get((object_type, object_id)),
+        }
+        for (object_type, object_id), row in latest.items()
+    ]
+    return rows[-1]['id'], has_more, results
+
+
+def prune_changes(days, batch_size=1000):
+    """Delete changes older than ``days`` in batches and return how many were deleted"""
+    cutoff = timezone.now() - timedelta(days=days)
+    # The newest change is always kept so that expired cursors can be told apart
+    newest = current_cursor()
+    deleted = 0
+    while True:
+        ids = list(
+            CatalogChange.objects.filter(changed_at__lt=cutoff, id__lt=newest)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += CatalogChange.objects.filter(pk__in=ids).delete()[0]
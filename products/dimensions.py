@@ -0,0 +1,137 @@
+"""
+Process-local cache of the brand and category tables.
+
+Both tables are tiny and almost never written, yet nearly every catalog read
+needs their names. Each worker keeps a size-bounded LRU of their serialized
+rows instead of joining them into every query. A write clears the writing
+worker's copy right away and bumps the model's version counter in the shared
+Django cache (see ``products.cache``); other workers compare that counter at
+most every ``CATALOG_DIMENSION_CHECK_SECONDS`` and drop their copy when it
+moved. Entries also expire after ``CATALOG_DIMENSION_TTL`` seconds, which
+bounds staleness even if the shared cache loses the counter.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+
+from .cache import get_versions
+from .models import Brand, Category
+
+
+class DimensionCache:
+
+    def __init__(self, model, serializer_path, maxsize=1000):
+        self.model = model
+        # Imported lazily: the serializers use this module
+        self.serializer_path = serializer_path
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # pk -> (expires_at, data)
+        self.version = None
+        self.checked_at = None
+
+    def __deepcopy__(self, memo):
+        # Serializer fields are deep-copied per instance; the cache is shared
+        return self
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.checked_at = None
+
+    def invalidate(self):
+        """Drop this worker's copy now and again once the current transaction commits"""
+        self.clear()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(self.clear)
+
+    def check_version(self, now):
+        interval = getattr(settings, 'CATALOG_DIMENSION_CHECK_SECONDS', 1)
+        if self.checked_at is not None and now - self.checked_at < interval:
+            return
+        version = get_versions([self.model])[0]
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            self.checked_at = now
+
+    def load(self, ids, now):
+        queryset = self.model.objects.order_by('pk')
+        if not self.entries:
+            # Cold: the whole table usually fits, so read it at once
+            rows = list(queryset[:self.maxsize])
+            leftover = set(ids) - {row.pk for row in rows}
+            if leftover:
+                rows += list(queryset.filter(pk__in=leftover))
+        else:
+            rows = list(queryset.filter(pk__in=ids))
+
+        serializer_class = import_string(self.serializer_path)
+        data = {item['id']: dict(item) for item in serializer_class(rows, many=True).data}
+        expires_at = now + getattr(settings, 'CATALOG_DIMENSION_TTL', 300)
+        with self.lock:
+            for pk, item in data.items():
+                self.entries[pk] = (expires_at, item)
+                self.entries.move_to_end(pk)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return data
+
+    def get_many(self, ids):
+        """Return {pk: serialized row} for the given ids; unknown ids are left out"""
+        now = time.monotonic()
+        self.check_version(now)
+        found = {}
+        missing = []
+        with self.lock:
+            for pk in ids:
+                if pk is None or pk in found:
+                    continue
+                entry = self.entries.get(pk)
+                if entry is not None and entry[0] > now:
+                    self.entries.move_to_end(pk)
+                    found[pk] = entry[1]
+                else:
+                    missing.append(pk)
+        if missing:
+            loaded = self.load(missing, now)
+            found.update((pk, loaded[pk]) for pk in missing if pk in loaded)
+        return found
+
+    def get(self, pk):
+        return self.get_many([pk]).get(pk)
+
+    def warm(self):
+        """Load the table ahead of the first lookup"""
+        self.clear()
+        self.check_version(time.monotonic())
+        self.load([], time.monotonic())
+
+
+brands = DimensionCache(Brand, 'products.serializers.BrandSerializer')
+categories = DimensionCache(Category, 'products.serializers.CategorySerializer')
+
+
+class DimensionField(serializers.Field):
+    """
+    Read-only field rendering a brand or category id from a ``DimensionCache``,
+    either as the whole serialized row or as one of its attributes.
+    """
+
+    def __init__(self, dimension, attr=None, **kwargs):
+        kwargs['read_only'] = True
+        self.dimension = dimension
+        self.attr = attr
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        data = self.dimension.get(value)
+        if data is None or self.attr is None:
+            return data
+        return data[self.attr]
@@ -0,0 +1,115 @@
+"""
+Streaming catalog export.
+
+Products are read in keyset chunks ordered by id, each chunk together with
+its variants, and rendered exactly like the product list. Only one chunk is
+held in memory at a time, so memory stays flat however large the catalog
+is. MySQL drivers buffer a whole result set client side even for
+``iterator()``, which is why the chunks are separate bounded queries rather
+than one long cursor.
+"""
+import csv
+import io
+import json
+import zlib
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from gudangpd_api.values import compile_serializer
+from .models import Product
+from .serializers import ProductSerializer
+
+# Same columns as the catalog import, so an export can be imported again;
+# stock is therefore physical stock, not what is left after holds
+CSV_COLUMNS = [
+    'product_id', 'product_name', 'description', 'brand', 'category', 'image_url',
+    'variant_id', 'variant_name', 'price', 'reseller_price', 'discount_price',
+    'sku', 'stock', 'weight',
+]
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Exports are streamed; this only renders error responses
+        return json.dumps(data).encode() + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Exports are streamed; this only renders error responses
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if isinstance(data, dict):
+            writer.writerow(data.keys())
+            writer.writerow(data.values())
+        return buffer.getvalue().encode()
+
+
+def iter_chunks(after=0, chunk_size=500):
+    """Yield lists of serialized products with an id greater than ``after``"""
+    mapper = compile_serializer(ProductSerializer())
+    while True:
+        rows = list(mapper.values(Product.objects.filter(pk__gt=after).order_by('pk'))[:chunk_size])
+        if not rows:
+            return
+        yield mapper.map_rows(rows)
+        after = rows[-1]['pk']
+
+
+def _ndjson(products):
+    return ''.join(
+        json.dumps(product, ensure_ascii=False, separators=(',', ':')) + '\n' for product in products
+    )
+
+
+def _csv(products):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for product in products:
+        for variant in product['variants']:
+            writer.writerow([
+                product['id'], product['name'], product['description'],
+                product.get('brand_name'), product.get('category_name'), product['image_url'],
+                variant['id'], variant['name'], variant['price'], variant['reseller_price'],
+                variant['discount_price'], variant['sku'], variant['stock'], variant['weight'],
+            ])
+    return buffer.getvalue()
+
+
+def _text_blocks(file_format, after, chunk_size):
+    if file_format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(CSV_COLUMNS)
+        yield buffer.getvalue()
+        encode = _csv
+    else:
+        encode = _ndjson
+    for products in iter_chunks(after, chunk_size):
+        yield encode(products)
+
+
+def export_stream(file_format='ndjson', after=0, chunk_size=None, compress=False):
+    """
+    Yield the catalog as bytes, one chunk of products at a time. NDJSON has
+    one product with its variants per line, CSV one variant per row. With
+    ``compress`` the output is a single gzip stream flushed after every chunk.
+    """
+    chunk_size = chunk_size or getattr(settings, 'CATALOG_EXPORT_CHUNK_SIZE', 500)
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    for block in _text_blocks(file_format, after, chunk_size):
+        data = block.encode()
+        if compressor:
+            data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield data
+    if compressor:
+        yield compressor.flush()
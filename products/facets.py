@@ -0,0 +1,78 @@
+"""
+Catalog facet counts.
+
+Facet counts for the current filter are computed with one grouped query per
+dimension (brand, category, named from the dimension cache) and one
+conditional aggregate for price buckets and availability over the product
+summary columns, so the cost does not depend on how many facet values exist.
+"""
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .dimensions import brands, categories
+
+
+def price_buckets():
+    """Return (lower, upper) bounds for CATALOG_PRICE_BUCKETS, open at both ends"""
+    bounds = [None, *getattr(settings, 'CATALOG_PRICE_BUCKETS', []), None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _price_filter(lower, upper):
+    condition = Q()
+    if lower is not None:
+        condition &= Q(min_effective_price__gte=lower)
+    if upper is not None:
+        condition &= Q(min_effective_price__lt=upper)
+    return condition
+
+
+def _name(rows, pk, attr):
+    row = rows.get(pk)
+    return row[attr] if row else None
+
+
+def compute_facets(queryset):
+    queryset = queryset.order_by()
+
+    # Names come from the dimension cache rather than a join
+    brand_counts = list(
+        queryset.values('brand_id').annotate(count=Count('pk')).order_by('-count', 'brand_id')
+    )
+    category_counts = list(
+        queryset.values('category_id').annotate(count=Count('pk')).order_by('-count', 'category_id')
+    )
+    brand_rows = brands.get_many([row['brand_id'] for row in brand_counts])
+    category_rows = categories.get_many([row['category_id'] for row in category_counts])
+
+    buckets = price_buckets()
+    aggregates = {
+        f'price_{i}': Count('pk', filter=_price_filter(lower, upper) & Q(variant_count__gt=0))
+        for i, (lower, upper) in enumerate(buckets)
+    }
+    aggregates['available'] = Count('pk', filter=Q(available_stock__gt=0))
+    aggregates['unavailable'] = Count('pk', filter=Q(available_stock__lte=0))
+    counts = queryset.aggregate(**aggregates)
+
+    return {
+        'brand': [
+            {'id': row['brand_id'], 'name': _name(brand_rows, row['brand_id'], 'brand_name'), 'count': row['count']}
+            for row in brand_counts
+        ],
+        'category': [
+            {
+                'id': row['category_id'],
+                'name': _name(category_rows, row['category_id'], 'category_name'),
+                'count': row['count'],
+            }
+            for row in category_counts
+        ],
+        'price': [
+            {'min': lower, 'max': upper, 'count': counts[f'price_{i}']}
+            for i, (lower, upper) in enumerate(buckets)
+        ],
+        'availability': {
+            'in_stock': counts['available'],
+            'out_of_stock': counts['unavailable'],
+        },
+    }
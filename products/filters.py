@@ -0,0 +1,31 @@
+from rest_framework.filters import BaseFilterBackend
+
+
+class ProductOrdering(BaseFilterBackend):
+    """
+    Order products by ``?ordering=`` (price or available stock, '-' for
+    descending) on the indexed summary columns, or ``?search=`` results by
+    relevance. Cursor pagination looks for a filter backend with
+    ``get_ordering`` and pages on the same ordering.
+    """
+    orderings = {
+        'price': ('min_effective_price', 'id'),
+        'stock': ('available_stock', 'id'),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering', '')
+        fields = self.orderings.get(ordering.lstrip('-'))
+        if fields:
+            if ordering.startswith('-'):
+                return tuple(f'-{field}' for field in fields)
+            return fields
+        if request.query_params.get('search'):
+            return ('-search_rank', 'id')
+        return None
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if ordering:
+            return queryset.order_by(*ordering)
+        return queryset
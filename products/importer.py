@@ -0,0 +1,246 @@
+"""
+Streaming catalog import.
+
+Rows are read one at a time from a CSV or NDJSON stream, validated in
+batches with ``CatalogImportRowSerializer`` and upserted with
+``bulk_create(update_conflicts=True)``, one transaction per batch. Product and
+variant ids are assigned externally, so they are the upsert keys; brands and
+categories are matched by name and created when missing. Optional columns a
+row leaves out, or leaves empty in a CSV, keep their stored values.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from orders.utils.reservations import held_quantities
+from .cache import bump_version
+from .changes import record_changes
+from .models import Brand, Category, Product, ProductVariant
+from .search import index_products
+from .serializers import CatalogImportRowSerializer
+from .summaries import refresh_product_summaries
+
+PRODUCT_UPDATE_FIELDS = ['name', 'description', 'brand', 'category', 'image_url', 'updated_at']
+VARIANT_UPDATE_FIELDS = [
+    'product', 'name', 'price', 'reseller_price', 'discount_price',
+    'sku', 'stock', 'weight', 'updated_at',
+]
+# Row keys that may be left out; each names the field it updates
+OPTIONAL_PRODUCT_FIELDS = ['description', 'brand', 'category', 'image_url']
+OPTIONAL_VARIANT_FIELDS = ['discount_price', 'stock']
+MAX_REPORTED_ERRORS = 1000
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+def detect_format(filename):
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    raise CatalogImportError("Cannot tell the file format, pass 'csv' or 'ndjson'")
+
+
+def read_rows(stream, file_format):
+    """Yield ``(line_number, row)`` pairs from a binary stream without loading it whole"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            # Empty cells mean "not given" so that field defaults apply
+            yield reader.line_num, {key: value for key, value in row.items() if value not in ('', None)}
+    elif file_format == 'ndjson':
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+                continue
+            yield line_number, row
+    else:
+        raise CatalogImportError(f"Unsupported format: {file_format}")
+
+
+def _upsert_options():
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    if connection.features.supports_update_conflicts_with_target:
+        return {'update_conflicts': True, 'unique_fields': ['id']}
+    return {'update_conflicts': True}
+
+
+class CatalogImporter:
+
+    def __init__(self, batch_size=500, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.report = {
+            'rows': 0,
+            'valid': 0,
+            'imported': 0,
+            'error_count': 0,
+            'errors': [],
+            'dry_run': dry_run,
+        }
+
+    def add_error(self, line, errors):
+        self.report['error_count'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'line': line, 'errors': errors})
+
+    def run(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return self.report
+            self.process_batch(batch)
+
+    def process_batch(self, batch):
+        valid = []
+        for line, row in batch:
+            self.report['rows'] += 1
+            if not isinstance(row, dict):
+                self.add_error(line, {'non_field_errors': [f"Invalid row: {row}"]})
+                continue
+            serializer = CatalogImportRowSerializer(data=row)
+            if serializer.is_valid():
+                valid.append((line, serializer.validated_data))
+            else:
+                self.add_error(line, serializer.errors)
+
+        if valid:
+            valid = self.check_holds(self.check_skus(valid))
+        self.report['valid'] += len(valid)
+        if not valid or self.dry_run:
+            return
+
+        try:
+            self.upsert([data for _, data in valid])
+        except DatabaseError as e:
+            for line, _ in valid:
+                self.add_error(line, {'non_field_errors': [f"Batch rejected by the database: {e}"]})
+            return
+        self.report['imported'] += len(valid)
+
+    def check_skus(self, valid):
+        """Drop rows whose SKU belongs to another variant, in the database or earlier in the batch"""
+        owners = dict(
+            ProductVariant.objects.filter(sku__in={data['sku'] for _, data in valid}).values_list('sku', 'pk')
+        )
+        accepted = []
+        for line, data in valid:
+            owner = owners.setdefault(data['sku'], data['variant_id'])
+            if owner != data['variant_id']:
+                self.add_error(line, {'sku': [f"SKU is already used by variant {owner}"]})
+            else:
+                accepted.append((line, data))
+        return accepted
+
+    def check_holds(self, valid):
+        """Drop rows that would set stock below what open orders hold of the variant"""
+        held = held_quantities([data['variant_id'] for _, data in valid if 'stock' in data])
+        accepted = []
+        for line, data in valid:
+            holds = held.get(data['variant_id'], 0)
+            if 'stock' in data and data['stock'] < holds:
+                self.add_error(line, {'stock': [f"Stock is below the {holds} held by open orders"]})
+            else:
+                accepted.append((line, data))
+        return accepted
+
+    def resolve_names(self, model, field, names):
+        """Return {name: id} for ``names``, creating the missing rows"""
+        if not names:
+            return {}
+        existing = {}
+        for pk, name in model.objects.filter(**{f'{field}__in': names}).order_by('-pk').values_list('pk', field):
+            existing[name] = pk
+        missing = [name for name in names if name not in existing]
+        if missing:
+            model.objects.bulk_create([model(**{field: name}) for name in missing])
+            created = dict(model.objects.filter(**{f'{field}__in': missing}).values_list(field, 'pk'))
+            record_changes(model, created.values(), 'created')
+            existing.update(created)
+        return existing
+
+    @transaction.atomic
+    def upsert(self, rows):
+        brands = self.resolve_names(Brand, 'brand_name', {row['brand'] for row in rows if row.get('brand')})
+        categories = self.resolve_names(
+            Category, 'category_name', {row['category'] for row in rows if row.get('category')}
+        )
+
+        now = timezone.now()
+        products = {}
+        variants = {}
+        # Optional fields a row leaves out keep their stored values
+        kept = {Product: {}, ProductVariant: {}}
+        for row in rows:
+            # A product spans several rows; the last one wins
+            products[row['product_id']] = Product(
+                id=row['product_id'],
+                name=row['product_name'],
+                description=row.get('description'),
+                brand_id=brands.get(row.get('brand')),
+                category_id=categories.get(row.get('category')),
+                image_url=row.get('image_url'),
+                updated_at=now,
+            )
+            kept[Product][row['product_id']] = frozenset(
+                field for field in OPTIONAL_PRODUCT_FIELDS if field not in row
+            )
+            variants[row['variant_id']] = ProductVariant(
+                id=row['variant_id'],
+                product_id=row['product_id'],
+                name=row['variant_name'],
+                price=row['price'],
+                reseller_price=row['reseller_price'],
+                discount_price=row.get('discount_price'),
+                sku=row['sku'],
+                stock=row.get('stock', 0),
+                weight=row['weight'],
+                updated_at=now,
+            )
+            kept[ProductVariant][row['variant_id']] = frozenset(
+                field for field in OPTIONAL_VARIANT_FIELDS if field not in row
+            )
+
+        # Upserts do not report which rows were inserted, so look that up first
+        existing_products = set(Product.objects.filter(pk__in=products).values_list('pk', flat=True))
+        # Variants may move between products, so their previous products need a new summary too
+        previous_owners = dict(ProductVariant.objects.filter(pk__in=variants).values_list('pk', 'product_id'))
+        existing_variants = set(previous_owners)
+        for model, objects, update_fields in [
+            (Product, products, PRODUCT_UPDATE_FIELDS),
+            (ProductVariant, variants, VARIANT_UPDATE_FIELDS),
+        ]:
+            # One upsert per combination of left out fields, usually just one
+            groups = {}
+            for pk, obj in objects.items():
+                groups.setdefault(kept[model][pk], []).append(obj)
+            for missing, group in groups.items():
+                model.objects.bulk_create(
+                    group, update_fields=[field for field in update_fields if field not in missing],
+                    **_upsert_options()
+                )
+
+        # bulk_create skips model signals, so do their work for the whole batch
+        index_products(products.keys())
+        # Imported products are logged below, the ones variants moved away from here
+        refresh_product_summaries(set(products), record=False)
+        refresh_product_summaries(set(previous_owners.values()) - set(products))
+        bump_version(Brand, Category, Product, ProductVariant)
+        for model, ids, existing in [
+            (Product, products, existing_products),
+            (ProductVariant, variants, existing_variants),
+        ]:
+            record_changes(model, [pk for pk in ids if pk not in existing], 'created')
+            record_changes(model, [pk for pk in ids if pk in existing], 'updated')
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import CatalogImporter, CatalogImportError, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = "Upsert brands, categories, products and variants from a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file, one variant per row")
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="File format, detected from the extension by default")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Rows validated and written per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Validate the file without writing anything")
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        try:
+            file_format = options['format'] or detect_format(options['path'])
+            with open(options['path'], 'rb') as stream:
+                report = importer.run(read_rows(stream, file_format))
+        except (CatalogImportError, OSError) as e:
+            raise CommandError(str(e))
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {json.dumps(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['rows']} row(s) read, {report['valid']} valid, "
+            f"{report['imported']} imported, {report['error_count']} error(s)"
+            + (" (dry run)" if report['dry_run'] else "")
+        ))
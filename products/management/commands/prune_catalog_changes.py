@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products.changes import prune_changes
+
+
+class Command(BaseCommand):
+    help = "Delete catalog change feed entries older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Retention in days (defaults to CATALOG_CHANGES_RETENTION_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of changes deleted per query")
+
+    def handle(self, *args, **options):
+        days = options['days'] or getattr(settings, 'CATALOG_CHANGES_RETENTION_DAYS', 30)
+        deleted = prune_changes(days, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} change(s) older than {days} day(s)"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import bump_version
+from products.models import Product
+from products.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute the price, stock and variant count summaries of every product"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of products updated per query")
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_summaries(batch_size=options['batch_size'])
+        bump_version(Product)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} product summary(ies)"))
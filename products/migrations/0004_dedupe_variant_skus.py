@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def dedupe_skus(apps, schema_editor):
+    """Keep each SKU on its lowest variant id and suffix the others with their id"""
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    duplicated = (
+        ProductVariant.objects.values('sku')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .values_list('sku', flat=True)
+    )
+    for sku in duplicated.iterator():
+        variants = ProductVariant.objects.filter(sku=sku).order_by('id')[1:]
+        for variant in variants:
+            suffix = f"-{variant.id}"
+            attempt = 1
+            # The suffixed SKU may itself be taken
+            while ProductVariant.objects.filter(sku=sku[:255 - len(suffix)] + suffix).exists():
+                attempt += 1
+                suffix = f"-{variant.id}-{attempt}"
+            variant.sku = sku[:255 - len(suffix)] + suffix
+            variant.save(update_fields=['sku'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_catalogchange'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_skus, migrations.RunPython.noop),
+    ]
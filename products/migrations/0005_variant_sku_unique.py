@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_dedupe_variant_skus'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productvariant',
+            name='sku',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:48
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_summaries(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    variants = ProductVariant.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    zero = Value(Decimal('0'), output_field=models.DecimalField(max_digits=10, decimal_places=2))
+
+    def aggregate(expression, default):
+        return Coalesce(Subquery(variants.annotate(value=expression).values('value')), default)
+
+    Product.objects.update(
+        min_price=aggregate(Min('price'), zero),
+        min_effective_price=aggregate(Min(Coalesce('discount_price', 'price')), zero),
+        total_stock=aggregate(Sum('stock'), Value(0)),
+        variant_count=aggregate(Count('pk'), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_variant_sku_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='min_effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='variant_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['min_effective_price', 'id'], name='products_pr_min_eff_8b6cf8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['total_stock', 'id'], name='products_pr_total_s_e9ec82_idx'),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
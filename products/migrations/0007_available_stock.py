@@ -0,0 +1,53 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:29
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def fill_available_stock(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    StockReservation = apps.get_model('orders', 'StockReservation')
+    holds = (
+        StockReservation.objects
+        .filter(product_variant=OuterRef('pk'), status='active', expires_at__gt=timezone.now())
+        .order_by().values('product_variant').annotate(total=Sum('quantity')).values('total')
+    )
+    ProductVariant.objects.update(held_stock=Coalesce(Subquery(holds), Value(0)))
+    variants = (
+        ProductVariant.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        .annotate(value=Sum(F('stock') - F('held_stock'))).values('value')
+    )
+    Product.objects.update(available_stock=Coalesce(Subquery(variants), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_summaries'),
+        ('orders', '0002_stockreservation'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='products_pr_total_s_e9ec82_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='available_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='productvariant',
+            name='held_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['available_stock', 'id'], name='products_pr_availab_e9c995_idx'),
+        ),
+        migrations.RunPython(fill_available_stock, migrations.RunPython.noop),
+    ]
@@ -28,6 +28,21 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Summary of the variants, maintained by products.summaries
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    min_effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_stock = models.IntegerField(default=0)
+    # Stock not held by unpaid orders; what the catalog filters and sorts on
+    available_stock = models.IntegerField(default=0)
+    variant_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Price and stock filters and orderings, with id as the cursor tie-breaker
+            models.Index(fields=['min_effective_price', 'id']),
+            models.Index(fields=['available_stock', 'id']),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -37,12 +52,59 @@ class ProductVariant(models.Model):
     name = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     reseller_price = models.DecimalField(max_digits=10, decimal_places=2)
-    sku = models.CharField(max_length=255)
+    sku = models.CharField(max_length=255, unique=True)
     stock = models.IntegerField(default=0)
+    # Quantity held by active reservations, maintained by the reservation ledger
+    held_stock = models.IntegerField(default=0)
     weight = models.DecimalField(max_digits=10, decimal_places=2, help_text="Weight in grams")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     discount_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
     def __str__(self):
-        return f"{self.product.name} - {self.name}"
\ No newline at end of file
+        return f"{self.product.name} - {self.name}"
+
+class ProductSearchTerm(models.Model):
+    """Inverted index entry mapping a normalized search token to a product"""
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        # Also serves exact and prefix lookups on term
+        unique_together = ('term', 'product')
+
+    def __str__(self):
+        return f"{self.term} -> {self.product_id}"
+
+
+class CatalogChange(models.Model):
+    """
+    Append-only log of catalog writes. The auto-increment id is the cursor
+    of the change feed; deleted objects are logged as tombstones.
+    """
+    TYPE_CHOICES = (
+        ('brand', 'Brand'),
+        ('category', 'Category'),
+        ('product', 'Product'),
+        ('variant', 'Product variant'),
+    )
+    ACTION_CHOICES = (
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted'),
+    )
+    id = models.BigAutoField(primary_key=True)
+    object_type = models.CharField(max_length=10, choices=TYPE_CHOICES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Retention pruning scans by age
+            models.Index(fields=['changed_at']),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.object_type} {self.object_id} {self.action}"
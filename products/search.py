@@ -0,0 +1,134 @@
+"""
+Product search backed by an inverted index.
+
+Every product is broken into normalized tokens (accents stripped, case
+folded) taken from its name, description, brand, category and variant names
+and SKUs. Each token is stored in ``ProductSearchTerm`` with a weight that
+reflects where it came from. A query matches products that contain every
+query token, where the last token may be a prefix so search-as-you-type works,
+and results are ranked by the summed weight of the matching terms.
+"""
+import re
+import unicodedata
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, IntegerField, Max, OuterRef, Q, Subquery, Sum, When
+
+from .models import Product, ProductSearchTerm
+
+TERM_MAX_LENGTH = 64
+MAX_QUERY_TOKENS = 8
+
+# How much a token counts towards the rank depending on where it was found
+FIELD_WEIGHTS = {
+    'name': 8,
+    'sku': 6,
+    'brand': 4,
+    'variant': 3,
+    'category': 2,
+    'description': 1,
+}
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Strip accents and case fold ``text``"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    return [token[:TERM_MAX_LENGTH] for token in TOKEN_RE.findall(normalize(text))]
+
+
+def _product_terms(product):
+    """Return {term: weight} for a product with brand, category and variants loaded"""
+    sources = [
+        ('name', product.name),
+        ('description', product.description),
+        ('brand', product.brand.brand_name if product.brand else ''),
+        ('category', product.category.category_name if product.category else ''),
+    ]
+    for variant in product.variants.all():
+        sources.append(('variant', variant.name))
+        sources.append(('sku', variant.sku))
+
+    terms = {}
+    for field, text in sources:
+        for token in set(tokenize(text)):
+            terms[token] = terms.get(token, 0) + FIELD_WEIGHTS[field]
+    return terms
+
+
+@transaction.atomic
+def index_products(product_ids):
+    """(Re)build the index entries of the given products"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+
+    products = (
+        Product.objects.filter(pk__in=product_ids)
+        .select_related('brand', 'category')
+        .prefetch_related('variants')
+    )
+    entries = [
+        ProductSearchTerm(term=term, product=product, weight=weight)
+        for product in products
+        for term, weight in _product_terms(product).items()
+    ]
+    ProductSearchTerm.objects.filter(product_id__in=product_ids).delete()
+    ProductSearchTerm.objects.bulk_create(entries, batch_size=1000)
+
+
+def rebuild_index(batch_size=500):
+    """Reindex the whole catalog in primary key order and return the product count"""
+    indexed = 0
+    last_id = None
+    while True:
+        batch = Product.objects.order_by('pk')
+        if last_id is not None:
+            batch = batch.filter(pk__gt=last_id)
+        product_ids = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not product_ids:
+            return indexed
+        index_products(product_ids)
+        indexed += len(product_ids)
+        last_id = product_ids[-1]
+
+
+def search_products(queryset, query):
+    """
+    Restrict ``queryset`` to products matching ``query`` and annotate each
+    with its ``search_rank``.
+    """
+    tokens = tokenize(query)[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return queryset.none()
+
+    # Complete words must match exactly; the word being typed may be a prefix.
+    # Terms are stored normalized, so a plain LIKE prefix can use the term index
+    conditions = [Q(term=token) for token in tokens[:-1]]
+    conditions.append(Q(term__startswith=tokens[-1]))
+
+    token_hits = {
+        f'token_{i}': Max(Case(When(condition, then=1), default=0, output_field=IntegerField()))
+        for i, condition in enumerate(conditions)
+    }
+    matches = (
+        ProductSearchTerm.objects
+        .filter(reduce(or_, conditions))
+        .values('product')
+        .annotate(rank=Sum('weight'), **token_hits)
+        .filter(**{name: 1 for name in token_hits})
+    )
+    rank = matches.filter(product=OuterRef('pk')).values('rank')
+
+    return (
+        queryset
+        .filter(pk__in=matches.values('product'))
+        .annotate(search_rank=Subquery(rank, output_field=IntegerField()))
+    )
@@ -1,4 +1,6 @@
 from rest_framework import serializers
+from gudangpd_api.fieldsets import SparseFieldsetMixin
+from .dimensions import DimensionField, brands, categories
 from .models import Brand, Category, Product, ProductVariant
 
 class BrandSerializer(serializers.ModelSerializer):
@@ -13,47 +15,108 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'category_name', 'image_url', 'created_at']
         read_only_fields = ['created_at']
 
-class ProductVariantSerializer(serializers.ModelSerializer):
+class ProductVariantSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = ProductVariant
         fields = [
             'id', 'product', 'name', 'price', 'reseller_price', 
-            'sku', 'stock', 'weight', 'created_at', 'updated_at', 'discount_price'
+            'sku', 'stock', 'held_stock', 'weight', 'created_at', 'updated_at', 'discount_price'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['held_stock', 'created_at', 'updated_at']
 
 class ProductVariantInlineSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductVariant
         fields = [
             'id', 'name', 'price', 'reseller_price', 
-            'sku', 'stock', 'weight', 'discount_price'
+            'sku', 'stock', 'held_stock', 'weight', 'discount_price'
         ]
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     variants = ProductVariantInlineSerializer(many=True, read_only=True)
-    brand_name = serializers.CharField(source='brand.brand_name', read_only=True)
-    category_name = serializers.CharField(source='category.category_name', read_only=True)
+    brand_name = DimensionField(brands, 'brand_name', source='brand_id')
+    category_name = DimensionField(categories, 'category_name', source='category_id')
     
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'description', 'brand', 'brand_name',
             'category', 'category_name', 'image_url', 
+            'min_price', 'min_effective_price', 'total_stock', 'available_stock', 'variant_count',
             'created_at', 'updated_at', 'variants'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = [
+            'min_price', 'min_effective_price', 'total_stock', 'available_stock', 'variant_count',
+            'created_at', 'updated_at'
+        ]
+        expandable_fields = {
+            'brand': (DimensionField, {'dimension': brands, 'source': 'brand_id'}),
+            'category': (DimensionField, {'dimension': categories, 'source': 'category_id'}),
+        }
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     variants = ProductVariantInlineSerializer(many=True, read_only=True)
-    brand = BrandSerializer(read_only=True)
-    category = CategorySerializer(read_only=True)
+    brand = DimensionField(brands, source='brand_id')
+    category = DimensionField(categories, source='category_id')
     
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'description', 'brand', 
-            'category', 'image_url', 'created_at', 
-            'updated_at', 'variants'
+            'category', 'image_url', 
+            'min_price', 'min_effective_price', 'total_stock', 'available_stock', 'variant_count',
+            'created_at', 'updated_at', 'variants'
         ]
-        read_only_fields = ['created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = [
+            'min_price', 'min_effective_price', 'total_stock', 'available_stock', 'variant_count',
+            'created_at', 'updated_at'
+        ]
+
+class CatalogImportRowSerializer(serializers.Serializer):
+    """One row of a catalog import: a variant together with its product"""
+    product_id = serializers.IntegerField(min_value=1)
+    product_name = serializers.CharField(max_length=255)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    brand = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    category = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    image_url = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    variant_id = serializers.IntegerField(min_value=1)
+    variant_name = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    reseller_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    discount_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, allow_null=True)
+    sku = serializers.CharField(max_length=255)
+    # Left out to keep an existing variant's stock; new variants then start at 0
+    stock = serializers.IntegerField(min_value=0, required=False)
+    weight = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class CatalogImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=['csv', 'ndjson'], required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+
+class StockAdjustmentSerializer(serializers.Serializer):
+    """Set (absolute) or change (delta) the stock of a variant found by id or SKU"""
+    variant_id = serializers.IntegerField(required=False)
+    sku = serializers.CharField(max_length=255, required=False)
+    delta = serializers.IntegerField(required=False)
+    absolute = serializers.IntegerField(required=False, min_value=0)
+    
+    def validate(self, attrs):
+        if ('variant_id' in attrs) == ('sku' in attrs):
+            raise serializers.ValidationError("Provide exactly one of variant_id or sku")
+        if ('delta' in attrs) == ('absolute' in attrs):
+            raise serializers.ValidationError("Provide exactly one of delta or absolute")
+        return attrs
+
+
+class StockAdjustmentBatchSerializer(serializers.Serializer):
+    adjustments = StockAdjustmentSerializer(many=True, allow_empty=False)
+
+
+class SkuLookupSerializer(serializers.Serializer):
+    skus = serializers.ListField(
+        child=serializers.CharField(max_length=255), allow_empty=False, max_length=1000
+    )
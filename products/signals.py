@@ -0,0 +1,86 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .changes import record_changes
+from .dimensions import brands, categories
+from .models import Brand, Category, Product, ProductVariant
+from .search import index_products
+from .summaries import refresh_product_summaries
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_cached_responses(sender, **kwargs):
+    bump_version(sender)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+def invalidate_dimension_cache(sender, **kwargs):
+    # Other workers notice the version bump above
+    (brands if sender is Brand else categories).invalidate()
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+def log_saved_object(sender, instance, created, **kwargs):
+    record_changes(sender, [instance.pk], 'created' if created else 'updated')
+
+
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductVariant)
+def log_deleted_object(sender, instance, **kwargs):
+    record_changes(sender, [instance.pk], 'deleted')
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    index_products([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def update_variant_product(sender, instance, origin=None, **kwargs):
+    # Variants deleted along with their product have nothing left to update
+    if isinstance(origin, Product) or getattr(origin, 'model', None) is Product:
+        return
+    index_products([instance.product_id])
+    refresh_product_summaries([instance.product_id])
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def index_dimension_products(sender, instance, created, **kwargs):
+    if not created:
+        # Products embed the brand and category names
+        product_ids = list(instance.products.values_list('pk', flat=True))
+        index_products(product_ids)
+        record_changes(Product, product_ids, 'updated')
+
+
+@receiver(pre_delete, sender=Brand)
+@receiver(pre_delete, sender=Category)
+def remember_dimension_products(sender, instance, **kwargs):
+    # Products are detached with a bulk UPDATE, so collect them beforehand
+    instance._indexed_product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+def index_detached_products(sender, instance, **kwargs):
+    product_ids = getattr(instance, '_indexed_product_ids', [])
+    index_products(product_ids)
+    record_changes(Product, product_ids, 'updated')
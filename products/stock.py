@@ -0,0 +1,119 @@
+"""
+Bulk stock adjustments.
+
+A batch of adjustments is applied in one transaction. Each chunk costs one
+query to resolve SKUs, one UPDATE built from ``F()`` expressions and one
+query to read the resulting stock back, however many variants it touches.
+Stock may not end below what unpaid orders hold, which costs one more query
+per chunk.
+"""
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from orders.utils.reservations import held_quantities
+from .cache import bump_version
+from .changes import record_changes
+from .models import ProductVariant
+from .summaries import refresh_variant_summaries
+
+
+class StockAdjustmentError(Exception):
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _resolve_variant_ids(chunk):
+    """Return the variant id of each adjustment, raising for unknown SKUs"""
+    skus = {adjustment['sku'] for adjustment in chunk if 'sku' in adjustment}
+    by_sku = dict(ProductVariant.objects.filter(sku__in=skus).values_list('sku', 'pk'))
+
+    errors = []
+    variant_ids = []
+    for adjustment in chunk:
+        if 'variant_id' in adjustment:
+            variant_ids.append(adjustment['variant_id'])
+        elif adjustment['sku'] not in by_sku:
+            errors.append({'sku': adjustment['sku'], 'detail': "Unknown SKU"})
+        else:
+            variant_ids.append(by_sku[adjustment['sku']])
+    if errors:
+        raise StockAdjustmentError(errors)
+    return variant_ids
+
+
+def _stock_expression(steps):
+    """Fold one variant's adjustments, in order, into a single expression"""
+    base = F('stock')
+    total_delta = 0
+    for adjustment in steps:
+        if 'absolute' in adjustment:
+            base = Value(adjustment['absolute'])
+            total_delta = 0
+        else:
+            total_delta += adjustment['delta']
+    return base + total_delta if total_delta else base
+
+
+@transaction.atomic
+def apply_adjustments(adjustments, chunk_size=500):
+    """Apply all adjustments or none and return the resulting stock levels"""
+    results = {}
+    for chunk in _chunks(adjustments, chunk_size):
+        variant_ids = _resolve_variant_ids(chunk)
+
+        steps = {}
+        for variant_id, adjustment in zip(variant_ids, chunk):
+            steps.setdefault(variant_id, []).append(adjustment)
+
+        updated = ProductVariant.objects.filter(pk__in=steps).update(
+            stock=Case(
+                *[When(pk=variant_id, then=_stock_expression(variant_steps))
+                  for variant_id, variant_steps in steps.items()],
+                default=F('stock'),
+            ),
+            updated_at=timezone.now(),
+        )
+        if updated != len(steps):
+            found = set(ProductVariant.objects.filter(pk__in=steps).values_list('pk', flat=True))
+            raise StockAdjustmentError([
+                {'variant_id': variant_id, 'detail': "Unknown variant"}
+                for variant_id in steps if variant_id not in found
+            ])
+
+        for row in ProductVariant.objects.filter(pk__in=steps).values('id', 'sku', 'stock'):
+            results[row['id']] = row
+
+    errors = []
+    for chunk in _chunks(results.values(), chunk_size):
+        # Stock promised to unpaid orders cannot be adjusted away
+        held = held_quantities([row['id'] for row in chunk])
+        for row in chunk:
+            if row['stock'] < 0:
+                errors.append({'variant_id': row['id'], 'detail': f"Stock would become {row['stock']}"})
+            elif row['stock'] < held.get(row['id'], 0):
+                errors.append({
+                    'variant_id': row['id'],
+                    'detail': f"Stock would become {row['stock']}, below the {held[row['id']]} held by open orders",
+                })
+    if errors:
+        raise StockAdjustmentError(errors)
+
+    # Bulk updates skip model signals
+    bump_version(ProductVariant)
+    record_changes(ProductVariant, results, 'updated')
+    refresh_variant_summaries(results)
+    return list(results.values())
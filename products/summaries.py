@@ -0,0 +1,74 @@
+"""
+Denormalized variant summaries on ``Product``.
+
+``min_price``, ``min_effective_price`` (the lowest discount-or-regular
+price), ``total_stock``, ``available_stock`` (stock less what unpaid orders
+hold) and ``variant_count`` mirror a product's variants so
+listings can filter and sort on indexed columns instead of aggregating
+variants per request. Every write path that changes variants or their stock
+refreshes the affected products with a single UPDATE and logs them in the
+change feed, whose product representation includes the summaries;
+``rebuild_summaries`` repairs the whole catalog in batches.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .changes import record_changes
+from .models import Product, ProductVariant
+
+
+def summary_expressions(product_model=Product, variant_model=ProductVariant):
+    """UPDATE expressions computing each summary column from the product's variants"""
+    variants = variant_model.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    price = product_model._meta.get_field('min_price')
+    zero_price = Value(Decimal('0'), output_field=DecimalField(max_digits=price.max_digits,
+                                                               decimal_places=price.decimal_places))
+
+    def aggregate(expression, default):
+        return Coalesce(Subquery(variants.annotate(value=expression).values('value')), default)
+
+    return {
+        'min_price': aggregate(Min('price'), zero_price),
+        'min_effective_price': aggregate(Min(Coalesce('discount_price', 'price')), zero_price),
+        'total_stock': aggregate(Sum('stock'), Value(0)),
+        'available_stock': aggregate(Sum(F('stock') - F('held_stock')), Value(0)),
+        'variant_count': aggregate(Count('pk'), Value(0)),
+    }
+
+
+def refresh_product_summaries(product_ids, record=True):
+    """Recompute the summaries of the given products and, with ``record``, log them as updated"""
+    product_ids = {pk for pk in product_ids if pk is not None}
+    if not product_ids:
+        return 0
+    updated = Product.objects.filter(pk__in=product_ids).update(**summary_expressions())
+    if record:
+        record_changes(Product, product_ids, 'updated')
+    return updated
+
+
+def refresh_variant_summaries(variant_ids):
+    """Recompute the summaries of the products owning the given variants"""
+    if not variant_ids:
+        return 0
+    return refresh_product_summaries(
+        ProductVariant.objects.filter(pk__in=list(variant_ids)).values_list('product_id', flat=True)
+    )
+
+
+def rebuild_summaries(batch_size=1000):
+    """Recompute every product's summary, one UPDATE per batch of ids"""
+    rebuilt = 0
+    last_id = None
+    while True:
+        queryset = Product.objects.order_by('pk')
+        if last_id is not None:
+            queryset = queryset.filter(pk__gt=last_id)
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return rebuilt
+        # A repair of drift, not a change the feed has to replay for every product
+        rebuilt += refresh_product_summaries(ids, record=False)
+        last_id = ids[-1]
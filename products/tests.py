@@ -1,3 +1,849 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from gudangpd_api.values import compile_serializer
+from orders.models import Order
+from orders.utils.reservations import release_order, reserve
+from users.models import User
+
+from .cache import bump_version, cache_stats
+from .changes import prune_changes
+from .dimensions import brands, categories
+from .importer import CatalogImporter, read_rows
+from .models import Brand, CatalogChange, Category, Product, ProductSearchTerm, ProductVariant
+from .search import rebuild_index, tokenize
+from .serializers import ProductSerializer
+
+
+def warm_dimensions():
+    # Query budgets assume a warm worker; the brand and category tables are
+    # read once per worker, not once per request
+    brands.warm()
+    categories.warm()
+
+
+def hold(variant_id, quantity):
+    """Reserve ``quantity`` of a variant for a new unpaid order"""
+    order = Order.objects.create(
+        user=User.objects.create_user(f'holder{Order.objects.count()}@example.com', 'pw'),
+        shipping_name="Budi", shipping_phone="08123456789", shipping_address="Jl. Merdeka 1",
+        shipping_province="DKI Jakarta", shipping_city="Jakarta Pusat", shipping_postal_code="10110",
+    )
+    reserve(order, {variant_id: quantity})
+
+
+class CatalogQueryBudgetTests(TestCase):
+    """
+    Catalog reads must cost a fixed number of queries no matter how many
+    products or variants are on the page.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        brands = [Brand.objects.create(brand_name=f"Brand {i}") for i in range(3)]
+        categories = [Category.objects.create(category_name=f"Category {i}") for i in range(3)]
+        for product_id in range(1, 31):
+            product = Product.objects.create(
+                id=product_id,
+                name=f"Product {product_id}",
+                brand=brands[product_id % 3],
+                category=categories[product_id % 3],
+            )
+            for variant in range(3):
+                ProductVariant.objects.create(
+                    id=product_id * 10 + variant,
+                    product=product,
+                    name=f"Size {variant}",
+                    price=100000,
+                    reseller_price=80000,
+                    sku=f"SKU-{product_id}-{variant}",
+                    stock=10,
+                    weight=200,
+                )
+
+    def setUp(self):
+        # Throttle counters live in the cache
+        cache.clear()
+        warm_dimensions()
+        self.client = APIClient()
+
+    def assertQueryBudget(self, budget, url):
+        with self.assertNumQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    # List and detail budgets include the ETag validator aggregate
+
+    def test_product_list(self):
+        self.assertQueryBudget(3, '/api/v1/products/?page_size=5')
+        response = self.assertQueryBudget(3, '/api/v1/products/?page_size=30')
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertEqual(len(response.data['results'][0]['variants']), 3)
+
+    def test_product_list_with_filters(self):
+        self.assertQueryBudget(3, '/api/v1/products/?brand=1&category=1&search=Product')
+
+    def test_product_detail(self):
+        response = self.assertQueryBudget(3, '/api/v1/products/1/')
+        self.assertEqual(response.data['brand']['brand_name'], "Brand 1")
+
+    def test_product_variants_action(self):
+        response = self.assertQueryBudget(2, '/api/v1/products/1/variants/')
+        self.assertEqual(len(response.data), 3)
+
+    def test_product_variant_list(self):
+        self.assertQueryBudget(2, '/api/v1/product-variants/?page_size=5')
+        self.assertQueryBudget(2, '/api/v1/product-variants/?page_size=90')
+        self.assertQueryBudget(2, '/api/v1/product-variants/?product=1')
+
+    def test_brand_and_category_lists(self):
+        self.assertQueryBudget(1, '/api/v1/brands/')
+        self.assertQueryBudget(1, '/api/v1/categories/')
+
+
+class ProductSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(brand_name="Rider")
+        cls.bra = Product.objects.create(id=1, name="Bra Renda", description="Bahan katun", brand=cls.brand)
+        cls.brief = Product.objects.create(id=2, name="Celana Dalam Pria", description="Renda tipis")
+        cls.socks = Product.objects.create(id=3, name="Kaos Kaki Crème")
+        ProductVariant.objects.create(
+            id=21, product=cls.brief, name="XL", price=1, reseller_price=1,
+            sku="CDP-XL-01", stock=1, weight=1,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, query):
+        response = self.client.get('/api/v1/products/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_tokenize_folds_case_and_accents(self):
+        self.assertEqual(tokenize("Kaos KAKI Crème-01"), ['kaos', 'kaki', 'creme', '01'])
+
+    def test_matches_every_indexed_field(self):
+        self.assertEqual(self.search("rider"), [1])
+        self.assertEqual(self.search("katun"), [1])
+        self.assertEqual(self.search("cdp-xl"), [2])
+        self.assertEqual(self.search("CREME"), [3])
+
+    def test_all_tokens_must_match_and_last_may_be_prefix(self):
+        self.assertEqual(self.search("celana da"), [2])
+        self.assertEqual(self.search("celana bra"), [])
+
+    def test_results_are_ranked(self):
+        # "renda" is in the name of product 1 but only the description of product 2
+        self.assertEqual(self.search("renda"), [1, 2])
+
+    def test_index_follows_writes(self):
+        self.brand.brand_name = "Wacoal"
+        self.brand.save()
+        self.assertEqual(self.search("wacoal"), [1])
+        ProductVariant.objects.get(id=21).delete()
+        self.assertEqual(self.search("cdp"), [])
+        self.brand.delete()
+        self.assertEqual(self.search("wacoal"), [])
+
+    def test_rebuild_index(self):
+        ProductSearchTerm.objects.all().delete()
+        self.assertEqual(rebuild_index(batch_size=2), 3)
+        self.assertEqual(self.search("kaos"), [3])
+
+
+class CatalogResponseCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(brand_name="Rider")
+        cls.product = Product.objects.create(id=1, name="Singlet", brand=cls.brand)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_repeated_reads_are_served_from_cache(self):
+        first = self.client.get('/api/v1/products/1/')
+        # The response and its validators both come from the cache
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/v1/products/1/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(cache_stats()['hits'], 1)
+        self.assertEqual(cache_stats()['misses'], 1)
+
+    def test_writes_invalidate_dependent_responses(self):
+        self.client.get('/api/v1/products/')
+        self.brand.brand_name = "Wacoal"
+        self.brand.save()
+        response = self.client.get('/api/v1/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['brand_name'], "Wacoal")
+
+    def test_query_parameters_are_part_of_the_key(self):
+        self.client.get('/api/v1/products/?brand=1')
+        response = self.client.get('/api/v1/products/?brand=2')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'], [])
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(id=1, name="Singlet")
+        cls.variant = ProductVariant.objects.create(
+            id=11, product=cls.product, name="M", price=1, reseller_price=1,
+            sku="SGL-M", stock=5, weight=1,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_unchanged_resources_return_304(self):
+        for url in ['/api/v1/products/', '/api/v1/products/1/', '/api/v1/product-variants/11/']:
+            response = self.client.get(url)
+            self.assertIn('Last-Modified', response)
+            # The validators are cached with the catalog versions
+            with self.assertNumQueries(0):
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(not_modified.status_code, 304)
+
+    def test_variant_write_changes_product_etag(self):
+        etag = self.client.get('/api/v1/products/1/')['ETag']
+        self.variant.stock = 4
+        self.variant.save()
+        response = self.client.get('/api/v1/products/1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_variant_delete_changes_product_etag(self):
+        newer = ProductVariant.objects.create(
+            id=12, product=self.product, name="L", price=1, reseller_price=1, sku="SGL-L", stock=5, weight=1,
+        )
+        etag = self.client.get('/api/v1/products/1/')['ETag']
+        # The deleted variant was not the newest, so max(updated_at) stays put
+        self.variant.delete()
+        response = self.client.get('/api/v1/products/1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([variant['id'] for variant in response.data['variants']], [newer.pk])
+
+    def test_list_etag_covers_the_page_only(self):
+        for pk in (2, 3):
+            Product.objects.create(id=pk, name=f"Singlet {pk}")
+        first_page = self.client.get('/api/v1/products/?page_size=2')
+        second_page = self.client.get(first_page.data['next'])
+        # A write past the first page leaves it unchanged
+        Product.objects.filter(pk=3).update(name="Singlet Baru", updated_at=timezone.now())
+        bump_version(Product)
+        response = self.client.get('/api/v1/products/?page_size=2', HTTP_IF_NONE_MATCH=first_page['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(first_page.data['next'], HTTP_IF_NONE_MATCH=second_page['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+        # Rows leaving the page change it even though no timestamp moved
+        Product.objects.filter(pk=2).delete()
+        response = self.client.get('/api/v1/products/?page_size=2', HTTP_IF_NONE_MATCH=first_page['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_object_is_still_404(self):
+        self.assertEqual(self.client.get('/api/v1/products/99/').status_code, 404)
+
+
+class CatalogImportTests(TestCase):
+    CSV = (
+        b"product_id,product_name,brand,category,variant_id,variant_name,price,reseller_price,sku,stock,weight\n"
+        b"1,Bra Renda,Rider,Bra,11,S,100000,80000,BR-S,5,100\n"
+        b"1,Bra Renda,Rider,Bra,12,M,100000,80000,BR-M,5,100\n"
+        b"2,Celana,Rider,,21,L,50000,40000,CL-L,many,100\n"
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin@example.com', 'pw', is_staff=True))
+
+    def upload(self, content, name='catalog.csv', **data):
+        return self.client.post(
+            '/api/v1/catalog/import/',
+            {'file': SimpleUploadedFile(name, content), **data},
+            format='multipart',
+        )
+
+    def test_dry_run_reports_errors_without_writing(self):
+        response = self.upload(self.CSV, dry_run=True)
+        self.assertEqual(response.data['valid'], 2)
+        self.assertEqual(response.data['errors'], [{'line': 4, 'errors': {'stock': ['A valid integer is required.']}}])
+        self.assertFalse(Product.objects.exists())
+
+    def test_import_upserts_rows(self):
+        self.upload(self.CSV)
+        self.assertEqual(ProductVariant.objects.filter(product_id=1).count(), 2)
+        self.assertEqual(Brand.objects.get().products.count(), 1)
+
+        ndjson = (
+            b'{"product_id": 1, "product_name": "Bra Renda Baru", "brand": "Rider", "variant_id": 11,'
+            b' "variant_name": "S", "price": 110000, "reseller_price": 80000, "sku": "BR-S", "stock": 9, "weight": 100}\n'
+        )
+        response = self.upload(ndjson, name='catalog.ndjson')
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(Product.objects.get(id=1).name, "Bra Renda Baru")
+        self.assertEqual(ProductVariant.objects.get(id=11).stock, 9)
+        self.assertEqual(Brand.objects.count(), 1)
+        # Imported products are searchable
+        results = self.client.get('/api/v1/products/', {'search': 'baru'}).data['results']
+        self.assertEqual([product['id'] for product in results], [1])
+
+    def test_empty_stock_cell_keeps_stock(self):
+        self.upload(self.CSV)
+        ProductVariant.objects.filter(id=11).update(stock=7)
+        response = self.upload(
+            b"product_id,product_name,variant_id,variant_name,price,reseller_price,sku,stock,weight\n"
+            b"1,Bra Renda,11,S,120000,80000,BR-S,,100\n"
+            b"1,Bra Renda,12,M,100000,80000,BR-M,3,100\n"
+            b"1,Bra Renda,13,L,100000,80000,BR-L,,100\n"
+        )
+        self.assertEqual(response.data['imported'], 3)
+        variants = {variant.id: variant for variant in ProductVariant.objects.filter(product_id=1)}
+        self.assertEqual(variants[11].stock, 7)
+        self.assertEqual(variants[11].price, 120000)
+        self.assertEqual(variants[12].stock, 3)
+        # A new variant without a stock value starts empty
+        self.assertEqual(variants[13].stock, 0)
+
+    def test_partial_rows_keep_the_fields_they_leave_out(self):
+        self.upload(
+            b"product_id,product_name,description,brand,category,image_url,variant_id,variant_name,"
+            b"price,reseller_price,discount_price,sku,stock,weight\n"
+            b"1,Bra Renda,Renda halus,Rider,Bra,https://img/1.jpg,11,S,100000,80000,90000,BR-S,5,100\n"
+        )
+        ndjson = (
+            b'{"product_id": 1, "product_name": "Bra Renda Baru", "variant_id": 11, "variant_name": "S",'
+            b' "price": 110000, "reseller_price": 80000, "sku": "BR-S", "weight": 100}\n'
+        )
+        self.assertEqual(self.upload(ndjson, name='catalog.ndjson').data['imported'], 1)
+        product = Product.objects.get(id=1)
+        self.assertEqual(product.name, "Bra Renda Baru")
+        self.assertEqual(
+            (product.description, product.brand.brand_name, product.category.category_name, product.image_url),
+            ("Renda halus", "Rider", "Bra", "https://img/1.jpg"),
+        )
+        variant = ProductVariant.objects.get(id=11)
+        self.assertEqual((variant.price, variant.discount_price, variant.stock), (110000, 90000, 5))
+
+    def test_rejects_negative_stock(self):
+        response = self.upload(
+            b"product_id,product_name,variant_id,variant_name,price,reseller_price,sku,stock,weight\n"
+            b"1,Bra Renda,11,S,100000,80000,BR-S,-2,100\n",
+            dry_run=True,
+        )
+        self.assertEqual(list(response.data['errors'][0]['errors']), ['stock'])
+
+    def test_rejects_stock_below_held_quantity(self):
+        self.upload(self.CSV)
+        hold(11, 4)
+        response = self.upload(
+            b"product_id,product_name,variant_id,variant_name,price,reseller_price,sku,stock,weight\n"
+            b"1,Bra Renda,11,S,100000,80000,BR-S,3,100\n"
+            b"1,Bra Renda,12,M,100000,80000,BR-M,0,100\n"
+        )
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(
+            response.data['errors'],
+            [{'line': 2, 'errors': {'stock': ["Stock is below the 4 held by open orders"]}}],
+        )
+        self.assertEqual(ProductVariant.objects.get(id=11).stock, 5)
+        self.assertEqual(ProductVariant.objects.get(id=12).stock, 0)
+
+    def test_requires_staff(self):
+        self.client.force_authenticate(User.objects.create_user('buyer@example.com', 'pw'))
+        self.assertEqual(self.upload(self.CSV).status_code, 403)
+
+
+class StockAdjustmentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(id=1, name="Singlet")
+        for variant_id in (11, 12):
+            ProductVariant.objects.create(
+                id=variant_id, product=product, name=f"Size {variant_id}", price=1,
+                reseller_price=1, sku=f"SGL-{variant_id}", stock=10, weight=1,
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin@example.com', 'pw', is_staff=True))
+
+    def adjust(self, adjustments):
+        return self.client.post('/api/v1/product-variants/adjust-stock/', {'adjustments': adjustments}, format='json')
+
+    def stock(self, variant_id):
+        return ProductVariant.objects.get(id=variant_id).stock
+
+    def test_applies_deltas_and_absolute_values_in_order(self):
+        response = self.adjust([
+            {'variant_id': 11, 'delta': -3},
+            {'sku': 'SGL-12', 'absolute': 50},
+            {'sku': 'SGL-12', 'delta': 2},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted((row['id'], row['stock']) for row in response.data['results']),
+            [(11, 7), (12, 52)],
+        )
+        self.assertEqual(self.stock(12), 52)
+
+    def test_batch_is_all_or_nothing(self):
+        response = self.adjust([{'variant_id': 12, 'delta': 5}, {'variant_id': 11, 'delta': -11}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock(12), 10)
+        response = self.adjust([{'variant_id': 12, 'delta': 5}, {'sku': 'MISSING', 'delta': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock(12), 10)
+
+    def test_stock_cannot_fall_below_held_quantity(self):
+        hold(11, 6)
+        response = self.adjust([{'variant_id': 11, 'absolute': 5}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock(11), 10)
+        response = self.adjust([{'variant_id': 11, 'delta': -4}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(11), 6)
+
+
+class CatalogFacetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        rider = Brand.objects.create(brand_name="Rider")
+        wacoal = Brand.objects.create(brand_name="Wacoal")
+        for product_id, brand, price, stock in [(1, rider, 40000, 3), (2, rider, 120000, 0), (3, wacoal, 90000, 1)]:
+            product = Product.objects.create(id=product_id, name=f"Product {product_id}", brand=brand)
+            ProductVariant.objects.create(
+                id=product_id * 10, product=product, name="M", price=price,
+                reseller_price=price, sku=f"SKU-{product_id}", stock=stock, weight=1,
+            )
+
+    def setUp(self):
+        cache.clear()
+        warm_dimensions()
+        self.client = APIClient()
+
+    def test_price_and_stock_filters(self):
+        response = self.client.get('/api/v1/products/', {'price_min': 50000, 'in_stock': 'true'})
+        self.assertEqual([product['id'] for product in response.data['results']], [3])
+
+    def test_facet_counts_follow_filters_in_constant_queries(self):
+        # Page, variants prefetch, brand counts, category counts, price/availability counts
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/v1/products/facets/', {'brand': 1})
+        facets = response.data['facets']
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(facets['brand'], [{'id': 1, 'name': "Rider", 'count': 2}])
+        self.assertEqual(facets['availability'], {'in_stock': 1, 'out_of_stock': 1})
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [1, 0, 1, 0, 0])
+
+
+class SparseFieldsetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(brand_name="Rider")
+        product = Product.objects.create(id=1, name="Kaos", description="Katun", brand=brand)
+        ProductVariant.objects.create(
+            id=10, product=product, name="M", price=1000,
+            reseller_price=900, sku="SKU-1", stock=3, weight=1,
+        )
+
+    def setUp(self):
+        cache.clear()
+        warm_dimensions()
+        self.client = APIClient()
+
+    def test_fields_limit_the_response_and_skip_the_variants_prefetch(self):
+        # Validators and the page only
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/products/', {'fields': 'id,name'})
+        self.assertEqual(response.data['results'], [{'id': 1, 'name': "Kaos"}])
+
+    def test_expand_nests_the_related_object(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/products/1/', {'fields': 'id,brand', 'expand': 'brand'})
+        self.assertEqual(set(response.data), {'id', 'brand'})
+        self.assertEqual(response.data['brand']['brand_name'], "Rider")
+
+    def test_unknown_fields_are_ignored(self):
+        response = self.client.get('/api/v1/products/', {'fields': 'id,nope', 'expand': 'nope'})
+        self.assertEqual(response.data['results'], [{'id': 1}])
+
+    def test_writes_keep_every_field(self):
+        self.client.force_authenticate(User.objects.create_user('admin@example.com', 'pw', is_staff=True))
+        response = self.client.patch(
+            '/api/v1/products/1/?fields=id&expand=brand', {'description': "Katun combed"}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.get(id=1).description, "Katun combed")
+        self.assertEqual(response.data['description'], "Katun combed")
+
+
+class ValuesListParityTests(TestCase):
+    """The values() read path must render exactly what the serializer does"""
+
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(brand_name="Rider")
+        category = Category.objects.create(category_name="Kaos")
+        for product_id in range(1, 5):
+            product = Product.objects.create(
+                id=product_id,
+                name=f"Product {product_id}",
+                brand=brand if product_id % 2 else None,
+                category=category if product_id < 3 else None,
+            )
+            for variant in range(product_id % 3):
+                ProductVariant.objects.create(
+                    id=product_id * 10 + variant, product=product, name="M",
+                    price="12.5", reseller_price=10, discount_price="9.99" if variant else None,
+                    sku=f"SKU-{product_id}-{variant}", stock=variant, weight="0.25",
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def expected(self, queryset):
+        return ProductSerializer(queryset, many=True).data
+
+    def test_mapper_matches_serializer(self):
+        queryset = Product.objects.order_by('id')
+        mapper = compile_serializer(ProductSerializer())
+        self.assertEqual(mapper.map_rows(mapper.values(queryset)), self.expected(queryset))
+
+    def test_list_endpoint_matches_serializer(self):
+        response = self.client.get('/api/v1/products/', {'page_size': 2})
+        results = response.data['results']
+        response = self.client.get(response.data['next'])
+        results += response.data['results']
+        self.assertEqual(results, self.expected(Product.objects.order_by('id')))
+
+    def test_expanded_fields_fall_back_to_the_serializer(self):
+        response = self.client.get('/api/v1/products/', {'expand': 'brand'})
+        self.assertEqual(response.data['results'][0]['brand']['brand_name'], "Rider")
+
+
+class CatalogExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(brand_name="Rider")
+        for product_id in range(1, 6):
+            product = Product.objects.create(id=product_id, name=f"Product {product_id}", brand=brand)
+            for variant in range(2):
+                ProductVariant.objects.create(
+                    id=product_id * 10 + variant, product=product, name=f"Size {variant}",
+                    price=100000, reseller_price=80000, sku=f"SKU-{product_id}-{variant}",
+                    stock=5, weight=200,
+                )
+        cls.seller = User.objects.create_user('seller@example.com', 'secret', is_seller=True)
+        cls.buyer = User.objects.create_user('buyer@example.com', 'secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def export(self, params=None, **headers):
+        response = self.client.get('/api/v1/catalog/export/', params or {}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson_streams_products_in_chunks(self):
+        with self.settings(CATALOG_EXPORT_CHUNK_SIZE=2):
+            # Each chunk costs a product and a variant query, plus the final empty chunk
+            with self.assertNumQueries(7):
+                response, body = self.export()
+        lines = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual([line['id'] for line in lines], [1, 2, 3, 4, 5])
+        self.assertEqual(lines[0]['variants'][0]['reseller_price'], "80000.00")
+
+    def test_resume_after_last_seen_id(self):
+        _, body = self.export({'after': 3})
+        self.assertEqual([json.loads(line)['id'] for line in body.decode().splitlines()], [4, 5])
+
+    def test_gzip_csv_can_be_imported_again(self):
+        response, body = self.export({'format': 'csv'}, accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        report = CatalogImporter(dry_run=True).run(read_rows(io.BytesIO(gzip.decompress(body)), 'csv'))
+        self.assertEqual((report['rows'], report['error_count']), (10, 0))
+
+    def test_sellers_and_staff_only(self):
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/v1/catalog/export/').status_code, 403)
+
+
+@override_settings(CATALOG_CHANGES_SETTLE_SECONDS=0)
+class CatalogChangeFeedTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.cursor = self.client.get('/api/v1/catalog/changes/').data['cursor']
+
+    def changes(self, since=None, **params):
+        since = self.cursor if since is None else since
+        response = self.client.get('/api/v1/catalog/changes/', {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_writes_and_tombstones_are_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            brand = Brand.objects.create(brand_name="Rider")
+            product = Product.objects.create(id=1, name="Kaos", brand=brand)
+            ProductVariant.objects.create(
+                id=10, product=product, name="M", price=1000, reseller_price=900, sku="SKU-1", weight=1,
+            )
+            product.name = "Kaos Polos"
+            product.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+
+        data = self.changes()
+        self.assertEqual(
+            [(change['type'], change['id'], change['action']) for change in data['results']],
+            [('brand', brand.pk, 'created'), ('variant', 10, 'deleted'), ('product', 1, 'deleted')],
+        )
+        self.assertEqual(data['results'][0]['data']['brand_name'], "Rider")
+        self.assertIsNone(data['results'][2]['data'])
+        self.assertEqual(self.changes(since=data['cursor'])['results'], [])
+
+    def test_bulk_writes_are_logged_and_paged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(id=1, name="Kaos")
+            ProductVariant.objects.bulk_create([
+                ProductVariant(id=i, product=product, name=f"Size {i}", price=1, reseller_price=1,
+                               sku=f"SKU-{i}", stock=5, weight=1)
+                for i in range(10, 13)
+            ])
+        self.cursor = self.client.get('/api/v1/catalog/changes/').data['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(User.objects.create_superuser('admin@example.com', 'secret'))
+            self.client.post('/api/v1/product-variants/adjust-stock/', {
+                'adjustments': [{'variant_id': i, 'delta': -1} for i in range(10, 13)],
+            }, format='json')
+
+        first = self.changes(limit=2)
+        self.assertTrue(first['has_more'])
+        second = self.changes(since=first['cursor'], limit=2)
+        self.assertFalse(second['has_more'])
+        changed = first['results'] + second['results']
+        self.assertEqual(
+            [(change['id'], change['data']['stock']) for change in changed if change['type'] == 'variant'],
+            [(10, 4), (11, 4), (12, 4)],
+        )
+        # The product's stock summary changed with them
+        self.assertEqual(
+            [(change['id'], change['data']['total_stock']) for change in changed if change['type'] == 'product'],
+            [(1, 12)],
+        )
+
+    def test_products_a_variant_moves_away_from_are_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(id=1, name="Kaos")
+            ProductVariant.objects.create(
+                id=10, product=product, name="M", price=1000, reseller_price=900, sku="SKU-1", stock=3, weight=1,
+            )
+        self.cursor = self.changes()['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            CatalogImporter().run([(2, {
+                'product_id': 2, 'product_name': "Kaos Baru", 'variant_id': 10, 'variant_name': "M",
+                'price': 1000, 'reseller_price': 900, 'sku': "SKU-1", 'weight': 1,
+            })])
+
+        products = {
+            change['id']: change['data'] for change in self.changes()['results'] if change['type'] == 'product'
+        }
+        self.assertEqual(set(products), {1, 2})
+        self.assertEqual((products[1]['variant_count'], products[2]['total_stock']), (0, 3))
+
+    def test_pruned_cursor_is_gone(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ["A", "B", "C"]:
+                Brand.objects.create(brand_name=name)
+        CatalogChange.objects.update(changed_at=timezone.now() - timedelta(days=40))
+        self.assertEqual(prune_changes(30), 2)
+        response = self.client.get('/api/v1/catalog/changes/', {'since': self.cursor})
+        self.assertEqual(response.status_code, 410)
+
+
+class DimensionCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(brand_name="Rider")
+        Product.objects.create(id=1, name="Kaos", brand=cls.brand)
+
+    def setUp(self):
+        cache.clear()
+        warm_dimensions()
+        self.client = APIClient()
+
+    def test_product_reads_do_not_join_brands(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(brands.get(self.brand.pk)['brand_name'], "Rider")
+        response = self.client.get('/api/v1/products/1/')
+        self.assertEqual(response.data['brand']['brand_name'], "Rider")
+        self.assertIsNone(response.data['category'])
+
+    def test_writes_in_this_worker_invalidate_immediately(self):
+        self.brand.brand_name = "Rider Men"
+        self.brand.save()
+        self.assertEqual(self.client.get('/api/v1/products/1/').data['brand']['brand_name'], "Rider Men")
+
+    def test_writes_in_other_workers_invalidate_through_the_version(self):
+        # Another worker's write only reaches this one through the shared version counter
+        Brand.objects.filter(pk=self.brand.pk).update(brand_name="Rider Men")
+        bump_version(Brand)
+        self.assertEqual(brands.get(self.brand.pk)['brand_name'], "Rider")
+        with self.settings(CATALOG_DIMENSION_CHECK_SECONDS=0):
+            self.assertEqual(brands.get(self.brand.pk)['brand_name'], "Rider Men")
+
+    def test_entries_expire(self):
+        Brand.objects.filter(pk=self.brand.pk).update(brand_name="Rider Men")
+        with self.settings(CATALOG_DIMENSION_TTL=0):
+            brands.warm()
+        self.assertEqual(brands.get(self.brand.pk)['brand_name'], "Rider Men")
+
+
+class SkuLookupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(id=1, name="Kaos")
+        for variant_id in range(10, 13):
+            ProductVariant.objects.create(
+                id=variant_id, product=product, name=f"Size {variant_id}", price=1000,
+                reseller_price=900, sku=f"KAOS-{variant_id}", stock=variant_id, weight=1,
+            )
+        cls.user = User.objects.create_user('picker@example.com', 'secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_lookup_in_one_query_keeps_request_order(self):
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/v1/product-variants/lookup/', {
+                'skus': ['KAOS-12', 'NOPE', 'KAOS-10', 'KAOS-12'],
+            }, format='json')
+        self.assertEqual([(variant['sku'], variant['stock']) for variant in response.data['results']],
+                         [('KAOS-12', 12), ('KAOS-10', 10)])
+        self.assertEqual(response.data['results'][0]['price'], "1000.00")
+        self.assertEqual(response.data['missing'], ['NOPE'])
+
+    def test_skus_are_unique(self):
+        response = self.client.post('/api/v1/product-variants/', {
+            'product': 1, 'name': "XL", 'price': 1000, 'reseller_price': 900,
+            'sku': "KAOS-10", 'stock': 1, 'weight': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sku', response.data)
+
+    def test_import_rejects_skus_of_other_variants(self):
+        report = CatalogImporter().run([
+            (2, {'product_id': 1, 'product_name': "Kaos", 'variant_id': 13, 'variant_name': "XL",
+                 'price': 1, 'reseller_price': 1, 'sku': "KAOS-10", 'weight': 1}),
+        ])
+        self.assertEqual(report['imported'], 0)
+        self.assertEqual(report['errors'][0]['errors']['sku'], ["SKU is already used by variant 10"])
+
+
+class ProductSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for product_id, prices in [(1, [(300, None), (200, 150)]), (2, [(100, None)]), (3, [])]:
+            product = Product.objects.create(id=product_id, name=f"Product {product_id}")
+            for i, (price, discount) in enumerate(prices):
+                ProductVariant.objects.create(
+                    id=product_id * 10 + i, product=product, name=f"Size {i}", price=price,
+                    reseller_price=price, discount_price=discount, sku=f"SKU-{product_id}-{i}",
+                    stock=product_id, weight=1,
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def summary(self, product_id):
+        return Product.objects.values(
+            'min_price', 'min_effective_price', 'total_stock', 'variant_count'
+        ).get(pk=product_id)
+
+    def test_variant_writes_keep_summaries_current(self):
+        self.assertEqual(self.summary(1), {
+            'min_price': Decimal('200'), 'min_effective_price': Decimal('150'),
+            'total_stock': 2, 'variant_count': 2,
+        })
+        ProductVariant.objects.get(pk=11).delete()
+        self.assertEqual(self.summary(1)['min_effective_price'], Decimal('300'))
+        self.assertEqual(self.summary(3)['variant_count'], 0)
+
+    def test_bulk_stock_changes_keep_summaries_current(self):
+        self.client.force_authenticate(User.objects.create_superuser('admin@example.com', 'secret'))
+        self.client.post('/api/v1/product-variants/adjust-stock/', {
+            'adjustments': [{'variant_id': 20, 'absolute': 0}],
+        }, format='json')
+        self.assertEqual(self.summary(2)['total_stock'], 0)
+        response = self.client.get('/api/v1/products/', {'in_stock': 'false'})
+        self.assertEqual([product['id'] for product in response.data['results']], [2, 3])
+
+    def test_holds_count_against_availability(self):
+        hold(20, 2)
+        self.assertEqual(Product.objects.values('total_stock', 'available_stock').get(pk=2),
+                         {'total_stock': 2, 'available_stock': 0})
+        self.assertEqual(ProductVariant.objects.get(pk=20).held_stock, 2)
+        response = self.client.get('/api/v1/products/facets/', {'in_stock': 'false'})
+        self.assertEqual([product['id'] for product in response.data['results']], [2, 3])
+        self.assertEqual(response.data['facets']['availability'], {'in_stock': 0, 'out_of_stock': 2})
+
+        release_order(Order.objects.get())
+        self.assertEqual(Product.objects.get(pk=2).available_stock, 2)
+        response = self.client.get('/api/v1/products/', {'in_stock': 'true'})
+        self.assertEqual([product['id'] for product in response.data['results']], [1, 2])
+
+    def test_price_ordering_pages_on_the_summary_column(self):
+        response = self.client.get('/api/v1/products/', {'ordering': '-price', 'page_size': 1})
+        ids = [product['id'] for product in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [product['id'] for product in response.data['results']]
+        self.assertEqual(ids, [1, 2, 3])
+        self.assertEqual(response.data['results'][0]['variant_count'], 0)
+
+    def test_rebuild_command_repairs_drift(self):
+        Product.objects.update(min_price=0, total_stock=0, variant_count=0)
+        call_command('rebuild_product_summaries', stdout=io.StringIO())
+        self.assertEqual(self.summary(1)['variant_count'], 2)
+        self.assertEqual(self.summary(2)['total_stock'], 2)
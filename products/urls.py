@@ -1,6 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BrandViewSet, CategoryViewSet, ProductViewSet, ProductVariantViewSet
+from .views import (
+    BrandViewSet, CategoryViewSet, ProductViewSet, ProductVariantViewSet,
+    CatalogImportView, CatalogExportView, CatalogChangesView
+)
 
 router = DefaultRouter()
 router.register(r'brands', BrandViewSet)
@@ -10,4 +13,7 @@ router.register(r'product-variants', ProductVariantViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('catalog/import/', CatalogImportView.as_view(), name='catalog-import'),
+    path('catalog/export/', CatalogExportView.as_view(), name='catalog-export'),
+    path('catalog/changes/', CatalogChangesView.as_view(), name='catalog-changes'),
 ]
\ No newline at end of file
@@ -1,27 +1,57 @@
-from rest_framework import viewsets, permissions
+import re
+from decimal import Decimal, InvalidOperation
+from django.db.models import Exists, OuterRef
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework import viewsets, permissions, generics, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from gudangpd_api.conditional import ConditionalGetMixin
+from gudangpd_api.fieldsets import SparseQuerysetMixin
+from gudangpd_api.values import ValuesListMixin, compile_serializer
+from users.permissions import IsSellerOrStaff
+from .cache import CachedResponseMixin, get_versions
+from .changes import MAX_LIMIT, ChangeFeedExpired, current_cursor, read_changes
+from .export import CSVRenderer, NDJSONRenderer, export_stream
+from .facets import compute_facets
+from .filters import ProductOrdering
+from .importer import CatalogImporter, CatalogImportError, detect_format, read_rows
 from .models import Brand, Category, Product, ProductVariant
+from .search import search_products
 from .serializers import (
     BrandSerializer, CategorySerializer,
     ProductSerializer, ProductDetailSerializer,
-    ProductVariantSerializer
+    ProductVariantSerializer, CatalogImportSerializer, StockAdjustmentBatchSerializer,
+    SkuLookupSerializer
 )
+from .stock import StockAdjustmentError, apply_adjustments
 
-class BrandViewSet(viewsets.ModelViewSet):
+class BrandViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_models = (Brand,)
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_models = (Category,)
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, SparseQuerysetMixin, ValuesListMixin,
+                     viewsets.ModelViewSet):
+    cache_models = (Product, ProductVariant, Brand, Category)
+    conditional_related_fields = ('variants__updated_at',)
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    filter_backends = (ProductOrdering,)
+    
+    def get_etag_extra(self):
+        # Brand and category names are embedded but carry no updated_at
+        return get_versions((Brand, Category))
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -29,7 +59,9 @@ class ProductViewSet(viewsets.ModelViewSet):
         return ProductSerializer
     
     def get_queryset(self):
-        queryset = Product.objects.all()
+        # Variants are prefetched so a page of products costs the same number of
+        # queries whatever its size; brand and category come from the dimension cache
+        queryset = Product.objects.prefetch_related('variants')
         
         # Filter by brand
         brand_id = self.request.query_params.get('brand')
@@ -41,21 +73,70 @@ class ProductViewSet(viewsets.ModelViewSet):
         if category_id:
             queryset = queryset.filter(category_id=category_id)
             
-        # Search by name
+        # Filter by the price of the cheapest variant and by availability
+        price_min = self.get_decimal_param('price_min')
+        price_max = self.get_decimal_param('price_max')
+        if price_min is not None or price_max is not None:
+            queryset = queryset.filter(variant_count__gt=0)
+            if price_min is not None:
+                queryset = queryset.filter(min_effective_price__gte=price_min)
+            if price_max is not None:
+                queryset = queryset.filter(min_effective_price__lte=price_max)
+        in_stock = self.request.query_params.get('in_stock')
+        if in_stock:
+            if in_stock.lower() in ('1', 'true', 'yes'):
+                queryset = queryset.filter(available_stock__gt=0)
+            else:
+                queryset = queryset.filter(available_stock__lte=0)
+        
+        # Filter by variant name, e.g. a size
+        variant = self.request.query_params.get('variant')
+        if variant:
+            queryset = queryset.filter(
+                Exists(ProductVariant.objects.filter(product=OuterRef('pk'), name__iexact=variant))
+            )
+        
+        # Search name, description, brand, category, variant names and SKUs
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(name__icontains=search)
+            queryset = search_products(queryset, search)
             
-        return queryset
+        return self.prune_queryset(queryset)
+    
+    def get_decimal_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: "A valid number is required."})
+    
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """A page of products plus brand, category, price and availability counts"""
+        return self.get_cached_response(self.list_with_facets, request)
+    
+    def list_with_facets(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        response.data['facets'] = compute_facets(queryset)
+        return response
     
     @action(detail=True, methods=['get'])
     def variants(self, request, pk=None):
+        return self.get_cached_response(self.list_variants, request, pk=pk)
+    
+    def list_variants(self, request, pk=None):
         product = self.get_object()
         variants = product.variants.all()
         serializer = ProductVariantSerializer(variants, many=True)
         return Response(serializer.data)
 
-class ProductVariantViewSet(viewsets.ModelViewSet):
+class ProductVariantViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    cache_models = (ProductVariant,)
     queryset = ProductVariant.objects.all()
     serializer_class = ProductVariantSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
@@ -67,5 +148,138 @@ class ProductVariantViewSet(viewsets.ModelViewSet):
         product_id = self.request.query_params.get('product')
         if product_id:
             queryset = queryset.filter(product_id=product_id)
+        
+        # Filter by SKU
+        sku = self.request.query_params.get('sku')
+        if sku:
+            queryset = queryset.filter(sku=sku)
             
-        return queryset
\ No newline at end of file
+        return queryset
+    
+    @action(detail=False, methods=['post'], serializer_class=SkuLookupSerializer,
+            permission_classes=[permissions.IsAuthenticated])
+    def lookup(self, request):
+        """Resolve up to 1000 SKUs to variants with stock, held quantities and prices in one query"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        skus = list(dict.fromkeys(serializer.validated_data['skus']))
+        
+        mapper = compile_serializer(ProductVariantSerializer())
+        found = {
+            variant['sku']: variant
+            for variant in mapper.map_rows(mapper.values(ProductVariant.objects.filter(sku__in=skus)))
+        }
+        return Response({
+            "results": [found[sku] for sku in skus if sku in found],
+            "missing": [sku for sku in skus if sku not in found],
+        })
+    
+    @action(detail=False, methods=['post'], url_path='adjust-stock',
+            serializer_class=StockAdjustmentBatchSerializer,
+            permission_classes=[permissions.IsAdminUser])
+    def adjust_stock(self, request):
+        """Apply a batch of stock corrections atomically"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        try:
+            results = apply_adjustments(serializer.validated_data['adjustments'])
+        except StockAdjustmentError as e:
+            return Response({"errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({"count": len(results), "results": results})
+
+
+class CatalogImportView(generics.GenericAPIView):
+    """
+    Bulk upsert brands, categories, products and variants from an uploaded
+    CSV or NDJSON file, one variant per row.
+    """
+    permission_classes = (permissions.IsAdminUser,)
+    parser_classes = (MultiPartParser,)
+    serializer_class = CatalogImportSerializer
+    
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        
+        try:
+            file_format = serializer.validated_data.get('format') or detect_format(upload.name)
+            importer = CatalogImporter(dry_run=serializer.validated_data['dry_run'])
+            report = importer.run(read_rows(upload, file_format))
+        except CatalogImportError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(report)
+
+
+
+class CatalogExportView(generics.GenericAPIView):
+    """
+    Stream the whole catalog with reseller prices: NDJSON with one product
+    and its variants per line (default), or CSV with one variant per row
+    (``?format=csv``). Products come in id order and ``?after=<id>`` resumes
+    an interrupted download. Clients sending ``Accept-Encoding: gzip`` get a
+    gzip-compressed stream.
+    """
+    permission_classes = (permissions.IsAuthenticated, IsSellerOrStaff)
+    renderer_classes = (NDJSONRenderer, CSVRenderer)
+    gzip_re = re.compile(r'\bgzip\b')
+    
+    def get(self, request):
+        after = request.query_params.get('after') or 0
+        try:
+            after = int(after)
+        except (TypeError, ValueError):
+            raise ValidationError({"after": "A valid product id is required."})
+        
+        renderer = request.accepted_renderer
+        compress = bool(self.gzip_re.search(request.headers.get('Accept-Encoding', '')))
+        response = StreamingHttpResponse(
+            export_stream(renderer.format, after=after, compress=compress),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        response['Content-Disposition'] = f'attachment; filename="catalog.{renderer.format}"'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class CatalogChangesView(generics.GenericAPIView):
+    """
+    Brands, categories, products and variants created, updated or deleted
+    after ``?since=<cursor>``, oldest first, with their current data.
+    Without ``since`` only the current cursor is returned: take it, run a
+    full export, then poll from that cursor. Keep calling with the returned
+    cursor while ``has_more`` is true.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    
+    def get_int_param(self, name, default):
+        value = self.request.query_params.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValidationError({name: "A valid integer is required."})
+        if value < 0:
+            raise ValidationError({name: "Must not be negative."})
+        return value
+    
+    def get(self, request):
+        since = self.get_int_param('since', None)
+        limit = min(self.get_int_param('limit', 500) or 1, MAX_LIMIT)
+        if since is None:
+            return Response({"cursor": current_cursor(), "has_more": False, "results": []})
+        
+        try:
+            cursor, has_more, results = read_changes(since, limit)
+        except ChangeFeedExpired:
+            return Response(
+                {"detail": "Cursor is older than the retained change log, run a full export and start again"},
+                status=status.HTTP_410_GONE
+            )
+        return Response({"cursor": cursor, "has_more": has_more, "results": results})
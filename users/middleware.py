@@ -1,3 +1,4 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import JsonResponse
 from django.utils import timezone
 from django.conf import settings
@@ -10,8 +11,13 @@ class APIKeyMiddleware:
     Public routes are excluded from API key checking.
     """
     
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
         
         # Compile a list of URLs that don't require API key
         self.public_urls = getattr(settings, 'API_KEY_EXEMPT_URLS', [
@@ -26,22 +32,16 @@ class APIKeyMiddleware:
         ])
     
     def __call__(self, request):
-        # Skip API key check for public URLs
-        path = request.path_info
-        if any(path.startswith(url) for url in self.public_urls):
-            return self.get_response(request)
-        
-        # Check for API key in header
-        api_key = request.META.get('HTTP_X_API_KEY')
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         
-        # If API key is not provided, proceed to let DRF handle authentication
-        # This allows using either API key or JWT token
+        api_key = self._requested_key(request)
         if not api_key:
             return self.get_response(request)
         
         try:
             # Find and validate API key
-            key = APIKey.objects.get(key=api_key, is_active=True)
+            key = APIKey.objects.select_related('user').get(key=api_key, is_active=True)
             
             # Update last used timestamp
             key.last_used_at = timezone.now()
@@ -53,4 +53,31 @@ class APIKeyMiddleware:
         except APIKey.DoesNotExist:
             return JsonResponse({'detail': 'Invalid API key'}, status=401)
         
-        return self.get_response(request)
\ No newline at end of file
+        return self.get_response(request)
+    
+    async def __acall__(self, request):
+        api_key = self._requested_key(request)
+        if not api_key:
+            return await self.get_response(request)
+        
+        try:
+            key = await APIKey.objects.select_related('user').aget(key=api_key, is_active=True)
+        except APIKey.DoesNotExist:
+            return JsonResponse({'detail': 'Invalid API key'}, status=401)
+        
+        key.last_used_at = timezone.now()
+        await key.asave(update_fields=['last_used_at'])
+        request.user = key.user
+        
+        return await self.get_response(request)
+    
+    def _requested_key(self, request):
+        """The API key sent with a non-public request, if any"""
+        # Skip API key check for public URLs
+        path = request.path_info
+        if any(path.startswith(url) for url in self.public_urls):
+            return None
+        
+        # If API key is not provided, proceed to let DRF handle authentication
+        # This allows using either API key or JWT token
+        return request.META.get('HTTP_X_API_KEY')
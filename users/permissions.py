@@ -18,4 +18,14 @@ class APISecretPermission(permissions.BasePermission):
         if not api_secret or secret_header != api_secret:
             return False
         
-        return True
\ No newline at end of file
+        return True
+
+
+class IsSellerOrStaff(permissions.BasePermission):
+    """
+    Allows access to resellers (``User.is_seller``) and staff.
+    """
+    
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and (user.is_seller or user.is_staff))